@@ -0,0 +1,282 @@
+"""
+Per-company columnar snapshot of expenses for reports, dashboards and the AI
+assistant.
+
+Instead of re-fetching every expense as a JSON dict per request, each
+company's expenses are held as NumPy columns: bill date as int32 days since
+1970-01-01, amount as int64 cents, vendor and category as int32 codes into
+per-company name tables, currency as a code into a currency table. Totals
+are converted into the company's base currency on the fly, one vectorized
+rate lookup per currency (see fx.py). Snapshots are refreshed incrementally (only rows
+whose updated_at moved past the last refresh, re-reading REFRESH_OVERLAP_SECONDS
+behind it for transactions that committed late), rebuilt from scratch every
+FULL_REBUILD_SECONDS, and evicted least-recently-used once all snapshots
+together exceed ANALYTICS_CACHE_MB.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+import numpy as np
+from database import table
+import fx
+
+MEMORY_BUDGET_BYTES = int(os.getenv("ANALYTICS_CACHE_MB", "256")) * 1024 * 1024
+# Incremental refreshes are skipped if the last one was this recent
+REFRESH_INTERVAL_SECONDS = 2
+# Full rebuild picks up what updated_at can't show (vendor/category renames,
+# hard deletes, transactions that committed late)
+FULL_REBUILD_SECONDS = 900
+# updated_at is set when the write runs, not when it commits: a row committed
+# after a refresh passed its updated_at is picked up by re-reading this far
+# behind the watermark (apply overwrites rows by id, so re-reads are harmless)
+REFRESH_OVERLAP_SECONDS = 60
+PAGE_SIZE = 1000
+INITIAL_CAPACITY = 256
+
+SNAPSHOT_SELECT = "id, bill_date, amount, currency, status, deleted_at, updated_at, vendors(name), categories(name)"
+GROUP_BY = ("vendor", "category", "month")
+
+
+class Dictionary:
+    """Dictionary encoding: name <-> small int code."""
+
+    def __init__(self):
+        self.names = []
+        self.codes = {}
+
+    def encode(self, name):
+        name = name or ""
+        code = self.codes.get(name)
+        if code is None:
+            code = self.codes[name] = len(self.names)
+            self.names.append(name)
+        return code
+
+
+class CompanySnapshot:
+    def __init__(self, company_id: str):
+        self.company_id = company_id
+        self.size = 0
+        self.days = np.zeros(INITIAL_CAPACITY, dtype=np.int32)
+        self.cents = np.zeros(INITIAL_CAPACITY, dtype=np.int64)
+        self.vendor = np.zeros(INITIAL_CAPACITY, dtype=np.int32)
+        self.category = np.zeros(INITIAL_CAPACITY, dtype=np.int32)
+        self.currency = np.zeros(INITIAL_CAPACITY, dtype=np.int32)
+        # Not void and not soft-deleted
+        self.active = np.zeros(INITIAL_CAPACITY, dtype=np.bool_)
+        self.vendors = Dictionary()
+        self.categories = Dictionary()
+        # "" is the company's base currency (expenses.currency NULL)
+        self.currencies = Dictionary()
+        self.row_of = {}  # expense id -> row
+        self.ids = []  # row -> expense id
+        # (updated_at, id) of the newest row applied; the next refresh starts after it
+        self.watermark = None
+        self.built_at = time.monotonic()
+        self.refreshed_at = 0.0
+        self.lock = threading.Lock()
+
+    def _grow(self, needed: int):
+        capacity = len(self.days)
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        for name in ("days", "cents", "vendor", "category", "currency", "active"):
+            column = getattr(self, name)
+            grown = np.zeros(capacity, dtype=column.dtype)
+            grown[:self.size] = column[:self.size]
+            setattr(self, name, grown)
+
+    def apply(self, rows: list):
+        """Insert or overwrite rows (a page of SNAPSHOT_SELECT results, ordered by updated_at, id)."""
+        if not rows:
+            return
+        positions = np.empty(len(rows), dtype=np.int64)
+        next_row = self.size
+        for i, row in enumerate(rows):
+            position = self.row_of.get(row["id"])
+            if position is None:
+                position = self.row_of[row["id"]] = next_row
+                self.ids.append(row["id"])
+                next_row += 1
+            positions[i] = position
+        self._grow(next_row)
+        self.size = next_row
+
+        self.days[positions] = np.array([row["bill_date"] for row in rows], dtype="datetime64[D]").astype(np.int32)
+        self.cents[positions] = np.rint(np.array([float(row.get("amount") or 0) for row in rows]) * 100).astype(np.int64)
+        self.vendor[positions] = [self.vendors.encode((row.get("vendors") or {}).get("name") or "Unknown") for row in rows]
+        self.category[positions] = [
+            self.categories.encode((row.get("categories") or {}).get("name") or "Uncategorized") for row in rows
+        ]
+        self.currency[positions] = [self.currencies.encode(fx.normalize(row.get("currency"))) for row in rows]
+        self.active[positions] = [row.get("status") != "void" and not row.get("deleted_at") for row in rows]
+        self.watermark = (rows[-1]["updated_at"], rows[-1]["id"])
+
+    def nbytes(self):
+        arrays = sum(getattr(self, name).nbytes for name in ("days", "cents", "vendor", "category", "currency", "active"))
+        # Rough cost of the id map/list and name tables (keys, values and slots)
+        return arrays + len(self.row_of) * 128 + (len(self.vendors.names) + len(self.categories.names)) * 150
+
+    def mask(self, start: str = None, end: str = None):
+        """Active rows with start <= bill_date <= end (ISO dates, either optional)."""
+        mask = self.active[:self.size].copy()
+        days = self.days[:self.size]
+        if start:
+            mask &= days >= np.datetime64(start, "D").astype(np.int32)
+        if end:
+            mask &= days <= np.datetime64(end, "D").astype(np.int32)
+        return mask
+
+    def base_cents(self, mask: np.ndarray, base: str):
+        """
+        Amounts of the masked rows in `base` cents (float), and a mask (over
+        those rows) of the ones that could be converted.
+        """
+        cents = self.cents[:self.size][mask]
+        names = self.currencies.names
+        if all(not name or name == base for name in names):
+            return cents.astype(np.float64), np.ones(len(cents), dtype=np.bool_)
+        factors = fx.conversion_factors(
+            self.currency[:self.size][mask], names, self.days[:self.size][mask], base,
+        )
+        converted = ~np.isnan(factors)
+        return np.where(converted, cents * factors, 0.0), converted
+
+
+def _fetch_changes(company_id: str, watermark):
+    """
+    Pages of rows changed since REFRESH_OVERLAP_SECONDS before `watermark`,
+    keyset-paginated on (updated_at, id).
+    """
+    since = None
+    if watermark:
+        since = (datetime.fromisoformat(watermark[0]) - timedelta(seconds=REFRESH_OVERLAP_SECONDS)).isoformat()
+        watermark = None
+    while True:
+        query = (
+            table("expenses")
+            .select(SNAPSHOT_SELECT)
+            .eq("company_id", company_id)
+            .order("updated_at")
+            .order("id")
+            .limit(PAGE_SIZE)
+        )
+        if watermark:
+            updated_at, last_id = watermark
+            query = query.or_(f'updated_at.gt."{updated_at}",and(updated_at.eq."{updated_at}",id.gt.{last_id})')
+        elif since:
+            query = query.gte("updated_at", since)
+        rows = query.execute().data or []
+        if rows:
+            yield rows
+            watermark = (rows[-1]["updated_at"], rows[-1]["id"])
+        if len(rows) < PAGE_SIZE:
+            return
+
+
+_snapshots = OrderedDict()
+_lock = threading.Lock()
+
+
+def _evict():
+    """Drop least-recently-used snapshots until the rest fit the memory budget (always keep one)."""
+    with _lock:
+        total = sum(s.nbytes() for s in _snapshots.values())
+        while total > MEMORY_BUDGET_BYTES and len(_snapshots) > 1:
+            _, evicted = _snapshots.popitem(last=False)
+            total -= evicted.nbytes()
+
+
+def get_snapshot(company_id: str):
+    """The company's snapshot, brought up to date with the database."""
+    with _lock:
+        snapshot = _snapshots.get(company_id)
+        if snapshot is not None and time.monotonic() - snapshot.built_at > FULL_REBUILD_SECONDS:
+            snapshot = None
+        if snapshot is None:
+            snapshot = _snapshots[company_id] = CompanySnapshot(company_id)
+        _snapshots.move_to_end(company_id)
+
+    with snapshot.lock:
+        if time.monotonic() - snapshot.refreshed_at >= REFRESH_INTERVAL_SECONDS:
+            for rows in _fetch_changes(company_id, snapshot.watermark):
+                snapshot.apply(rows)
+            snapshot.refreshed_at = time.monotonic()
+    _evict()
+    return snapshot
+
+
+def invalidate(company_id: str):
+    with _lock:
+        _snapshots.pop(company_id, None)
+
+
+def cache_stats():
+    with _lock:
+        return {
+            "companies": len(_snapshots),
+            "rows": sum(s.size for s in _snapshots.values()),
+            "bytes": sum(s.nbytes() for s in _snapshots.values()),
+            "budget_bytes": MEMORY_BUDGET_BYTES,
+        }
+
+
+# -- queries --------------------------------------------------------------
+
+def summary(company_id: str, start: str = None, end: str = None):
+    """
+    Count, total and average of active expenses between start and end, in the
+    company's base currency. Expenses in a currency without FX rates are left
+    out and counted in unconverted_count.
+    """
+    base = fx.base_currency(company_id)
+    snapshot = get_snapshot(company_id)
+    with snapshot.lock:
+        cents, converted = snapshot.base_cents(snapshot.mask(start, end), base)
+    count = int(converted.sum())
+    total_cents = float(cents.sum())
+    return {
+        "expense_count": count,
+        "total_amount": round(total_cents / 100, 2),
+        "average_amount": round(total_cents / count / 100, 2) if count else 0,
+        "currency": base,
+        "unconverted_count": int(len(converted) - count),
+    }
+
+
+def group_totals(company_id: str, by: str = "vendor", start: str = None, end: str = None, limit: int = None):
+    """
+    Totals per vendor, category or month ('YYYY-MM') in the company's base
+    currency, largest first (months in date order).
+    """
+    if by not in GROUP_BY:
+        raise ValueError(f"by must be one of {', '.join(GROUP_BY)}")
+    base = fx.base_currency(company_id)
+    snapshot = get_snapshot(company_id)
+    with snapshot.lock:
+        mask = snapshot.mask(start, end)
+        cents, converted = snapshot.base_cents(mask, base)
+        if by == "month":
+            months = snapshot.days[:snapshot.size][mask].astype("datetime64[D]").astype("datetime64[M]").astype(np.int64)
+            keys, codes = np.unique(months, return_inverse=True)
+            names = [str(np.datetime64(int(m), "M")) for m in keys]
+        else:
+            codes = (snapshot.vendor if by == "vendor" else snapshot.category)[:snapshot.size][mask]
+            names = list((snapshot.vendors if by == "vendor" else snapshot.categories).names)
+
+    codes = codes[converted]
+    counts = np.bincount(codes, minlength=len(names))
+    totals = np.bincount(codes, weights=cents[converted], minlength=len(names))
+    present = np.nonzero(counts)[0]
+    if by != "month":
+        present = present[np.argsort(-totals[present], kind="stable")]
+    if limit:
+        present = present[:limit]
+    return [
+        {by: names[i], "expense_count": int(counts[i]), "total_amount": round(float(totals[i]) / 100, 2)}
+        for i in present
+    ]
@@ -0,0 +1,99 @@
+import atexit
+import queue
+import threading
+from database import table
+
+# Rows are flushed in a single bulk insert once this many are buffered,
+# or after FLUSH_INTERVAL_SECONDS, whichever comes first.
+BATCH_SIZE = 100
+FLUSH_INTERVAL_SECONDS = 2.0
+MAX_BUFFERED_ROWS = 10000
+
+
+class AuditLogWriter:
+    """
+    Buffered, background writer for expense_audit_log.
+    Request handlers only enqueue a row; a daemon thread batches the inserts,
+    so audit logging adds no database round-trip to the write path.
+    """
+
+    def __init__(self, batch_size: int = BATCH_SIZE, flush_interval: float = FLUSH_INTERVAL_SECONDS):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=MAX_BUFFERED_ROWS)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="audit-log-writer", daemon=True)
+                self._thread.start()
+
+    def write(self, row: dict):
+        self._ensure_started()
+        # Blocks only if the buffer is full, i.e. the database is far behind
+        self._queue.put(row)
+
+    def _drain(self, first=None):
+        batch = [first] if first is not None else []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _insert(self, batch):
+        if not batch:
+            return
+        try:
+            table("expense_audit_log").insert(batch).execute()
+        except Exception as e:
+            if len(batch) == 1:
+                print(f"Audit log row dropped: {e}")
+                return
+            # One bad row fails the whole insert: retry them one at a time so only it is lost
+            print(f"Audit log flush of {len(batch)} rows failed, retrying row by row: {e}")
+            for row in batch:
+                self._insert([row])
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            self._insert(self._drain(first))
+
+    def flush(self):
+        """Synchronously write everything still buffered."""
+        while not self._queue.empty():
+            self._insert(self._drain())
+
+    def close(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.flush_interval + 1)
+        self.flush()
+
+
+writer = AuditLogWriter()
+atexit.register(writer.close)
+
+
+def log_expense_change(expense_id: str, company_id: str, action: str, changed_by: str = None,
+                       old_values: dict = None, new_values: dict = None, reason: str = None):
+    """Queue an expense_audit_log row. Returns immediately."""
+    writer.write({
+        "expense_id": expense_id,
+        "company_id": company_id,
+        "action": action,
+        "changed_by": changed_by,
+        "old_values": old_values,
+        "new_values": new_values,
+        "reason": reason,
+    })
@@ -0,0 +1,90 @@
+"""
+Copy legacy `bills` rows into `expenses` in resumable batches.
+
+Bills are streamed in primary-key order using keyset pagination, and each
+batch is upserted on expenses.source_bill_id, so re-running is harmless.
+A run stopped by --max-batches returns a cursor (the last bill id it read)
+to continue from with --after; the backfill_bills job stores it in its
+result. A full pass ends with no cursor, and the next run starts over from
+the first bill, so bills added since (at any id) are picked up too.
+
+Usage:
+    python backfill_expenses.py [--batch-size 500] [--max-batches N] [--after BILL_ID]
+"""
+import argparse
+from database import table
+
+DEFAULT_BATCH_SIZE = 500
+
+# bills.status -> expenses.status ('partial' has no equivalent in expenses)
+STATUS_MAP = {
+    "draft": "draft",
+    "paid": "paid",
+    "partial": "approved",
+    "void": "void",
+}
+
+
+def bill_to_expense(bill: dict):
+    return {
+        "company_id": bill["company_id"],
+        "vendor_id": bill.get("vendor_id"),
+        "category_id": bill.get("category_id"),
+        "bill_number": bill.get("bill_number"),
+        "bill_date": bill["bill_date"],
+        "amount": bill.get("total_amount") or 0,
+        "memo": bill.get("memo"),
+        "status": STATUS_MAP.get(bill.get("status"), "draft"),
+        "receipt_url": bill.get("receipt_url"),
+        "receipt_file_name": bill.get("receipt_file_name"),
+        "payment_method_id": bill.get("payment_method_id"),
+        "created_at": bill.get("created_at"),
+        "source_bill_id": bill["id"],
+    }
+
+
+def iter_bill_batches(after_id: str = None, batch_size: int = DEFAULT_BATCH_SIZE):
+    """Yield lists of bills with id > after_id, in id order, batch_size at a time."""
+    while True:
+        query = table("bills").select("*").order("id").limit(batch_size)
+        if after_id:
+            query = query.gt("id", after_id)
+        batch = query.execute().data
+        if not batch:
+            return
+        yield batch
+        after_id = batch[-1]["id"]
+
+
+def backfill(batch_size: int = DEFAULT_BATCH_SIZE, max_batches: int = None, after_id: str = None):
+    """
+    Copy bills with id > after_id into expenses.
+    Returns {"copied", "cursor"}; cursor is None once every bill has been read.
+    """
+    print(f"Resuming after bill {after_id}" if after_id else "Starting bills -> expenses backfill")
+
+    copied = 0
+    cursor = None
+    for batch_number, batch in enumerate(iter_bill_batches(after_id, batch_size), start=1):
+        rows = [bill_to_expense(bill) for bill in batch]
+        table("expenses").upsert(rows, on_conflict="source_bill_id", ignore_duplicates=True).execute()
+        copied += len(rows)
+        print(f"Batch {batch_number}: {len(rows)} bills copied (through {batch[-1]['id']})")
+        if max_batches and batch_number >= max_batches:
+            cursor = batch[-1]["id"]
+            break
+
+    if cursor:
+        print(f"Stopped after {copied} bills; continue with --after {cursor}")
+    else:
+        print(f"Backfill finished: {copied} bills copied")
+    return {"copied": copied, "cursor": cursor}
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Backfill legacy bills into expenses.")
+    arg_parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    arg_parser.add_argument("--max-batches", type=int, default=None)
+    arg_parser.add_argument("--after", default=None, help="bill id to continue after (printed by a stopped run)")
+    args = arg_parser.parse_args()
+    backfill(batch_size=args.batch_size, max_batches=args.max_batches, after_id=args.after)
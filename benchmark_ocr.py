@@ -0,0 +1,93 @@
+"""
+Compare OCR latency, memory and field accuracy with and without image
+preprocessing, over a directory of fixture receipts.
+
+The directory holds receipt images (.jpg/.jpeg/.png) and optionally an
+expected.json mapping file names to the fields extract_fields should find:
+
+    {"staples.jpg": {"vendor": "Staples", "date": "03/02/2025", "total": "45.99"}}
+
+Usage:
+    python benchmark_ocr.py fixtures/receipts
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+FIELDS = ("vendor", "date", "total")
+
+
+def run_mode(directory: str, preprocess: bool):
+    """Run OCR over every fixture in this process and return per-file results."""
+    from smart_parser import extract_fields, extract_from_image, get_ocr_reader
+
+    get_ocr_reader()  # load the model outside the timed section
+    results = {}
+    for name in sorted(os.listdir(directory)):
+        if not name.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        start = time.perf_counter()
+        text = extract_from_image(os.path.join(directory, name), preprocess=preprocess)
+        results[name] = {
+            "seconds": time.perf_counter() - start,
+            "fields": extract_fields(text),
+        }
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        rss //= 1024  # bytes on macOS, KiB elsewhere
+    return {"files": results, "rss_mb": rss / 1024}
+
+
+def field_accuracy(files: dict, expected: dict):
+    checked = correct = 0
+    for name, want in expected.items():
+        got = files.get(name, {}).get("fields", {})
+        for field in FIELDS:
+            if field in want:
+                checked += 1
+                correct += (got.get(field) or "").strip().lower() == str(want[field]).strip().lower()
+    return correct / checked if checked else None
+
+
+def measure(directory: str, preprocess: bool):
+    # Separate interpreter per mode so peak memory isn't shared between them
+    result = subprocess.run(
+        [sys.executable, __file__, directory, "--mode", "preprocessed" if preprocess else "raw"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="OCR preprocessing benchmark.")
+    arg_parser.add_argument("directory")
+    arg_parser.add_argument("--mode", choices=["raw", "preprocessed"], help=argparse.SUPPRESS)
+    args = arg_parser.parse_args()
+
+    if args.mode:
+        print(json.dumps(run_mode(args.directory, args.mode == "preprocessed")))
+        sys.exit(0)
+
+    expected_path = os.path.join(args.directory, "expected.json")
+    expected = {}
+    if os.path.exists(expected_path):
+        with open(expected_path) as f:
+            expected = json.load(f)
+
+    print(f"{'Mode':<14} {'Files':>5} {'Total (s)':>10} {'Mean (s)':>9} {'Max RSS (MB)':>13} {'Field accuracy':>15}")
+    for preprocess in (False, True):
+        report = measure(args.directory, preprocess)
+        timings = [r["seconds"] for r in report["files"].values()]
+        accuracy = field_accuracy(report["files"], expected)
+        print(
+            f"{'preprocessed' if preprocess else 'raw':<14} {len(timings):>5} {sum(timings):>10.2f} "
+            f"{(sum(timings) / len(timings) if timings else 0):>9.2f} {report['rss_mb']:>13.1f} "
+            f"{(f'{accuracy:.0%}' if accuracy is not None else 'n/a'):>15}"
+        )
@@ -0,0 +1,188 @@
+import threading
+import time
+from contextvars import ContextVar
+from database import table
+
+# How long cross-request entries stay valid. Kept short so other workers'
+# writes become visible quickly even without explicit invalidation.
+USER_TTL_SECONDS = 60
+COMPANY_TTL_SECONDS = 300
+
+
+class TTLCache:
+    """Small thread-safe dict cache whose entries expire after `ttl` seconds."""
+
+    def __init__(self, ttl: int):
+        self.ttl = ttl
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+_users_by_id = TTLCache(USER_TTL_SECONDS)
+_user_ids_by_email = TTLCache(USER_TTL_SECONDS)
+_companies = TTLCache(COMPANY_TTL_SECONDS)
+
+# Per-request memo so the same entity is never fetched twice in one request.
+# Set up by the middleware in main.py; None outside of a request.
+_request_memo: ContextVar = ContextVar("request_memo", default=None)
+
+
+def begin_request():
+    """Start a fresh request-scoped memo. Returns a token for end_request()."""
+    return _request_memo.set({})
+
+
+def end_request(token):
+    _request_memo.reset(token)
+
+
+def _memoized(key, loader):
+    memo = _request_memo.get()
+    if memo is not None and key in memo:
+        return memo[key]
+    value = loader()
+    if memo is not None:
+        memo[key] = value
+    return value
+
+
+def _remember_user(user: dict):
+    _users_by_id.set(user["id"], user)
+    if user.get("email"):
+        _user_ids_by_email.set(user["email"], user["id"])
+
+
+def get_user(user_id: str):
+    """Return the users row for `user_id`, or None if it doesn't exist."""
+    if not user_id:
+        return None
+
+    def load():
+        cached = _users_by_id.get(user_id)
+        if cached is not None:
+            return cached
+        response = table("users").select("*").eq("id", user_id).limit(1).execute()
+        if not response.data:
+            return None
+        _remember_user(response.data[0])
+        return response.data[0]
+
+    return _memoized(("user", user_id), load)
+
+
+def get_user_by_email(email: str):
+    """Return the users row for `email`, or None if it doesn't exist."""
+    if not email:
+        return None
+
+    def load():
+        user_id = _user_ids_by_email.get(email)
+        if user_id is not None:
+            cached = _users_by_id.get(user_id)
+            if cached is not None:
+                return cached
+        response = table("users").select("*").eq("email", email).limit(1).execute()
+        if not response.data:
+            return None
+        _remember_user(response.data[0])
+        return response.data[0]
+
+    return _memoized(("user_email", email), load)
+
+
+def get_user_company_id(user_id: str):
+    """Return the company_id a user belongs to, or None."""
+    user = get_user(user_id)
+    return user.get("company_id") if user else None
+
+
+def get_company(company_id: str):
+    """Return the company row (with its users joined), or None if missing."""
+    if not company_id:
+        return None
+
+    def load():
+        cached = _companies.get(company_id)
+        if cached is not None:
+            return cached
+        response = (
+            table("companies")
+            .select("*, users(full_name, email, role, user_type)")
+            .eq("id", company_id)
+            .execute()
+        )
+        if not response.data:
+            return None
+        _companies.set(company_id, response.data[0])
+        return response.data[0]
+
+    return _memoized(("company", company_id), load)
+
+
+def _forget_memo(*keys):
+    memo = _request_memo.get()
+    if memo is not None:
+        for key in keys:
+            memo.pop(key, None)
+
+
+def invalidate_user(user_id: str = None, email: str = None, company_id: str = None):
+    """
+    Drop a user from the caches. Call after any write to the users table,
+    passing the company the user belonged to before the write (its cached
+    row embeds the user).
+    """
+    invalidate_company(company_id)
+    cached = _users_by_id.get(user_id) if user_id else None
+    if cached is not None:
+        if cached.get("company_id") != company_id:
+            invalidate_company(cached.get("company_id"))
+        email = email or cached.get("email")
+    if email:
+        user_id = user_id or _user_ids_by_email.get(email)
+        _user_ids_by_email.delete(email)
+        _forget_memo(("user_email", email))
+    if user_id:
+        _users_by_id.delete(user_id)
+        _forget_memo(("user", user_id))
+
+
+def invalidate_company(company_id: str = None):
+    """Drop a company from the cache. Call after any write to the companies table."""
+    if not company_id:
+        return
+    _companies.delete(company_id)
+    _forget_memo(("company", company_id))
+
+
+def clear_users():
+    """Drop every cached user, e.g. after a company delete nulls out company_id."""
+    _users_by_id.clear()
+    _user_ids_by_email.clear()
+    memo = _request_memo.get()
+    if memo is not None:
+        for key in [k for k in memo if k[0] in ("user", "user_email")]:
+            del memo[key]
@@ -0,0 +1,30 @@
+"""
+Response compression: Brotli for clients that accept it, gzip otherwise.
+
+brotli-asgi is used when installed, falling back to Starlette's gzip-only
+middleware. Stored receipt files are skipped: they are already compressed
+images/PDFs and are served with byte ranges, which compression would break.
+"""
+import os
+import re
+from starlette.middleware.gzip import GZipMiddleware
+
+MINIMUM_SIZE = int(os.getenv("COMPRESSION_MIN_BYTES", "1000"))
+BROTLI_QUALITY = 4  # well past gzip's ratio on JSON while still cheap per request
+EXCLUDED_PATHS = re.compile(r"^/receipts/[^/]+/(file|thumbnail|preview)$")
+
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size: int = MINIMUM_SIZE):
+        self.app = app
+        try:
+            from brotli_asgi import BrotliMiddleware
+            self.compressed = BrotliMiddleware(app, quality=BROTLI_QUALITY, minimum_size=minimum_size, gzip_fallback=True)
+        except ImportError:
+            self.compressed = GZipMiddleware(app, minimum_size=minimum_size)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and not EXCLUDED_PATHS.match(scope["path"]):
+            await self.compressed(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
@@ -17,4 +17,8 @@ supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
 def table(name: str):
     return supabase.table(name)
 
+# Call a Postgres function defined in database/schema.sql
+def rpc(name: str, params: dict = None):
+    return supabase.rpc(name, params or {})
+
 print("Supabase connection initialized successfully (using service_role key).")
@@ -15,6 +15,11 @@
 -- Enable UUID extension
 CREATE EXTENSION IF NOT EXISTS "uuid-ossp";
 
+-- Trigram similarity (fuzzy vendor search) and btree_gin (company-scoped
+-- full-text index)
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE EXTENSION IF NOT EXISTS btree_gin;
+
 -- ============================================================================
 -- CORE TABLES
 -- ============================================================================
@@ -33,6 +38,14 @@ CREATE TABLE IF NOT EXISTS public.companies (
   updated_at TIMESTAMP DEFAULT NOW()
 );
 
+-- Normalized company name used for deduplication (case/whitespace-insensitive)
+ALTER TABLE public.companies
+  ADD COLUMN IF NOT EXISTS name_normalized TEXT GENERATED ALWAYS AS (lower(btrim(name))) STORED;
+
+-- created_at is the GET /companies/ keyset cursor, so it can't be NULL
+UPDATE public.companies SET created_at = NOW() WHERE created_at IS NULL;
+ALTER TABLE public.companies ALTER COLUMN created_at SET NOT NULL;
+
 -- Users Table (linked to Supabase Auth)
 CREATE TABLE IF NOT EXISTS public.users (
   id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
@@ -149,6 +162,10 @@ CREATE TABLE IF NOT EXISTS public.bills (
   updated_at TIMESTAMP DEFAULT NOW()
 );
 
+-- Category link for bills (drives budget actuals)
+ALTER TABLE public.bills
+  ADD COLUMN IF NOT EXISTS category_id UUID REFERENCES public.categories(id) ON DELETE SET NULL;
+
 -- Expenses Table (Enhanced - recommended for future use)
 CREATE TABLE IF NOT EXISTS public.expenses (
   id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
@@ -169,6 +186,51 @@ CREATE TABLE IF NOT EXISTS public.expenses (
   deleted_at TIMESTAMP
 );
 
+-- Columns carried over from bills (bill_number) and for the bills -> expenses
+-- backfill (source_bill_id makes it idempotent and resumable)
+ALTER TABLE public.expenses
+  ADD COLUMN IF NOT EXISTS bill_number TEXT,
+  ADD COLUMN IF NOT EXISTS source_bill_id UUID UNIQUE;
+
+-- Receipt text fingerprint used for duplicate detection (see duplicates.py)
+ALTER TABLE public.expenses
+  ADD COLUMN IF NOT EXISTS receipt_fingerprint TEXT;
+
+-- Per-company counter behind manual expense bill numbers (see next_bill_number)
+CREATE TABLE IF NOT EXISTS public.bill_number_sequences (
+  company_id UUID PRIMARY KEY REFERENCES public.companies(id) ON DELETE CASCADE,
+  last_value BIGINT NOT NULL DEFAULT 0,
+  updated_at TIMESTAMP DEFAULT NOW()
+);
+
+-- Receipts: uploaded files kept in content-addressed storage (see
+-- receipt_store.py) with their extracted text, so a re-review needs no
+-- re-upload or re-OCR
+CREATE TABLE IF NOT EXISTS public.receipts (
+  id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+  company_id UUID REFERENCES public.companies(id) ON DELETE CASCADE,
+  sha256 TEXT NOT NULL,
+  storage_key TEXT NOT NULL,
+  file_name TEXT,
+  content_type TEXT,
+  size_bytes BIGINT,
+  extracted_text TEXT,
+  parsed_fields JSONB,
+  receipt_fingerprint TEXT,
+  thumbnail_key TEXT,
+  preview_key TEXT,
+  created_at TIMESTAMP DEFAULT NOW(),
+  updated_at TIMESTAMP DEFAULT NOW()
+);
+
+ALTER TABLE public.expenses
+  ADD COLUMN IF NOT EXISTS receipt_id UUID REFERENCES public.receipts(id) ON DELETE SET NULL;
+
+-- Full-text search document: vendor name and bill number (weight A),
+-- memo and category (B), receipt OCR text (C). Maintained by triggers.
+ALTER TABLE public.expenses
+  ADD COLUMN IF NOT EXISTS search_document TSVECTOR;
+
 -- Expense Audit Log
 CREATE TABLE IF NOT EXISTS public.expense_audit_log (
   id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
@@ -226,6 +288,54 @@ CREATE TABLE IF NOT EXISTS public.journal_lines (
   updated_at TIMESTAMP DEFAULT NOW()
 );
 
+-- Ledger account mappings (see ledger.py): expenses debit their category's
+-- account and credit the payment method's account
+ALTER TABLE public.categories
+  ADD COLUMN IF NOT EXISTS account_id UUID REFERENCES public.chart_of_accounts(id) ON DELETE SET NULL;
+ALTER TABLE public.payment_methods
+  ADD COLUMN IF NOT EXISTS account_id UUID REFERENCES public.chart_of_accounts(id) ON DELETE SET NULL;
+
+-- The expense a journal entry was posted for (voided with the expense)
+ALTER TABLE public.journal_entries
+  ADD COLUMN IF NOT EXISTS expense_id UUID REFERENCES public.expenses(id) ON DELETE SET NULL;
+
+-- Account Balances: per-account monthly totals of posted journal lines plus
+-- the running balance (debits - credits) at the end of each month.
+-- Maintained by triggers on journal_lines / journal_entries.
+CREATE TABLE IF NOT EXISTS public.account_balances (
+  id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+  company_id UUID NOT NULL REFERENCES public.companies(id) ON DELETE CASCADE,
+  account_id UUID NOT NULL REFERENCES public.chart_of_accounts(id) ON DELETE CASCADE,
+  period_start DATE NOT NULL,
+  debit_total NUMERIC(15, 2) NOT NULL DEFAULT 0,
+  credit_total NUMERIC(15, 2) NOT NULL DEFAULT 0,
+  closing_balance NUMERIC(15, 2) NOT NULL DEFAULT 0,
+  created_at TIMESTAMP DEFAULT NOW(),
+  updated_at TIMESTAMP DEFAULT NOW(),
+  UNIQUE(account_id, period_start)
+);
+
+-- Base currency: reports, balances and journal postings are in this currency
+ALTER TABLE public.companies
+  ADD COLUMN IF NOT EXISTS base_currency TEXT DEFAULT 'USD';
+
+-- Currency an expense was paid in (ISO 4217); NULL means the company's base
+-- currency. amount stays in this currency; conversion happens on read (fx.py).
+ALTER TABLE public.expenses
+  ADD COLUMN IF NOT EXISTS currency TEXT;
+
+-- FX Rates: value of one unit of `currency` in USD on rate_date. A date
+-- without a row uses the latest earlier rate (see fx.py).
+CREATE TABLE IF NOT EXISTS public.fx_rates (
+  id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+  currency TEXT NOT NULL,
+  rate_date DATE NOT NULL,
+  usd_rate NUMERIC(20, 10) NOT NULL CHECK (usd_rate > 0),
+  source TEXT,
+  created_at TIMESTAMP DEFAULT NOW(),
+  UNIQUE(currency, rate_date)
+);
+
 -- ============================================================================
 -- INVOICES & PAYMENTS
 -- ============================================================================
@@ -277,7 +387,8 @@ CREATE TABLE IF NOT EXISTS public.budgets (
   actual_amount NUMERIC(15, 2) DEFAULT 0,
   variance NUMERIC(15, 2) GENERATED ALWAYS AS (budget_amount - actual_amount) STORED,
   created_at TIMESTAMP DEFAULT NOW(),
-  updated_at TIMESTAMP DEFAULT NOW()
+  updated_at TIMESTAMP DEFAULT NOW(),
+  UNIQUE(category_id, period)
 );
 
 -- ============================================================================
@@ -349,6 +460,55 @@ CREATE TABLE IF NOT EXISTS public.migrations_imports (
   updated_at TIMESTAMP DEFAULT NOW()
 );
 
+-- Import file, progress and resume checkpoint (see importer.py)
+ALTER TABLE public.migrations_imports
+  ADD COLUMN IF NOT EXISTS file_path TEXT,
+  ADD COLUMN IF NOT EXISTS file_format TEXT CHECK (file_format IN ('iif', 'csv', 'xml')),
+  ADD COLUMN IF NOT EXISTS checkpoint_row INTEGER DEFAULT 0,
+  ADD COLUMN IF NOT EXISTS rows_per_second NUMERIC(12, 1),
+  ADD COLUMN IF NOT EXISTS error TEXT;
+ALTER TABLE public.migrations_imports DROP CONSTRAINT IF EXISTS migrations_imports_status_check;
+ALTER TABLE public.migrations_imports ADD CONSTRAINT migrations_imports_status_check
+  CHECK (status IN ('pending', 'running', 'completed', 'failed'));
+
+-- Rows written by an import carry its id and source record number, so an
+-- interrupted chunk can be removed and rewritten on resume
+ALTER TABLE public.journal_entries
+  ADD COLUMN IF NOT EXISTS import_id UUID REFERENCES public.migrations_imports(id) ON DELETE SET NULL,
+  ADD COLUMN IF NOT EXISTS import_row INTEGER;
+ALTER TABLE public.expenses
+  ADD COLUMN IF NOT EXISTS import_id UUID REFERENCES public.migrations_imports(id) ON DELETE SET NULL,
+  ADD COLUMN IF NOT EXISTS import_row INTEGER;
+
+-- Background Jobs (one row per run; see scheduler.py)
+CREATE TABLE IF NOT EXISTS public.jobs (
+  id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+  job_name TEXT NOT NULL,
+  company_id UUID REFERENCES public.companies(id) ON DELETE CASCADE,
+  params JSONB DEFAULT '{}',
+  status TEXT DEFAULT 'pending' CHECK (status IN ('pending', 'running', 'completed', 'failed')),
+  attempts INTEGER DEFAULT 0,
+  max_attempts INTEGER DEFAULT 3,
+  run_after TIMESTAMP DEFAULT NOW(),
+  started_at TIMESTAMP,
+  finished_at TIMESTAMP,
+  duration_ms INTEGER,
+  last_error TEXT,
+  result JSONB,
+  created_at TIMESTAMP DEFAULT NOW(),
+  updated_at TIMESTAMP DEFAULT NOW()
+);
+
+-- Last sign of life from the worker running a job; rows whose heartbeat
+-- stops are put back in the queue
+ALTER TABLE public.jobs
+  ADD COLUMN IF NOT EXISTS heartbeat_at TIMESTAMP;
+
+-- When the backfill_ai_suggestions job last tried to categorize an expense,
+-- so expenses it could not categorize are not sent to the AI again
+ALTER TABLE public.expenses
+  ADD COLUMN IF NOT EXISTS ai_category_attempted_at TIMESTAMP;
+
 -- ============================================================================
 -- INDEXES FOR PERFORMANCE
 -- ============================================================================
@@ -356,24 +516,68 @@ CREATE TABLE IF NOT EXISTS public.migrations_imports (
 -- Companies
 CREATE INDEX IF NOT EXISTS idx_companies_created_by ON public.companies(created_by);
 
+-- Keyset order of the GET /companies/ listing
+DROP INDEX IF EXISTS public.idx_companies_created_at;
+CREATE INDEX IF NOT EXISTS idx_companies_created_at_id ON public.companies(created_at, id);
+CREATE INDEX IF NOT EXISTS idx_companies_name_normalized ON public.companies(name_normalized, created_at);
+
+-- Unique company names (the API creates companies with ON CONFLICT on it).
+-- Legacy duplicates are renamed first: the oldest company keeps the name,
+-- later ones get their id appended.
+DO $$
+BEGIN
+  IF NOT EXISTS (
+    SELECT 1 FROM pg_constraint WHERE conname = 'companies_name_normalized_key'
+  ) THEN
+    UPDATE public.companies c
+    SET name = btrim(c.name) || ' (' || c.id || ')'
+    FROM (
+      SELECT id, row_number() OVER (PARTITION BY name_normalized ORDER BY created_at, id) AS rn
+      FROM public.companies
+    ) d
+    WHERE d.id = c.id AND d.rn > 1;
+
+    ALTER TABLE public.companies
+      ADD CONSTRAINT companies_name_normalized_key UNIQUE (name_normalized);
+  END IF;
+END $$;
+
+-- The listing reads companies directly now that names are unique
+DROP VIEW IF EXISTS public.companies_unique;
+
 -- Users
 CREATE INDEX IF NOT EXISTS idx_users_company_id ON public.users(company_id);
 CREATE INDEX IF NOT EXISTS idx_users_email ON public.users(email);
+-- Newest updated_at for listing ETags (see http_cache.py)
+CREATE INDEX IF NOT EXISTS idx_users_updated_at ON public.users(updated_at);
+CREATE INDEX IF NOT EXISTS idx_companies_updated_at ON public.companies(updated_at);
 
 -- Vendors
 CREATE INDEX IF NOT EXISTS idx_vendors_company_id ON public.vendors(company_id);
 CREATE INDEX IF NOT EXISTS idx_vendors_is_active ON public.vendors(is_active);
+CREATE INDEX IF NOT EXISTS idx_vendors_company_updated ON public.vendors(company_id, updated_at);
+
+-- Migrations/Imports
+CREATE INDEX IF NOT EXISTS idx_migrations_imports_company_id ON public.migrations_imports(company_id);
 
 -- Categories
 CREATE INDEX IF NOT EXISTS idx_categories_company_id ON public.categories(company_id);
 CREATE INDEX IF NOT EXISTS idx_categories_is_active ON public.categories(is_active);
 CREATE INDEX IF NOT EXISTS idx_categories_parent_id ON public.categories(parent_category_id);
+CREATE INDEX IF NOT EXISTS idx_categories_company_updated ON public.categories(company_id, updated_at);
 
 -- Bills
 CREATE INDEX IF NOT EXISTS idx_bills_company_id ON public.bills(company_id);
 CREATE INDEX IF NOT EXISTS idx_bills_vendor_id ON public.bills(vendor_id);
 CREATE INDEX IF NOT EXISTS idx_bills_status ON public.bills(status);
 CREATE INDEX IF NOT EXISTS idx_bills_bill_date ON public.bills(bill_date);
+CREATE INDEX IF NOT EXISTS idx_bills_category_date ON public.bills(category_id, bill_date DESC);
+
+-- Budgets
+CREATE INDEX IF NOT EXISTS idx_budgets_company_period ON public.budgets(company_id, period);
+-- Also declared on the table; added here for databases created before it was.
+-- apply_budget_delta upserts ON CONFLICT (category_id, period).
+CREATE UNIQUE INDEX IF NOT EXISTS uq_budgets_category_period ON public.budgets(category_id, period);
 
 -- Expenses
 CREATE INDEX IF NOT EXISTS idx_expenses_company_id ON public.expenses(company_id);
@@ -382,6 +586,18 @@ CREATE INDEX IF NOT EXISTS idx_expenses_category_id ON public.expenses(category_
 CREATE INDEX IF NOT EXISTS idx_expenses_status ON public.expenses(status);
 CREATE INDEX IF NOT EXISTS idx_expenses_bill_date ON public.expenses(bill_date);
 CREATE INDEX IF NOT EXISTS idx_expenses_created_by ON public.expenses(created_by);
+CREATE INDEX IF NOT EXISTS idx_expenses_category_date ON public.expenses(category_id, bill_date DESC);
+CREATE INDEX IF NOT EXISTS idx_expenses_company_fingerprint ON public.expenses(company_id, receipt_fingerprint);
+CREATE INDEX IF NOT EXISTS idx_expenses_import ON public.expenses(import_id, import_row);
+CREATE INDEX IF NOT EXISTS idx_expenses_company_updated ON public.expenses(company_id, updated_at, id);
+
+-- Receipts
+CREATE INDEX IF NOT EXISTS idx_receipts_sha256 ON public.receipts(sha256);
+CREATE INDEX IF NOT EXISTS idx_receipts_company_created ON public.receipts(company_id, created_at DESC);
+
+-- Search
+CREATE INDEX IF NOT EXISTS idx_expenses_search ON public.expenses USING GIN (company_id, search_document);
+CREATE INDEX IF NOT EXISTS idx_vendors_name_trgm ON public.vendors USING GIN (name gin_trgm_ops);
 
 -- Expense Audit Log
 CREATE INDEX IF NOT EXISTS idx_expense_audit_expense_id ON public.expense_audit_log(expense_id);
@@ -391,15 +607,33 @@ CREATE INDEX IF NOT EXISTS idx_expense_audit_created_at ON public.expense_audit_
 -- Journal Entries
 CREATE INDEX IF NOT EXISTS idx_journal_entries_company_id ON public.journal_entries(company_id);
 CREATE INDEX IF NOT EXISTS idx_journal_entries_entry_date ON public.journal_entries(entry_date);
+CREATE INDEX IF NOT EXISTS idx_journal_entries_import ON public.journal_entries(import_id, import_row);
 
 -- Journal Lines
 CREATE INDEX IF NOT EXISTS idx_journal_lines_journal_id ON public.journal_lines(journal_id);
 CREATE INDEX IF NOT EXISTS idx_journal_lines_account_id ON public.journal_lines(account_id);
 
+-- Account Balances
+CREATE INDEX IF NOT EXISTS idx_account_balances_company_period ON public.account_balances(company_id, period_start);
+CREATE INDEX IF NOT EXISTS idx_journal_entries_expense_id ON public.journal_entries(expense_id);
+
 -- Payment Methods
 CREATE INDEX IF NOT EXISTS idx_payment_methods_company_id ON public.payment_methods(company_id);
 CREATE INDEX IF NOT EXISTS idx_payment_methods_is_active ON public.payment_methods(is_active);
 
+-- Reports Cache (one row per report and period, refreshed by upsert)
+CREATE UNIQUE INDEX IF NOT EXISTS uq_reports_cache_key
+  ON public.reports_cache(company_id, report_name, period_start);
+
+-- Jobs
+CREATE INDEX IF NOT EXISTS idx_jobs_status_run_after ON public.jobs(status, run_after);
+CREATE INDEX IF NOT EXISTS idx_jobs_name_created ON public.jobs(job_name, created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_expenses_ai_category_pending ON public.expenses(company_id)
+  WHERE category_id IS NULL AND ai_category_attempted_at IS NULL;
+-- At most one queued/running run of each global (non company-scoped) job
+CREATE UNIQUE INDEX IF NOT EXISTS uq_jobs_active_global ON public.jobs(job_name)
+  WHERE status IN ('pending', 'running') AND company_id IS NULL;
+
 -- ============================================================================
 -- ROW LEVEL SECURITY (RLS) POLICIES
 -- ============================================================================
@@ -519,10 +753,500 @@ DROP TRIGGER IF EXISTS update_expenses_updated_at ON public.expenses;
 CREATE TRIGGER update_expenses_updated_at BEFORE UPDATE ON public.expenses
   FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
 
+DROP TRIGGER IF EXISTS update_receipts_updated_at ON public.receipts;
+CREATE TRIGGER update_receipts_updated_at BEFORE UPDATE ON public.receipts
+  FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
+
 DROP TRIGGER IF EXISTS update_payment_methods_updated_at ON public.payment_methods;
 CREATE TRIGGER update_payment_methods_updated_at BEFORE UPDATE ON public.payment_methods
   FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
 
+DROP TRIGGER IF EXISTS update_budgets_updated_at ON public.budgets;
+CREATE TRIGGER update_budgets_updated_at BEFORE UPDATE ON public.budgets
+  FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
+
+-- Add (or subtract) an amount from a category's monthly budget actuals.
+-- Budget periods are calendar months ('YYYY-MM'); the row is created on
+-- first use with the category's current budget_amount.
+CREATE OR REPLACE FUNCTION apply_budget_delta(
+  p_company_id UUID, p_category_id UUID, p_date DATE, p_delta NUMERIC
+)
+RETURNS VOID AS $$
+BEGIN
+  IF p_category_id IS NULL OR p_delta = 0 THEN
+    RETURN;
+  END IF;
+  INSERT INTO public.budgets (company_id, category_id, period, budget_amount, actual_amount)
+  SELECT p_company_id, p_category_id, to_char(p_date, 'YYYY-MM'),
+         COALESCE(c.budget_amount, 0), p_delta
+  FROM public.categories c
+  WHERE c.id = p_category_id
+  ON CONFLICT (category_id, period)
+  DO UPDATE SET actual_amount = public.budgets.actual_amount + EXCLUDED.actual_amount;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Keep budgets.actual_amount in step with expenses: remove the old row's
+-- contribution and add the new one, so each write costs O(1). Void and
+-- soft-deleted expenses contribute nothing. Rows backfilled from bills
+-- (source_bill_id set) were already counted when the bill was written, so
+-- their insert is skipped; later edits to them adjust the budget normally.
+CREATE OR REPLACE FUNCTION track_expense_budget_actuals()
+RETURNS TRIGGER AS $$
+BEGIN
+  IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.status <> 'void' AND OLD.deleted_at IS NULL THEN
+    PERFORM apply_budget_delta(OLD.company_id, OLD.category_id, OLD.bill_date, -COALESCE(OLD.amount, 0));
+  END IF;
+  IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.status <> 'void' AND NEW.deleted_at IS NULL
+     AND NOT (TG_OP = 'INSERT' AND NEW.source_bill_id IS NOT NULL) THEN
+    PERFORM apply_budget_delta(NEW.company_id, NEW.category_id, NEW.bill_date, COALESCE(NEW.amount, 0));
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Bills are legacy (read only by the backfill); actuals now follow expenses
+DROP TRIGGER IF EXISTS track_bills_budget_actuals ON public.bills;
+DROP FUNCTION IF EXISTS track_bill_budget_actuals();
+
+DROP TRIGGER IF EXISTS track_expenses_budget_actuals ON public.expenses;
+CREATE TRIGGER track_expenses_budget_actuals
+  AFTER INSERT OR DELETE OR UPDATE OF status, category_id, bill_date, amount, deleted_at ON public.expenses
+  FOR EACH ROW EXECUTE FUNCTION track_expense_budget_actuals();
+
+-- Full recomputation of budget actuals from expenses (all companies when
+-- p_company_id is NULL). Used by the recompute_budget_actuals job to repair
+-- any drift from the incremental trigger. Returns the number of budgets set.
+CREATE OR REPLACE FUNCTION recompute_budget_actuals(p_company_id UUID DEFAULT NULL)
+RETURNS INTEGER AS $$
+DECLARE
+  affected INTEGER;
+BEGIN
+  UPDATE public.budgets
+  SET actual_amount = 0
+  WHERE p_company_id IS NULL OR company_id = p_company_id;
+
+  INSERT INTO public.budgets (company_id, category_id, period, budget_amount, actual_amount)
+  SELECT e.company_id, e.category_id, to_char(e.bill_date, 'YYYY-MM'),
+         COALESCE(MAX(c.budget_amount), 0), SUM(e.amount)
+  FROM public.expenses e
+  JOIN public.categories c ON c.id = e.category_id
+  WHERE e.status <> 'void' AND e.deleted_at IS NULL
+    AND (p_company_id IS NULL OR e.company_id = p_company_id)
+  GROUP BY e.company_id, e.category_id, to_char(e.bill_date, 'YYYY-MM')
+  ON CONFLICT (category_id, period)
+  DO UPDATE SET actual_amount = EXCLUDED.actual_amount;
+
+  GET DIAGNOSTICS affected = ROW_COUNT;
+  RETURN affected;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS update_account_balances_updated_at ON public.account_balances;
+CREATE TRIGGER update_account_balances_updated_at BEFORE UPDATE ON public.account_balances
+  FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
+
+-- Add a posted (or, negated, a reversed) line amount to an account's month.
+-- The month's row starts from the previous month's closing balance, and the
+-- change is carried into the closing balance of every later month.
+CREATE OR REPLACE FUNCTION apply_account_delta(
+  p_company_id UUID, p_account_id UUID, p_date DATE, p_debit NUMERIC, p_credit NUMERIC
+)
+RETURNS VOID AS $$
+DECLARE
+  v_period DATE := date_trunc('month', p_date)::DATE;
+BEGIN
+  IF p_account_id IS NULL OR (p_debit = 0 AND p_credit = 0) THEN
+    RETURN;
+  END IF;
+  INSERT INTO public.account_balances (company_id, account_id, period_start, debit_total, credit_total, closing_balance)
+  VALUES (
+    p_company_id, p_account_id, v_period, p_debit, p_credit,
+    COALESCE((
+      SELECT closing_balance FROM public.account_balances
+      WHERE account_id = p_account_id AND period_start < v_period
+      ORDER BY period_start DESC LIMIT 1
+    ), 0)
+  )
+  ON CONFLICT (account_id, period_start)
+  DO UPDATE SET debit_total = public.account_balances.debit_total + EXCLUDED.debit_total,
+                credit_total = public.account_balances.credit_total + EXCLUDED.credit_total;
+
+  UPDATE public.account_balances
+  SET closing_balance = closing_balance + (p_debit - p_credit)
+  WHERE account_id = p_account_id AND period_start >= v_period;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Lines count toward balances only while their entry is posted
+CREATE OR REPLACE FUNCTION track_journal_line_balances()
+RETURNS TRIGGER AS $$
+DECLARE
+  e RECORD;
+BEGIN
+  IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.account_id IS NOT NULL THEN
+    SELECT company_id, entry_date, status INTO e FROM public.journal_entries WHERE id = OLD.journal_id;
+    IF FOUND AND e.status = 'posted' THEN
+      PERFORM apply_account_delta(e.company_id, OLD.account_id, e.entry_date, -COALESCE(OLD.debit, 0), -COALESCE(OLD.credit, 0));
+    END IF;
+  END IF;
+  IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.account_id IS NOT NULL THEN
+    SELECT company_id, entry_date, status INTO e FROM public.journal_entries WHERE id = NEW.journal_id;
+    IF FOUND AND e.status = 'posted' THEN
+      PERFORM apply_account_delta(e.company_id, NEW.account_id, e.entry_date, COALESCE(NEW.debit, 0), COALESCE(NEW.credit, 0));
+    END IF;
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS track_journal_line_balances ON public.journal_lines;
+CREATE TRIGGER track_journal_line_balances
+  AFTER INSERT OR DELETE OR UPDATE OF account_id, debit, credit, journal_id ON public.journal_lines
+  FOR EACH ROW EXECUTE FUNCTION track_journal_line_balances();
+
+-- Posting, voiding, re-dating or deleting an entry moves all of its lines.
+-- Deletes run BEFORE so the lines are still there to reverse (their own
+-- cascaded deletes then find no entry and do nothing).
+CREATE OR REPLACE FUNCTION track_journal_entry_balances()
+RETURNS TRIGGER AS $$
+DECLARE
+  l RECORD;
+BEGIN
+  IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.status = 'posted' THEN
+    FOR l IN SELECT account_id, debit, credit FROM public.journal_lines
+             WHERE journal_id = OLD.id AND account_id IS NOT NULL LOOP
+      PERFORM apply_account_delta(OLD.company_id, l.account_id, OLD.entry_date, -COALESCE(l.debit, 0), -COALESCE(l.credit, 0));
+    END LOOP;
+  END IF;
+  IF TG_OP = 'UPDATE' AND NEW.status = 'posted' THEN
+    FOR l IN SELECT account_id, debit, credit FROM public.journal_lines
+             WHERE journal_id = NEW.id AND account_id IS NOT NULL LOOP
+      PERFORM apply_account_delta(NEW.company_id, l.account_id, NEW.entry_date, COALESCE(l.debit, 0), COALESCE(l.credit, 0));
+    END LOOP;
+  END IF;
+  IF TG_OP = 'DELETE' THEN
+    RETURN OLD;
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS track_journal_entry_balances ON public.journal_entries;
+CREATE TRIGGER track_journal_entry_balances
+  AFTER UPDATE OF status, entry_date, company_id ON public.journal_entries
+  FOR EACH ROW
+  WHEN (OLD.status IS DISTINCT FROM NEW.status OR OLD.entry_date IS DISTINCT FROM NEW.entry_date
+        OR OLD.company_id IS DISTINCT FROM NEW.company_id)
+  EXECUTE FUNCTION track_journal_entry_balances();
+
+DROP TRIGGER IF EXISTS track_journal_entry_deletes ON public.journal_entries;
+CREATE TRIGGER track_journal_entry_deletes
+  BEFORE DELETE ON public.journal_entries
+  FOR EACH ROW EXECUTE FUNCTION track_journal_entry_balances();
+
+-- Account balance (debits - credits) at the end of p_as_of: the previous
+-- month's closing balance plus this month's posted lines up to the date.
+CREATE OR REPLACE FUNCTION account_balance_as_of(p_account_id UUID, p_as_of DATE)
+RETURNS NUMERIC AS $$
+  SELECT
+    COALESCE((
+      SELECT closing_balance FROM public.account_balances
+      WHERE account_id = p_account_id AND period_start < date_trunc('month', p_as_of)::DATE
+      ORDER BY period_start DESC LIMIT 1
+    ), 0)
+    + COALESCE((
+      SELECT SUM(COALESCE(jl.debit, 0) - COALESCE(jl.credit, 0))
+      FROM public.journal_lines jl
+      JOIN public.journal_entries je ON je.id = jl.journal_id
+      WHERE jl.account_id = p_account_id AND je.status = 'posted'
+        AND je.entry_date >= date_trunc('month', p_as_of)::DATE AND je.entry_date <= p_as_of
+    ), 0);
+$$ LANGUAGE sql STABLE;
+
+-- Balance of every account of a company at the end of p_as_of
+CREATE OR REPLACE FUNCTION trial_balance(p_company_id UUID, p_as_of DATE)
+RETURNS TABLE (account_id UUID, account_name TEXT, account_code TEXT, account_type TEXT, balance NUMERIC) AS $$
+  SELECT a.id, a.account_name, a.account_code, a.account_type, account_balance_as_of(a.id, p_as_of)
+  FROM public.chart_of_accounts a
+  WHERE a.company_id = p_company_id
+  ORDER BY a.account_code NULLS LAST, a.account_name;
+$$ LANGUAGE sql STABLE;
+
+-- Monthly account totals recomputed from scratch from posted journal lines
+CREATE OR REPLACE FUNCTION expected_account_balances(p_company_id UUID DEFAULT NULL)
+RETURNS TABLE (company_id UUID, account_id UUID, period_start DATE, debit_total NUMERIC, credit_total NUMERIC, closing_balance NUMERIC) AS $$
+  SELECT t.company_id, t.account_id, t.period_start, t.debit_total, t.credit_total,
+         SUM(t.debit_total - t.credit_total) OVER (PARTITION BY t.account_id ORDER BY t.period_start)
+  FROM (
+    SELECT je.company_id, jl.account_id, date_trunc('month', je.entry_date)::DATE AS period_start,
+           SUM(COALESCE(jl.debit, 0)) AS debit_total, SUM(COALESCE(jl.credit, 0)) AS credit_total
+    FROM public.journal_lines jl
+    JOIN public.journal_entries je ON je.id = jl.journal_id
+    WHERE je.status = 'posted' AND jl.account_id IS NOT NULL
+      AND (p_company_id IS NULL OR je.company_id = p_company_id)
+    GROUP BY je.company_id, jl.account_id, date_trunc('month', je.entry_date)
+  ) t;
+$$ LANGUAGE sql STABLE;
+
+-- Months where the incrementally maintained balances disagree with a full
+-- recomputation (empty when the ledger is consistent)
+CREATE OR REPLACE FUNCTION verify_account_balances(p_company_id UUID DEFAULT NULL)
+RETURNS TABLE (account_id UUID, period_start DATE, stored_closing NUMERIC, expected_closing NUMERIC) AS $$
+  WITH s AS (
+    SELECT b.account_id, b.period_start, b.debit_total, b.credit_total, b.closing_balance
+    FROM public.account_balances b
+    WHERE p_company_id IS NULL OR b.company_id = p_company_id
+  ),
+  joined AS (
+    SELECT COALESCE(s.account_id, x.account_id) AS account_id,
+           COALESCE(s.period_start, x.period_start) AS period_start,
+           s.account_id IS NOT NULL AS stored, x.account_id IS NOT NULL AS expected,
+           s.debit_total AS stored_debit, s.credit_total AS stored_credit, s.closing_balance AS stored_closing,
+           x.debit_total AS expected_debit, x.credit_total AS expected_credit
+    FROM s
+    FULL OUTER JOIN expected_account_balances(p_company_id) x
+      ON x.account_id = s.account_id AND x.period_start = s.period_start
+  ),
+  checked AS (
+    -- Running expected balance over stored and expected months alike, so a
+    -- stored month whose lines were all voided (zero activity) must carry
+    -- the previous month's closing balance forward
+    SELECT j.*,
+           SUM(COALESCE(j.expected_debit, 0) - COALESCE(j.expected_credit, 0))
+             OVER (PARTITION BY j.account_id ORDER BY j.period_start) AS expected_closing
+    FROM joined j
+  )
+  SELECT c.account_id, c.period_start, c.stored_closing, c.expected_closing
+  FROM checked c
+  WHERE NOT c.stored
+     OR (NOT c.expected AND (c.stored_debit <> 0 OR c.stored_credit <> 0))
+     OR (c.expected AND (c.stored_debit <> c.expected_debit OR c.stored_credit <> c.expected_credit))
+     OR c.stored_closing <> c.expected_closing;
+$$ LANGUAGE sql STABLE;
+
+-- Full recomputation of account_balances (all companies when p_company_id
+-- is NULL). Returns the number of account-months written.
+CREATE OR REPLACE FUNCTION recompute_account_balances(p_company_id UUID DEFAULT NULL)
+RETURNS INTEGER AS $$
+DECLARE
+  affected INTEGER;
+BEGIN
+  DELETE FROM public.account_balances
+  WHERE p_company_id IS NULL OR company_id = p_company_id;
+
+  INSERT INTO public.account_balances (company_id, account_id, period_start, debit_total, credit_total, closing_balance)
+  SELECT * FROM expected_account_balances(p_company_id);
+
+  GET DIAGNOSTICS affected = ROW_COUNT;
+  RETURN affected;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Link journal entries posted before entries carried expense_id (memo
+-- 'Expense logged: <vendor> (<category>)') to their expense: same company,
+-- date, vendor and debit total, paired in creation order. All unlinked
+-- expenses when p_expense_id is NULL. Returns the number of entries linked.
+CREATE OR REPLACE FUNCTION link_expense_journal_entries(p_company_id UUID DEFAULT NULL, p_expense_id UUID DEFAULT NULL)
+RETURNS INTEGER AS $$
+DECLARE
+  affected INTEGER;
+BEGIN
+  -- A single expense only needs the rows of its company and date
+  WITH target AS (
+    SELECT company_id, bill_date FROM public.expenses WHERE id = p_expense_id
+  ),
+  unlinked AS (
+    SELECT e.id, e.company_id, e.bill_date, e.amount, v.name AS vendor_name,
+           row_number() OVER (PARTITION BY e.company_id, e.bill_date, e.amount, v.name ORDER BY e.created_at, e.id) AS n
+    FROM public.expenses e
+    JOIN public.vendors v ON v.id = e.vendor_id
+    WHERE (p_company_id IS NULL OR e.company_id = p_company_id)
+      AND (p_expense_id IS NULL OR (e.company_id, e.bill_date) IN (SELECT company_id, bill_date FROM target))
+      AND NOT EXISTS (SELECT 1 FROM public.journal_entries j WHERE j.expense_id = e.id)
+  ),
+  legacy AS (
+    SELECT j.id, j.company_id, j.entry_date, SUM(COALESCE(l.debit, 0)) AS amount,
+           substring(j.memo FROM '^Expense logged: (.*) \([^()]*\)$') AS vendor_name,
+           row_number() OVER (
+             PARTITION BY j.company_id, j.entry_date, SUM(COALESCE(l.debit, 0)),
+                          substring(j.memo FROM '^Expense logged: (.*) \([^()]*\)$')
+             ORDER BY j.created_at, j.id
+           ) AS n
+    FROM public.journal_entries j
+    JOIN public.journal_lines l ON l.journal_id = j.id
+    WHERE j.expense_id IS NULL AND j.import_id IS NULL AND j.memo LIKE 'Expense logged: %'
+      AND (p_company_id IS NULL OR j.company_id = p_company_id)
+      AND (p_expense_id IS NULL OR (j.company_id, j.entry_date) IN (SELECT company_id, bill_date FROM target))
+    GROUP BY j.id
+  )
+  UPDATE public.journal_entries je
+  SET expense_id = e.id
+  FROM legacy x
+  JOIN unlinked e
+    ON e.company_id = x.company_id AND e.bill_date = x.entry_date
+   AND e.amount = x.amount AND e.vendor_name = x.vendor_name AND e.n = x.n
+  WHERE je.id = x.id
+    AND (p_expense_id IS NULL OR e.id = p_expense_id);
+
+  GET DIAGNOSTICS affected = ROW_COUNT;
+  RETURN affected;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Post a journal entry and its lines in one transaction (see ledger.py), so
+-- a failure never leaves an entry without lines. With p_replace_expense_id
+-- that expense's posted entries are voided in the same transaction: a
+-- repost either replaces the entry or leaves the old one in place.
+CREATE OR REPLACE FUNCTION post_journal_entry(p_entry JSONB, p_lines JSONB, p_replace_expense_id UUID DEFAULT NULL)
+RETURNS SETOF public.journal_entries AS $$
+DECLARE
+  posted public.journal_entries;
+BEGIN
+  IF p_replace_expense_id IS NOT NULL THEN
+    UPDATE public.journal_entries SET status = 'void'
+    WHERE expense_id = p_replace_expense_id AND status = 'posted';
+  END IF;
+
+  INSERT INTO public.journal_entries (company_id, expense_id, entry_date, memo, status, created_by)
+  SELECT company_id, expense_id, entry_date, memo, COALESCE(status, 'posted'), created_by
+  FROM jsonb_populate_record(NULL::public.journal_entries, p_entry)
+  RETURNING * INTO posted;
+
+  INSERT INTO public.journal_lines (journal_id, account_id, description, debit, credit)
+  SELECT posted.id, account_id, description, debit, credit
+  FROM jsonb_populate_recordset(NULL::public.journal_lines, p_lines);
+
+  RETURN NEXT posted;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Search document for an expense's searchable fields
+CREATE OR REPLACE FUNCTION expense_search_document(
+  p_vendor_id UUID, p_category_id UUID, p_memo TEXT, p_bill_number TEXT, p_receipt_id UUID
+)
+RETURNS TSVECTOR AS $$
+  SELECT
+    setweight(to_tsvector('simple', COALESCE((SELECT name FROM public.vendors WHERE id = p_vendor_id), '')
+                                    || ' ' || COALESCE(p_bill_number, '')), 'A')
+    || setweight(to_tsvector('simple', COALESCE(p_memo, '')
+                                       || ' ' || COALESCE((SELECT name FROM public.categories WHERE id = p_category_id), '')), 'B')
+    || setweight(to_tsvector('simple', COALESCE((SELECT left(extracted_text, 100000) FROM public.receipts WHERE id = p_receipt_id), '')), 'C');
+$$ LANGUAGE sql STABLE;
+
+CREATE OR REPLACE FUNCTION set_expense_search_document()
+RETURNS TRIGGER AS $$
+BEGIN
+  NEW.search_document := expense_search_document(NEW.vendor_id, NEW.category_id, NEW.memo, NEW.bill_number, NEW.receipt_id);
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS set_expense_search_document ON public.expenses;
+CREATE TRIGGER set_expense_search_document
+  BEFORE INSERT OR UPDATE OF vendor_id, category_id, memo, bill_number, receipt_id ON public.expenses
+  FOR EACH ROW EXECUTE FUNCTION set_expense_search_document();
+
+-- Renaming a vendor/category or re-extracting a receipt refreshes the
+-- documents of the expenses that use it
+CREATE OR REPLACE FUNCTION refresh_expense_search_documents()
+RETURNS TRIGGER AS $$
+BEGIN
+  UPDATE public.expenses e
+  SET search_document = expense_search_document(e.vendor_id, e.category_id, e.memo, e.bill_number, e.receipt_id)
+  WHERE (TG_TABLE_NAME = 'vendors' AND e.vendor_id = NEW.id)
+     OR (TG_TABLE_NAME = 'categories' AND e.category_id = NEW.id)
+     OR (TG_TABLE_NAME = 'receipts' AND e.receipt_id = NEW.id);
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS refresh_vendor_search_documents ON public.vendors;
+CREATE TRIGGER refresh_vendor_search_documents
+  AFTER UPDATE OF name ON public.vendors
+  FOR EACH ROW EXECUTE FUNCTION refresh_expense_search_documents();
+
+DROP TRIGGER IF EXISTS refresh_category_search_documents ON public.categories;
+CREATE TRIGGER refresh_category_search_documents
+  AFTER UPDATE OF name ON public.categories
+  FOR EACH ROW EXECUTE FUNCTION refresh_expense_search_documents();
+
+DROP TRIGGER IF EXISTS refresh_receipt_search_documents ON public.receipts;
+CREATE TRIGGER refresh_receipt_search_documents
+  AFTER UPDATE OF extracted_text ON public.receipts
+  FOR EACH ROW EXECUTE FUNCTION refresh_expense_search_documents();
+
+-- Index expenses written before the search column existed
+UPDATE public.expenses
+SET search_document = expense_search_document(vendor_id, category_id, memo, bill_number, receipt_id)
+WHERE search_document IS NULL;
+
+-- Ranked expense search within a company. Every query word is matched as a
+-- prefix (any word may match; more matches rank higher), and vendor names
+-- are also matched by trigram similarity so OCR-mangled names still hit.
+-- total_count is the number of hits before paging.
+CREATE OR REPLACE FUNCTION search_expenses(
+  p_company_id UUID, p_query TEXT, p_start DATE DEFAULT NULL, p_end DATE DEFAULT NULL,
+  p_limit INTEGER DEFAULT 20, p_offset INTEGER DEFAULT 0
+)
+RETURNS TABLE (expense_id UUID, score REAL, total_count BIGINT) AS $$
+  WITH terms AS (
+    SELECT DISTINCT w
+    FROM regexp_split_to_table(lower(COALESCE(p_query, '')), '[^[:alnum:]]+') AS w
+    WHERE length(w) >= 2
+  ),
+  q AS (
+    SELECT to_tsquery('simple', string_agg(quote_literal(w) || ':*', ' | ')) AS tsq FROM terms
+  ),
+  -- <% (word_similarity >= pg_trgm.word_similarity_threshold, set to 0.4
+  -- below) can use idx_vendors_name_trgm; trigrams ignore case
+  vendor_hits AS (
+    SELECT v.id AS vendor_id, MAX(word_similarity(t.w, v.name)) AS similarity
+    FROM terms t
+    JOIN public.vendors v ON t.w <% v.name
+    WHERE v.company_id = p_company_id AND length(t.w) >= 3
+    GROUP BY v.id
+  ),
+  candidates AS (
+    SELECT e.id FROM public.expenses e, q
+    WHERE e.company_id = p_company_id AND e.search_document @@ q.tsq
+    UNION
+    SELECT e.id FROM public.expenses e
+    JOIN vendor_hits vh ON vh.vendor_id = e.vendor_id
+  ),
+  hits AS (
+    SELECT e.id, e.bill_date,
+           (COALESCE(ts_rank_cd(e.search_document, q.tsq), 0) + COALESCE(vh.similarity, 0))::REAL AS score
+    FROM candidates c
+    JOIN public.expenses e ON e.id = c.id
+    CROSS JOIN q
+    LEFT JOIN vendor_hits vh ON vh.vendor_id = e.vendor_id
+    WHERE e.deleted_at IS NULL
+      AND e.status IS DISTINCT FROM 'void'
+      AND (p_start IS NULL OR e.bill_date >= p_start)
+      AND (p_end IS NULL OR e.bill_date <= p_end)
+  )
+  SELECT h.id, h.score, COUNT(*) OVER ()
+  FROM hits h
+  ORDER BY h.score DESC, h.bill_date DESC, h.id
+  LIMIT p_limit OFFSET p_offset;
+$$ LANGUAGE sql STABLE SET pg_trgm.word_similarity_threshold = 0.4;
+
+-- Next bill number for a company's manual expenses ('EXP-000001', ...).
+-- The upsert takes a row lock, so concurrent callers get distinct numbers.
+CREATE OR REPLACE FUNCTION public.next_bill_number(p_company_id UUID)
+RETURNS TEXT AS $$
+  INSERT INTO public.bill_number_sequences AS s (company_id, last_value)
+  VALUES (p_company_id, 1)
+  ON CONFLICT (company_id) DO UPDATE
+    SET last_value = s.last_value + 1, updated_at = NOW()
+  RETURNING 'EXP-' || lpad(s.last_value::TEXT, GREATEST(6, length(s.last_value::TEXT)), '0');
+$$ LANGUAGE sql VOLATILE;
+
+DROP TRIGGER IF EXISTS update_jobs_updated_at ON public.jobs;
+CREATE TRIGGER update_jobs_updated_at BEFORE UPDATE ON public.jobs
+  FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
+
 -- ============================================================================
 -- SEED DATA (Optional - Common Categories)
 -- ============================================================================
@@ -0,0 +1,215 @@
+import bisect
+import hashlib
+import re
+import threading
+import time
+from datetime import date as date_type, datetime
+from database import table
+
+# Same vendor + same amount within this many days is a likely duplicate
+DATE_WINDOW_DAYS = 3
+# Rebuild a company's index from the database after this long, so expenses
+# written by other workers are picked up
+INDEX_TTL_SECONDS = 600
+# A receipt needs at least this many numeric tokens to be fingerprinted
+MIN_FINGERPRINT_TOKENS = 3
+# Expenses fetched per request when building an index (PostgREST caps responses at 1000 rows)
+PAGE_SIZE = 1000
+
+_VENDOR_NOISE = re.compile(r"#\s*\d+|\b(store|inc|llc|ltd|co|corp|corporation|company)\b|[^a-z0-9 ]")
+_NUMERIC_TOKEN = re.compile(r"\d[\d.,/:-]*\d")
+
+
+def normalize_vendor(name: str):
+    """'WALMART STORE #1234, Inc.' -> 'walmart'"""
+    if not name:
+        return ""
+    return " ".join(_VENDOR_NOISE.sub(" ", name.lower()).split())
+
+
+def to_cents(amount):
+    return int(round(float(amount) * 100))
+
+
+def to_day(value):
+    """Day number for a 'YYYY-MM-DD' string or date, or None if unparseable."""
+    if isinstance(value, date_type):
+        return value.toordinal()
+    try:
+        return datetime.strptime(str(value)[:10], "%Y-%m-%d").toordinal()
+    except (TypeError, ValueError):
+        return None
+
+
+def text_fingerprint(text: str):
+    """
+    Fingerprint of a receipt's OCR text, as 16 hex chars, or None if too sparse.
+    Built from the set of numeric tokens (amounts, dates, times, card digits):
+    OCR reads digits far more reliably than words, so a re-scan or second
+    photo of the same receipt yields the same fingerprint.
+    """
+    tokens = {token.replace(",", "") for token in _NUMERIC_TOKEN.findall(text or "") if len(token) >= 3}
+    if len(tokens) < MIN_FINGERPRINT_TOKENS:
+        return None
+    return hashlib.blake2b(" ".join(sorted(tokens)).encode(), digest_size=8).hexdigest()
+
+
+class CompanyIndex:
+    """
+    In-memory duplicate index for one company.
+    - (vendor, cents) -> sorted [(day, expense_id)], searched with bisect
+    - receipt fingerprint -> {expense_id}, an O(1) lookup
+    """
+
+    def __init__(self):
+        self.by_key = {}
+        self.by_fingerprint = {}
+        self.entries = {}
+        self.built_at = time.monotonic()
+
+    def add(self, expense_id, vendor_name, amount, bill_date, fingerprint=None):
+        previous = self.entries.get(expense_id)
+        self.remove(expense_id)
+        # Updates may not carry the vendor; keep the one already indexed
+        vendor = normalize_vendor(vendor_name) if vendor_name or not previous else previous[0][0]
+        key = (vendor, to_cents(amount))
+        day = to_day(bill_date)
+        if day is not None:
+            bisect.insort(self.by_key.setdefault(key, []), (day, expense_id))
+        if fingerprint:
+            self.by_fingerprint.setdefault(fingerprint, set()).add(expense_id)
+        self.entries[expense_id] = (key, day, fingerprint)
+
+    def remove(self, expense_id):
+        entry = self.entries.pop(expense_id, None)
+        if entry is None:
+            return
+        key, day, fingerprint = entry
+        rows = self.by_key.get(key)
+        if rows and day is not None:
+            i = bisect.bisect_left(rows, (day, expense_id))
+            if i < len(rows) and rows[i] == (day, expense_id):
+                rows.pop(i)
+        if fingerprint:
+            self.by_fingerprint.get(fingerprint, set()).discard(expense_id)
+
+    def find(self, vendor_name, amount, bill_date, fingerprint=None, exclude_id=None):
+        """Return [{"expense_id", "reason"}] for likely duplicates of the given expense."""
+        matches = {}
+
+        day = to_day(bill_date)
+        if vendor_name and amount is not None and day is not None:
+            rows = self.by_key.get((normalize_vendor(vendor_name), to_cents(amount)), [])
+            lo = bisect.bisect_left(rows, (day - DATE_WINDOW_DAYS, ""))
+            for row_day, expense_id in rows[lo:]:
+                if row_day > day + DATE_WINDOW_DAYS:
+                    break
+                matches[expense_id] = "same vendor and amount within %d days" % DATE_WINDOW_DAYS
+
+        for expense_id in self.by_fingerprint.get(fingerprint, ()) if fingerprint else ():
+            matches[expense_id] = "matching receipt"
+
+        matches.pop(exclude_id, None)
+        return [{"expense_id": expense_id, "reason": reason} for expense_id, reason in matches.items()]
+
+
+_indexes = {}
+# Guards _indexes, _company_locks and the indexes' contents; held only briefly
+_lock = threading.Lock()
+# Held while a company's index is (re)built, so its writes wait for the new
+# index instead of going to the old one; other companies are not blocked
+_company_locks = {}
+
+
+def _company_lock(company_id: str):
+    with _lock:
+        return _company_locks.setdefault(company_id, threading.Lock())
+
+
+def _fetch_company_expenses(company_id: str):
+    """A company's live expenses, keyset-paginated on id."""
+    last_id = None
+    while True:
+        query = (
+            table("expenses")
+            .select("id, amount, bill_date, receipt_fingerprint, vendors(name)")
+            .eq("company_id", company_id)
+            .neq("status", "void")
+            .is_("deleted_at", "null")
+            .order("id")
+            .limit(PAGE_SIZE)
+        )
+        if last_id:
+            query = query.gt("id", last_id)
+        rows = query.execute().data or []
+        yield from rows
+        if len(rows) < PAGE_SIZE:
+            return
+        last_id = rows[-1]["id"]
+
+
+def _build_index(company_id: str):
+    index = CompanyIndex()
+    for row in _fetch_company_expenses(company_id):
+        vendor = (row.get("vendors") or {}).get("name")
+        index.add(row["id"], vendor, row.get("amount") or 0, row.get("bill_date"), row.get("receipt_fingerprint"))
+    return index
+
+
+def get_index(company_id: str):
+    """The company's index, built from the database on first use or after INDEX_TTL_SECONDS."""
+    with _company_lock(company_id):
+        with _lock:
+            index = _indexes.get(company_id)
+            if index is not None and time.monotonic() - index.built_at < INDEX_TTL_SECONDS:
+                return index
+        index = _build_index(company_id)
+        with _lock:
+            _indexes[company_id] = index
+        return index
+
+
+def find_duplicates(company_id: str, vendor_name: str, amount, bill_date, fingerprint: str = None, exclude_id: str = None):
+    """Likely duplicates of an expense that is about to be (or was just) entered."""
+    if not company_id:
+        return []
+    index = get_index(company_id)
+    with _lock:
+        return index.find(vendor_name, amount, bill_date, fingerprint, exclude_id)
+
+
+def record_expense(company_id: str, expense_id: str, vendor_name: str, amount, bill_date, fingerprint: str = None):
+    """Add or refresh an expense in the company's index after a write."""
+    with _company_lock(company_id), _lock:
+        index = _indexes.get(company_id)
+        if index is not None:
+            index.add(expense_id, vendor_name, amount, bill_date, fingerprint)
+
+
+def forget_expense(company_id: str, expense_id: str):
+    """Drop a voided or deleted expense from the company's index."""
+    with _company_lock(company_id), _lock:
+        index = _indexes.get(company_id)
+        if index is not None:
+            index.remove(expense_id)
+
+
+def scan_company(company_id: str):
+    """
+    Bulk mode: find duplicate groups across a company's whole history.
+    Builds a fresh index in one pass and checks each expense against the
+    ones already indexed, so the scan is O(n log n).
+    """
+    with _company_lock(company_id):
+        index = CompanyIndex()
+        groups = {}
+        for row in sorted(_fetch_company_expenses(company_id), key=lambda r: (str(r.get("bill_date")), r["id"])):
+            vendor = (row.get("vendors") or {}).get("name")
+            amount = row.get("amount") or 0
+            for match in index.find(vendor, amount, row.get("bill_date"), row.get("receipt_fingerprint")):
+                groups.setdefault(match["expense_id"], []).append({"expense_id": row["id"], "reason": match["reason"]})
+            index.add(row["id"], vendor, amount, row.get("bill_date"), row.get("receipt_fingerprint"))
+
+        with _lock:
+            _indexes[company_id] = index
+    return [{"expense_id": original, "duplicates": dupes} for original, dupes in groups.items()]
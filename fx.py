@@ -0,0 +1,174 @@
+"""
+Foreign-exchange conversion into a company's base currency.
+
+fx_rates holds the value of one unit of each currency in USD per date. The
+whole table is loaded into memory (it is small: one row per currency per
+day) as sorted arrays per currency and reloaded every FX_RATES_TTL_SECONDS.
+The rate for a date is the latest one on or before it (bisect for single
+amounts, np.searchsorted for whole columns); dates before a currency's first
+rate use that first rate.
+
+Load rates from a CSV of date,currency,usd_rate with `python fx.py rates.csv`.
+"""
+import bisect
+import csv
+import os
+import sys
+import numpy as np
+from cache import TTLCache, get_company
+from database import table
+# One symbol table for receipt parsing and normalize(), so they agree
+from smart_parser import CURRENCY_SYMBOLS
+
+PIVOT = "USD"
+DEFAULT_BASE_CURRENCY = "USD"
+RATES_TTL_SECONDS = int(os.getenv("FX_RATES_TTL_SECONDS", "3600"))
+PAGE_SIZE = 1000
+UPSERT_BATCH_SIZE = 500
+
+
+class RateTable:
+    """Per-currency (days since 1970-01-01, USD rate) arrays, sorted by day."""
+
+    def __init__(self, rows: list):
+        by_currency = {}
+        for row in rows:
+            by_currency.setdefault(row["currency"].upper(), []).append((row["rate_date"], float(row["usd_rate"])))
+        self.series = {}
+        for currency, points in by_currency.items():
+            points.sort()
+            days = np.array([d for d, _ in points], dtype="datetime64[D]").astype(np.int32)
+            rates = np.array([r for _, r in points], dtype=np.float64)
+            self.series[currency] = (days, rates, days.tolist())
+
+    def currencies(self):
+        return sorted(set(self.series) | {PIVOT})
+
+    def usd_rate(self, currency: str, day: int):
+        """USD value of one unit of `currency` on `day`, or None if the currency has no rates."""
+        if currency == PIVOT:
+            return 1.0
+        series = self.series.get(currency)
+        if series is None:
+            return None
+        _, rates, day_list = series
+        i = max(bisect.bisect_right(day_list, day) - 1, 0)
+        return float(rates[i])
+
+    def usd_rates(self, currency: str, days: np.ndarray):
+        """Vectorized usd_rate over an int32 array of days (NaN if the currency has no rates)."""
+        if currency == PIVOT:
+            return np.ones(len(days))
+        series = self.series.get(currency)
+        if series is None:
+            return np.full(len(days), np.nan)
+        day_array, rates, _ = series
+        i = np.maximum(np.searchsorted(day_array, days, side="right") - 1, 0)
+        return rates[i]
+
+
+_rates = TTLCache(RATES_TTL_SECONDS)
+
+
+def get_rates():
+    rates = _rates.get("all")
+    if rates is None:
+        rows = []
+        while True:
+            page = (
+                table("fx_rates")
+                .select("currency, rate_date, usd_rate")
+                .order("currency")
+                .order("rate_date")
+                .range(len(rows), len(rows) + PAGE_SIZE - 1)
+                .execute()
+                .data
+            ) or []
+            rows.extend(page)
+            if len(page) < PAGE_SIZE:
+                break
+        rates = RateTable(rows)
+        _rates.set("all", rates)
+    return rates
+
+
+def invalidate():
+    _rates.clear()
+
+
+def normalize(currency: str):
+    """ISO code for a code or symbol ("eur", "€" -> "EUR"); None for blanks."""
+    if not currency:
+        return None
+    currency = currency.strip()
+    return CURRENCY_SYMBOLS.get(currency, currency.upper()) or None
+
+
+def base_currency(company_id: str):
+    company = get_company(company_id)
+    return normalize((company or {}).get("base_currency")) or DEFAULT_BASE_CURRENCY
+
+
+def to_day(value):
+    return int(np.datetime64(str(value)[:10], "D").astype(np.int32))
+
+
+def convert_amount(amount, currency: str, target: str, on_date):
+    """Convert one amount from `currency` to `target` at the rate of `on_date`."""
+    currency = normalize(currency) or target
+    if currency == target:
+        return float(amount)
+    rates = get_rates()
+    day = to_day(on_date)
+    source_rate = rates.usd_rate(currency, day)
+    target_rate = rates.usd_rate(target, day)
+    if source_rate is None or target_rate is None:
+        raise ValueError(f"No exchange rate for {currency} -> {target}")
+    return round(float(amount) * source_rate / target_rate, 2)
+
+
+def conversion_factors(codes: np.ndarray, names: list, days: np.ndarray, target: str):
+    """
+    Per-row multipliers into `target` for rows whose currency is names[code]
+    ("" meaning already in target). NaN where a rate is missing.
+    """
+    factors = np.ones(len(codes))
+    foreign = [(code, name) for code, name in enumerate(names) if name and name != target]
+    if not foreign:
+        return factors
+    rates = get_rates()
+    target_rates = rates.usd_rates(target, days)
+    for code, name in foreign:
+        rows = codes == code
+        if rows.any():
+            factors[rows] = rates.usd_rates(name, days[rows]) / target_rates[rows]
+    return factors
+
+
+def load_csv(path: str):
+    """Upsert date,currency,usd_rate rows from a CSV file. Returns the number written."""
+    written = 0
+    batch = []
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            batch.append({
+                "currency": normalize(row["currency"]),
+                "rate_date": row["date"],
+                "usd_rate": float(row["usd_rate"]),
+                "source": os.path.basename(path),
+            })
+            if len(batch) >= UPSERT_BATCH_SIZE:
+                table("fx_rates").upsert(batch, on_conflict="currency,rate_date").execute()
+                written += len(batch)
+                batch = []
+    if batch:
+        table("fx_rates").upsert(batch, on_conflict="currency,rate_date").execute()
+        written += len(batch)
+    invalidate()
+    return written
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        sys.exit("usage: python fx.py rates.csv")
+    print(f"Loaded {load_csv(sys.argv[1])} rates")
@@ -0,0 +1,45 @@
+"""
+Conditional GET for listing endpoints.
+
+A listing's ETag is built from the row count and newest updated_at of every
+table it reads (scoped to the company when there is one) plus the query
+string, so a client that already holds the current payload gets a 304 after
+a few indexed lookups instead of downloading it again. Tables that are only
+joined in (vendors and categories on expenses) count too, so a rename
+changes the tag. Row counts catch hard deletes, which leave updated_at alone.
+"""
+import hashlib
+from fastapi import Request, Response
+from database import table
+
+# Clients may keep the payload but must revalidate it on every use
+CACHE_CONTROL = "private, no-cache"
+
+
+def table_version(name: str, company_id: str = None, column: str = "company_id"):
+    """'<table>:<row count>:<newest updated_at>', optionally for one company's rows."""
+    query = table(name).select("updated_at", count="exact").order("updated_at", desc=True).limit(1)
+    if company_id:
+        query = query.eq(column, company_id)
+    response = query.execute()
+    newest = response.data[0]["updated_at"] if response.data else ""
+    return f"{name}:{response.count}:{newest}"
+
+
+def listing_etag(request: Request, *versions: str):
+    """Weak ETag (the body may be sent compressed) over table versions and the query string."""
+    digest = hashlib.sha1("|".join((request.url.path, request.url.query) + versions).encode()).hexdigest()
+    return f'W/"{digest[:24]}"'
+
+
+def not_modified(request: Request, response: Response, etag: str):
+    """
+    Set the ETag on `response`; return a 304 to send instead if the client's
+    If-None-Match already names it, else None.
+    """
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+    response.headers.update(headers)
+    tags = [t.strip() for t in (request.headers.get("if-none-match") or "").split(",")]
+    if "*" in tags or etag in tags or etag.removeprefix("W/") in tags:
+        return Response(status_code=304, headers=headers)
+    return None
@@ -0,0 +1,130 @@
+"""
+Idempotency-Key support for the create (POST) routes.
+
+A client retrying a create after a timeout sends the same Idempotency-Key
+header. The first request's response is kept for IDEMPOTENCY_TTL_SECONDS and
+replayed (with an Idempotent-Replayed: true header) instead of creating the
+record twice. A duplicate that arrives while the first is still running
+waits for it and gets the same response. Keys are scoped per route; reusing
+one with a different body is rejected with 422.
+
+Successes and 4xx errors are stored; a 5xx or crash frees the key so the
+retry runs again. The store is per process and bounded: beyond
+IDEMPOTENCY_MAX_KEYS the least recently used keys are dropped.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import ORJSONResponse
+
+TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+MAX_KEYS = int(os.getenv("IDEMPOTENCY_MAX_KEYS", "10000"))
+MAX_KEY_LENGTH = 255
+# How long a duplicate waits for the original request before giving up with 409
+WAIT_SECONDS = 60
+REPLAY_HEADERS = {"Idempotent-Replayed": "true"}
+
+
+class _Entry:
+    def __init__(self, fingerprint: str):
+        self.fingerprint = fingerprint
+        self.done = threading.Event()
+        self.status_code = None  # None once done means the first attempt failed without a stored response
+        self.body = None
+        self.expires_at = None
+
+
+class IdempotencyStore:
+    """Bounded LRU of key -> response, with in-flight entries duplicates can wait on."""
+
+    def __init__(self, ttl: int, max_keys: int):
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def claim(self, key, fingerprint: str):
+        """(entry, True) if the caller should run the request, else (existing entry, False)."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at is not None and entry.expires_at < time.monotonic():
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry, False
+            entry = self._entries[key] = _Entry(fingerprint)
+            while len(self._entries) > self.max_keys:
+                self._entries.popitem(last=False)
+            return entry, True
+
+    def complete(self, entry: _Entry, status_code: int, body):
+        entry.status_code = status_code
+        entry.body = body
+        entry.expires_at = time.monotonic() + self.ttl
+        entry.done.set()
+
+    def release(self, key, entry: _Entry):
+        """Forget a key whose request failed, waking any duplicates so one of them can run it."""
+        with self._lock:
+            if self._entries.get(key) is entry:
+                del self._entries[key]
+        entry.done.set()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+store = IdempotencyStore(TTL_SECONDS, MAX_KEYS)
+
+
+def fingerprint(body):
+    return hashlib.sha256(json.dumps(body, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def replay(entry: _Entry):
+    if entry.status_code >= 400:
+        raise HTTPException(status_code=entry.status_code, detail=entry.body, headers=REPLAY_HEADERS)
+    return ORJSONResponse(entry.body, status_code=entry.status_code, headers=REPLAY_HEADERS)
+
+
+def run(idempotency_key: str, scope: str, body, handler):
+    """
+    Run `handler()` (a route's create logic) at most once per (scope, key).
+    Without a key the handler simply runs.
+    """
+    if not idempotency_key:
+        return handler()
+    if len(idempotency_key) > MAX_KEY_LENGTH:
+        raise HTTPException(status_code=400, detail=f"Idempotency-Key must be at most {MAX_KEY_LENGTH} characters")
+
+    key = (scope, idempotency_key)
+    request_fingerprint = fingerprint(body)
+    entry, owner = store.claim(key, request_fingerprint)
+    if not owner:
+        if entry.fingerprint != request_fingerprint:
+            raise HTTPException(status_code=422, detail="Idempotency-Key was already used with a different request body")
+        if not entry.done.wait(WAIT_SECONDS):
+            raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still in progress")
+        if entry.status_code is None:
+            return run(idempotency_key, scope, body, handler)
+        return replay(entry)
+
+    try:
+        result = handler()
+    except HTTPException as e:
+        if e.status_code < 500:
+            store.complete(entry, e.status_code, e.detail)
+        else:
+            store.release(key, entry)
+        raise
+    except Exception:
+        store.release(key, entry)
+        raise
+    store.complete(entry, 200, jsonable_encoder(result))
+    return result
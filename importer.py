@@ -0,0 +1,459 @@
+"""
+QuickBooks / NetSuite bulk import.
+
+Export files (IIF, CSV or QuickBooks qbXML) are stream-parsed into vendor,
+account and transaction records, which are written in chunks: vendors and
+chart_of_accounts rows are created once per name, every transaction becomes a
+posted journal entry with its lines, and bill/check/charge transactions also
+become expenses (bill payments only settle A/P in the journal, since the bill
+they pay is already an expense). Progress and the resume checkpoint live on the
+migrations_imports row, so a failed import picks up where it stopped.
+
+Imports normally run as the `import_accounting_file` background job; for a
+one-off run from the shell:
+
+    python importer.py <import_id>
+"""
+import csv
+import os
+import sys
+import time
+import xml.etree.ElementTree as ET
+from datetime import datetime
+from database import table
+
+CHUNK_SIZE = 2000
+# Existing vendors/accounts fetched per request (PostgREST caps responses at 1000 rows)
+LOOKUP_PAGE_SIZE = 1000
+
+# Transaction types that are also recorded as expenses (lower-cased)
+EXPENSE_TRANSACTION_TYPES = {
+    "bill", "check", "credit card", "credit card charge", "ccard", "expense",
+    "vendor bill", "cash purchase",
+}
+# Payments of a bill imported separately: journal entries against A/P, not expenses
+BILL_PAYMENT_TYPES = {
+    "bill payment", "billpmt", "bill pmt -check", "bill pmt -ccard", "vendor payment",
+}
+
+DATE_FORMATS = ("%Y-%m-%d", "%m/%d/%Y", "%m/%d/%y", "%d-%b-%Y", "%d/%m/%Y")
+
+# CSV header aliases across QuickBooks and NetSuite exports
+CSV_COLUMNS = {
+    "date": ("date", "transaction date", "txn date"),
+    "type": ("type", "transaction type", "txn type"),
+    "number": ("num", "number", "document number", "ref no", "ref number"),
+    "name": ("name", "vendor", "payee", "entity"),
+    "memo": ("memo", "description", "memo/description"),
+    "account": ("account", "account name", "split"),
+    "amount": ("amount", "amount (net)"),
+    "debit": ("debit", "amount (debit)"),
+    "credit": ("credit", "amount (credit)"),
+}
+
+
+def parse_date(value: str):
+    value = (value or "").strip()
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).date().isoformat()
+        except ValueError:
+            continue
+    return None
+
+
+def parse_amount(value):
+    value = (value or "").strip().replace(",", "").replace("$", "")
+    if value.startswith("(") and value.endswith(")"):
+        value = "-" + value[1:-1]
+    try:
+        return float(value) if value else 0.0
+    except ValueError:
+        return 0.0
+
+
+def map_account_type(raw: str):
+    """QuickBooks/NetSuite account type -> chart_of_accounts.account_type."""
+    kind = (raw or "").lower().replace(" ", "").replace("_", "")
+    if "receivable" in kind or "asset" in kind or kind in ("bank", "ar"):
+        return "asset"
+    if "payable" in kind or "liab" in kind or "creditcard" in kind or kind in ("ap", "ccard"):
+        return "liability"
+    if "equity" in kind:
+        return "equity"
+    if "income" in kind or "revenue" in kind or kind == "inc":
+        return "revenue"
+    return "expense"
+
+
+def make_transaction(txn_type, date, number, vendor, memo, lines):
+    return {
+        "kind": "transaction",
+        "type": (txn_type or "").strip(),
+        "date": date,
+        "number": (number or "").strip() or None,
+        "vendor": (vendor or "").strip() or None,
+        "memo": (memo or "").strip() or None,
+        "lines": lines,
+    }
+
+
+def balance_lines(txn: dict):
+    """Single-sided exports: add the offsetting line so the journal balances."""
+    total = round(sum(line["amount"] for line in txn["lines"]), 2)
+    if total:
+        payable = EXPENSE_TRANSACTION_TYPES | BILL_PAYMENT_TYPES
+        offset = "Accounts Payable" if txn["type"].lower() in payable else "Suspense"
+        txn["lines"].append({"account": offset, "amount": -total, "memo": None})
+    return txn
+
+
+# -- parsers: each yields vendor / account / transaction records ------------
+
+def parse_iif(f):
+    """QuickBooks IIF: tab-separated, '!' rows declare the columns of each record type."""
+    headers = {}
+    txn = None
+    for line in f:
+        cells = line.rstrip("\r\n").split("\t")
+        tag = cells[0].strip()
+        if not tag:
+            continue
+        if tag.startswith("!"):
+            headers[tag[1:]] = [c.strip() for c in cells[1:]]
+            continue
+        row = dict(zip(headers.get(tag, []), cells[1:]))
+
+        if tag == "VEND" and row.get("NAME"):
+            yield {"kind": "vendor", "name": row["NAME"].strip()}
+        elif tag == "ACCNT" and row.get("NAME"):
+            yield {
+                "kind": "account",
+                "name": row["NAME"].strip(),
+                "type": map_account_type(row.get("ACCNTTYPE")),
+                "code": (row.get("ACCNUM") or "").strip() or None,
+            }
+        elif tag == "TRNS":
+            # The TRNS row is itself the first split (IIF: positive = debit)
+            txn = make_transaction(
+                row.get("TRNSTYPE"), parse_date(row.get("DATE")), row.get("DOCNUM"),
+                row.get("NAME"), row.get("MEMO"),
+                [{"account": row.get("ACCNT"), "amount": parse_amount(row.get("AMOUNT")), "memo": row.get("MEMO")}],
+            )
+        elif tag == "SPL" and txn is not None:
+            txn["lines"].append({"account": row.get("ACCNT"), "amount": parse_amount(row.get("AMOUNT")), "memo": row.get("MEMO")})
+        elif tag == "ENDTRNS" and txn is not None:
+            yield balance_lines(txn)
+            txn = None
+
+
+def parse_csv(f):
+    """
+    QuickBooks / NetSuite transaction-detail CSV. Consecutive rows sharing
+    date, type and number are lines of one transaction.
+    """
+    reader = csv.reader(f)
+    header = None
+    for cells in reader:
+        lowered = [c.strip().lower() for c in cells]
+        # Exports often start with title rows; the header is the first row with a date column
+        if any(name in lowered for name in CSV_COLUMNS["date"]):
+            header = lowered
+            break
+    if header is None:
+        return
+
+    index = {}
+    for field, aliases in CSV_COLUMNS.items():
+        for alias in aliases:
+            if alias in header:
+                index[field] = header.index(alias)
+                break
+
+    def cell(cells, field):
+        i = index.get(field)
+        return cells[i] if i is not None and i < len(cells) else ""
+
+    txn = None
+    key = None
+    for cells in reader:
+        date = parse_date(cell(cells, "date"))
+        if not date:
+            continue  # subtotal / blank rows
+        if "amount" in index:
+            amount = parse_amount(cell(cells, "amount"))
+        else:
+            amount = parse_amount(cell(cells, "debit")) - parse_amount(cell(cells, "credit"))
+        line = {"account": cell(cells, "account"), "amount": amount, "memo": cell(cells, "memo")}
+
+        row_key = (date, cell(cells, "type"), cell(cells, "number"))
+        if txn is not None and row_key == key and cell(cells, "number"):
+            txn["lines"].append(line)
+            continue
+        if txn is not None:
+            yield balance_lines(txn)
+        key = row_key
+        txn = make_transaction(cell(cells, "type"), date, cell(cells, "number"), cell(cells, "name"), cell(cells, "memo"), [line])
+    if txn is not None:
+        yield balance_lines(txn)
+
+
+QBXML_TRANSACTIONS = {
+    "BillRet": "Bill",
+    "CheckRet": "Check",
+    "CreditCardChargeRet": "Credit Card Charge",
+}
+
+
+def parse_qbxml(f):
+    """QuickBooks qbXML responses (VendorRet, AccountRet, BillRet, CheckRet, CreditCardChargeRet)."""
+    parents = []
+    for event, elem in ET.iterparse(f, events=("start", "end")):
+        if event == "start":
+            parents.append(elem)
+            continue
+        parents.pop()
+        tag = elem.tag
+        if tag == "VendorRet":
+            yield {"kind": "vendor", "name": elem.findtext("Name", "").strip()}
+        elif tag == "AccountRet":
+            yield {
+                "kind": "account",
+                "name": elem.findtext("FullName") or elem.findtext("Name", ""),
+                "type": map_account_type(elem.findtext("AccountType")),
+                "code": elem.findtext("AccountNumber"),
+            }
+        elif tag in QBXML_TRANSACTIONS:
+            lines = [
+                {
+                    "account": line.findtext("AccountRef/FullName"),
+                    "amount": parse_amount(line.findtext("Amount")),
+                    "memo": line.findtext("Memo"),
+                }
+                for line in elem.iter("ExpenseLineRet")
+            ]
+            total = sum(line["amount"] for line in lines)
+            # Bills credit A/P; checks and charges credit the paying account
+            credit_account = elem.findtext("AccountRef/FullName") or "Accounts Payable"
+            lines.append({"account": credit_account, "amount": -total, "memo": None})
+            yield make_transaction(
+                QBXML_TRANSACTIONS[tag],
+                parse_date(elem.findtext("TxnDate")),
+                elem.findtext("RefNumber"),
+                elem.findtext("VendorRef/FullName") or elem.findtext("PayeeEntityRef/FullName"),
+                elem.findtext("Memo"),
+                lines,
+            )
+        else:
+            continue
+        # Free each record once handled, and detach it from its parent, so
+        # memory stays flat on large files
+        elem.clear()
+        if parents:
+            parents[-1].remove(elem)
+
+
+PARSERS = {"iif": parse_iif, "csv": parse_csv, "xml": parse_qbxml}
+
+
+def iter_records(file_path: str, file_format: str):
+    parse = PARSERS[file_format]
+    mode = "rb" if file_format == "xml" else "r"
+    kwargs = {} if file_format == "xml" else {"encoding": "utf-8-sig", "errors": "replace", "newline": ""}
+    with open(file_path, mode, **kwargs) as f:
+        yield from parse(f)
+
+
+# -- writer -------------------------------------------------------------------
+
+def load_name_ids(table_name: str, name_column: str, company_id: str):
+    """{name: id} over all of a company's rows in `table_name`, keyset-paginated on id."""
+    ids = {}
+    last_id = None
+    while True:
+        query = (
+            table(table_name)
+            .select(f"id, {name_column}")
+            .eq("company_id", company_id)
+            .order("id")
+            .limit(LOOKUP_PAGE_SIZE)
+        )
+        if last_id:
+            query = query.gt("id", last_id)
+        rows = query.execute().data or []
+        for row in rows:
+            ids.setdefault(row[name_column], row["id"])
+        if len(rows) < LOOKUP_PAGE_SIZE:
+            return ids
+        last_id = rows[-1]["id"]
+
+
+class ImportWriter:
+    """Writes parsed records for one company in chunks of bulk inserts."""
+
+    def __init__(self, company_id: str, import_id: str):
+        self.company_id = company_id
+        self.import_id = import_id
+        self.vendor_ids = load_name_ids("vendors", "name", company_id)
+        self.account_ids = load_name_ids("chart_of_accounts", "account_name", company_id)
+
+    def discard_partial_chunk(self, from_row: int):
+        """Remove rows of a chunk that was interrupted mid-write, so it can be redone."""
+        table("expenses").delete().eq("import_id", self.import_id).gte("import_row", from_row).execute()
+        table("journal_entries").delete().eq("import_id", self.import_id).gte("import_row", from_row).execute()
+
+    def _ensure_vendors(self, names):
+        new = sorted({n for n in names if n and n not in self.vendor_ids})
+        if new:
+            rows = table("vendors").insert([{"company_id": self.company_id, "name": n} for n in new]).execute().data
+            self.vendor_ids.update({v["name"]: v["id"] for v in rows})
+
+    def _ensure_accounts(self, accounts: dict):
+        new = {name: spec for name, spec in accounts.items() if name and name not in self.account_ids}
+        if new:
+            rows = table("chart_of_accounts").insert([
+                {
+                    "company_id": self.company_id,
+                    "account_name": name,
+                    "account_code": spec.get("code"),
+                    "account_type": spec.get("type") or "expense",
+                }
+                for name, spec in new.items()
+            ]).execute().data
+            self.account_ids.update({a["account_name"]: a["id"] for a in rows})
+
+    def write_chunk(self, records, first_row: int):
+        """Write records numbered first_row, first_row + 1, ... (numbers make re-runs idempotent)."""
+        transactions = []
+        vendor_names = []
+        accounts = {}
+        for offset, record in enumerate(records):
+            if record["kind"] == "vendor":
+                vendor_names.append(record["name"])
+            elif record["kind"] == "account":
+                accounts[record["name"]] = record
+            elif record["date"]:
+                transactions.append((first_row + offset, record))
+                vendor_names.append(record["vendor"])
+                for line in record["lines"]:
+                    accounts.setdefault(line["account"], {})
+
+        self._ensure_vendors(vendor_names)
+        self._ensure_accounts(accounts)
+        if not transactions:
+            return
+
+        expenses = []
+        for row, txn in transactions:
+            if txn["type"].lower() in EXPENSE_TRANSACTION_TYPES:
+                expenses.append({
+                    "company_id": self.company_id,
+                    "vendor_id": self.vendor_ids.get(txn["vendor"]),
+                    "bill_number": txn["number"],
+                    "bill_date": txn["date"],
+                    "amount": round(sum(l["amount"] for l in txn["lines"] if l["amount"] > 0), 2),
+                    "memo": txn["memo"],
+                    "status": "approved" if txn["type"].lower() in ("bill", "vendor bill") else "paid",
+                    "import_id": self.import_id,
+                    "import_row": row,
+                })
+        # Expenses first, so each entry can point at its expense (voiding the
+        # expense then voids the entry)
+        expense_ids = {}
+        if expenses:
+            inserted = table("expenses").insert(expenses).execute().data
+            expense_ids = {expense["import_row"]: expense["id"] for expense in inserted}
+
+        entries = table("journal_entries").insert([
+            {
+                "company_id": self.company_id,
+                "entry_date": txn["date"],
+                "memo": txn["memo"] or f"Imported {txn['type']} {txn['number'] or ''}".strip(),
+                "status": "posted",
+                "expense_id": expense_ids.get(row),
+                "import_id": self.import_id,
+                "import_row": row,
+            }
+            for row, txn in transactions
+        ]).execute().data
+        entry_ids = {entry["import_row"]: entry["id"] for entry in entries}
+
+        lines = []
+        for row, txn in transactions:
+            for line in txn["lines"]:
+                amount = round(line["amount"], 2)
+                lines.append({
+                    "journal_id": entry_ids[row],
+                    "account_id": self.account_ids.get(line["account"]),
+                    "description": line["memo"] or line["account"],
+                    "debit": amount if amount > 0 else 0,
+                    "credit": -amount if amount < 0 else 0,
+                })
+        for start in range(0, len(lines), CHUNK_SIZE):
+            table("journal_lines").insert(lines[start:start + CHUNK_SIZE]).execute()
+
+
+def run_import(import_id: str, company_id: str = None):
+    """
+    Run (or resume) the import described by a migrations_imports row.
+    Records before the row's checkpoint are skipped; the checkpoint advances
+    after every chunk.
+    """
+    job = table("migrations_imports").select("*").eq("id", import_id).execute().data
+    if not job:
+        raise ValueError(f"Import {import_id} not found")
+    job = job[0]
+    checkpoint = job.get("checkpoint_row") or 0
+
+    table("migrations_imports").update({"status": "running", "error": None}).eq("id", import_id).execute()
+    writer = ImportWriter(job["company_id"], import_id)
+    writer.discard_partial_chunk(checkpoint)
+
+    start = time.perf_counter()
+    processed = 0
+    chunk = []
+    chunk_start = checkpoint
+
+    def flush():
+        nonlocal chunk, chunk_start, processed
+        if not chunk:
+            return
+        writer.write_chunk(chunk, chunk_start)
+        processed += len(chunk)
+        chunk_start += len(chunk)
+        chunk = []
+        elapsed = time.perf_counter() - start
+        table("migrations_imports").update({
+            "checkpoint_row": chunk_start,
+            "records_imported": chunk_start,
+            "rows_per_second": round(processed / elapsed, 1) if elapsed else None,
+        }).eq("id", import_id).execute()
+
+    try:
+        for row_number, record in enumerate(iter_records(job["file_path"], job["file_format"])):
+            if row_number < checkpoint:
+                continue
+            chunk.append(record)
+            if len(chunk) >= CHUNK_SIZE:
+                flush()
+        flush()
+    except Exception as e:
+        table("migrations_imports").update({"status": "failed", "error": str(e)}).eq("id", import_id).execute()
+        raise
+
+    elapsed = time.perf_counter() - start
+    table("migrations_imports").update({"status": "completed"}).eq("id", import_id).execute()
+    # The upload is only needed to resume; drop it once everything is written
+    if os.path.exists(job["file_path"]):
+        os.remove(job["file_path"])
+    return {
+        "records_imported": chunk_start,
+        "seconds": round(elapsed, 2),
+        "rows_per_second": round(processed / elapsed, 1) if elapsed else None,
+    }
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        sys.exit("Usage: python importer.py <import_id>")
+    print(run_import(sys.argv[1]))
@@ -0,0 +1,263 @@
+"""
+Spending insights computed locally from the analytics snapshots (no LLM).
+
+- outliers: recent expenses far above what the vendor usually charges. The
+  score is a robust z-score, 0.6745 * (amount - median) / MAD, over the
+  vendor's expenses in the BASELINE_MONTHS before the recent window.
+- new_vendors: vendors whose first expense falls in the recent window.
+- spikes: categories/vendors whose spend this month already exceeds their
+  monthly baseline (mean of the previous BASELINE_MONTHS) by SPIKE_RATIO and
+  SPIKE_Z standard deviations.
+- trends: categories whose monthly spend has grown or shrunk steadily over
+  the previous BASELINE_MONTHS (least-squares slope, as % of the mean).
+
+Everything is computed with grouped NumPy operations over the snapshot
+columns, in the company's base currency. The snapshot picks up new bills
+incrementally, and results are reused until it changes (or for
+INSIGHTS_TTL_SECONDS, so new FX rates are picked up).
+"""
+from datetime import datetime
+import numpy as np
+import analytics
+import fx
+from cache import TTLCache
+
+RECENT_DAYS = 30
+BASELINE_MONTHS = 6
+MIN_BASELINE_EXPENSES = 5
+OUTLIER_SCORE = 3.5
+# MAD is floored at this fraction of the median, so a vendor that always
+# charges the same amount doesn't flag every cent of change
+MAD_FLOOR_FRACTION = 0.05
+MIN_ACTIVE_MONTHS = 3
+SPIKE_RATIO = 1.5
+SPIKE_Z = 2.0
+TREND_MIN_PERCENT = 10
+TREND_MIN_R2 = 0.6
+DEFAULT_LIMIT = 10
+INSIGHTS_TTL_SECONDS = 300
+
+_results = TTLCache(INSIGHTS_TTL_SECONDS)
+
+
+def grouped_median(groups: np.ndarray, values: np.ndarray, n_groups: int):
+    """Median of `values` per group code, and the group sizes (NaN median for empty groups)."""
+    order = np.lexsort((values, groups))
+    values = values[order]
+    counts = np.bincount(groups, minlength=n_groups)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    medians = np.full(n_groups, np.nan)
+    present = counts > 0
+    low = starts[present] + (counts[present] - 1) // 2
+    high = starts[present] + counts[present] // 2
+    medians[present] = (values[low] + values[high]) / 2
+    return medians, counts
+
+
+def _month(day: int):
+    return int(np.datetime64(day, "D").astype("datetime64[M]").astype(np.int64))
+
+
+def _date(day: int):
+    return str(np.datetime64(int(day), "D"))
+
+
+def _money(cents):
+    return round(float(cents) / 100, 2)
+
+
+def _outliers(data: dict, recent_start: int, limit: int):
+    days, cents, vendor = data["days"], data["cents"], data["vendor"]
+    n_vendors = len(data["vendor_names"])
+    baseline = (days < recent_start) & (days >= recent_start - BASELINE_MONTHS * 30)
+    medians, counts = grouped_median(vendor[baseline], cents[baseline], n_vendors)
+    deviations = np.abs(cents[baseline] - medians[vendor[baseline]])
+    mads, _ = grouped_median(vendor[baseline], deviations, n_vendors)
+    mads = np.fmax(mads, MAD_FLOOR_FRACTION * np.abs(medians))
+
+    recent = np.nonzero(days >= recent_start)[0]
+    recent = recent[counts[vendor[recent]] >= MIN_BASELINE_EXPENSES]
+    typical = medians[vendor[recent]]
+    scale = mads[vendor[recent]]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        scores = 0.6745 * (cents[recent] - typical) / scale
+    flagged = np.nonzero(scores > OUTLIER_SCORE)[0]
+    flagged = flagged[np.argsort(-scores[flagged], kind="stable")][:limit]
+    return [
+        {
+            "expense_id": data["ids"][recent[i]],
+            "vendor": data["vendor_names"][vendor[recent[i]]],
+            "category": data["category_names"][data["category"][recent[i]]],
+            "bill_date": _date(days[recent[i]]),
+            "amount": _money(cents[recent[i]]),
+            "typical_amount": _money(typical[i]),
+            "score": round(float(scores[i]), 1),
+        }
+        for i in flagged
+    ]
+
+
+def _new_vendors(data: dict, recent_start: int, limit: int):
+    days, cents, vendor = data["days"], data["cents"], data["vendor"]
+    n_vendors = len(data["vendor_names"])
+    first_day = np.full(n_vendors, np.iinfo(np.int32).max, dtype=np.int64)
+    np.minimum.at(first_day, vendor, days)
+    recent = days >= recent_start
+    counts = np.bincount(vendor[recent], minlength=n_vendors)
+    totals = np.bincount(vendor[recent], weights=cents[recent], minlength=n_vendors)
+    # Dictionary vendors with no rows here (all voided, deleted or unconvertible) are not new
+    seen = np.bincount(vendor, minlength=n_vendors) > 0
+    new = np.nonzero((first_day >= recent_start) & seen)[0]
+    new = new[np.argsort(-totals[new], kind="stable")][:limit]
+    return [
+        {
+            "vendor": data["vendor_names"][v],
+            "first_seen": _date(first_day[v]),
+            "expense_count": int(counts[v]),
+            "total_amount": _money(totals[v]),
+        }
+        for v in new
+    ]
+
+
+def _monthly_matrix(groups: np.ndarray, n_groups: int, data: dict, current_month: int):
+    """Spend per group per month, shape (n_groups, BASELINE_MONTHS + 1); the last column is current_month."""
+    width = BASELINE_MONTHS + 1
+    column = data["months"] - (current_month - BASELINE_MONTHS)
+    inside = (column >= 0) & (column < width)
+    flat = np.bincount(
+        groups[inside] * width + column[inside], weights=data["cents"][inside], minlength=n_groups * width,
+    )
+    return flat.reshape(n_groups, width)
+
+
+def _spikes(data: dict, by: str, current_month: int):
+    names = data[f"{by}_names"]
+    matrix = _monthly_matrix(data[by], len(names), data, current_month)
+    baseline, current = matrix[:, :-1], matrix[:, -1]
+    mean = baseline.mean(axis=1)
+    std = np.fmax(baseline.std(axis=1, ddof=1), 0.1 * mean)
+    active = (baseline > 0).sum(axis=1) >= MIN_ACTIVE_MONTHS
+    with np.errstate(divide="ignore", invalid="ignore"):
+        z = (current - mean) / std
+    flagged = np.nonzero(active & (current >= SPIKE_RATIO * mean) & (z >= SPIKE_Z))[0]
+    month = str(np.datetime64(current_month, "M"))
+    return [
+        {
+            "group": by,
+            "name": names[g],
+            "month": month,
+            "total_amount": _money(current[g]),
+            "baseline_amount": _money(mean[g]),
+            "change_percent": round(float((current[g] - mean[g]) / mean[g] * 100), 1),
+            "z": round(float(z[g]), 1),
+        }
+        for g in flagged
+    ]
+
+
+def _trends(data: dict, current_month: int, limit: int):
+    names = data["category_names"]
+    baseline = _monthly_matrix(data["category"], len(names), data, current_month)[:, :-1]
+    x = np.arange(BASELINE_MONTHS) - (BASELINE_MONTHS - 1) / 2
+    mean = baseline.mean(axis=1)
+    centered = baseline - mean[:, None]
+    slope = centered @ x / (x @ x)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        r2 = (centered @ x) ** 2 / ((x @ x) * (centered ** 2).sum(axis=1))
+        percent = slope / mean * 100
+    steady = (baseline > 0).sum(axis=1) >= BASELINE_MONTHS - 1
+    flagged = np.nonzero(steady & (np.abs(percent) >= TREND_MIN_PERCENT) & (r2 >= TREND_MIN_R2))[0]
+    flagged = flagged[np.argsort(-np.abs(percent[flagged]), kind="stable")][:limit]
+    first_month = str(np.datetime64(current_month - BASELINE_MONTHS, "M"))
+    last_month = str(np.datetime64(current_month - 1, "M"))
+    return [
+        {
+            "category": names[g],
+            "direction": "rising" if percent[g] > 0 else "falling",
+            "monthly_change_percent": round(float(percent[g]), 1),
+            "average_monthly_amount": _money(mean[g]),
+            "r2": round(float(r2[g]), 2),
+            "from_month": first_month,
+            "to_month": last_month,
+        }
+        for g in flagged
+    ]
+
+
+def _columns(snapshot, as_of: str, base: str):
+    """Copies of the snapshot columns for active, convertible rows up to as_of."""
+    with snapshot.lock:
+        mask = snapshot.mask(None, as_of)
+        cents, converted = snapshot.base_cents(mask, base)
+        rows = np.nonzero(mask)[0][converted]
+        data = {
+            "ids": [snapshot.ids[r] for r in rows],
+            "days": snapshot.days[rows].astype(np.int64),
+            "cents": cents[converted],
+            "vendor": snapshot.vendor[rows].astype(np.int64),
+            "category": snapshot.category[rows].astype(np.int64),
+            "vendor_names": list(snapshot.vendors.names),
+            "category_names": list(snapshot.categories.names),
+        }
+    data["months"] = data["days"].astype("datetime64[D]").astype("datetime64[M]").astype(np.int64)
+    return data
+
+
+def company_insights(company_id: str, as_of: str = None, limit: int = DEFAULT_LIMIT):
+    """Outliers, new vendors, spikes and trends for a company as of a date (default today)."""
+    as_of = as_of or datetime.utcnow().date().isoformat()
+    base = fx.base_currency(company_id)
+    snapshot = analytics.get_snapshot(company_id)
+    version = (snapshot.built_at, snapshot.watermark)
+    key = (company_id, as_of, limit, base)
+    cached = _results.get(key)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    data = _columns(snapshot, as_of, base)
+
+    as_of_day = fx.to_day(as_of)
+    recent_start = as_of_day - RECENT_DAYS + 1
+    current_month = _month(as_of_day)
+    spikes = _spikes(data, "category", current_month) + _spikes(data, "vendor", current_month)
+    spikes.sort(key=lambda s: s["total_amount"] - s["baseline_amount"], reverse=True)
+    result = {
+        "as_of": as_of,
+        "currency": base,
+        "recent_days": RECENT_DAYS,
+        "baseline_months": BASELINE_MONTHS,
+        "outliers": _outliers(data, recent_start, limit),
+        "new_vendors": _new_vendors(data, recent_start, limit),
+        "spikes": spikes[:limit],
+        "trends": _trends(data, current_month, limit),
+    }
+    _results.set(key, (version, result))
+    return result
+
+
+def describe(insights: dict, max_items: int = 3):
+    """A few short lines for the assistant's context."""
+    currency = insights["currency"]
+    lines = []
+    for o in insights["outliers"][:max_items]:
+        lines.append(
+            f"Unusual amount: {o['vendor']} on {o['bill_date']}, {o['amount']:.2f} {currency} "
+            f"(usually about {o['typical_amount']:.2f})"
+        )
+    for v in insights["new_vendors"][:max_items]:
+        lines.append(
+            f"New vendor: {v['vendor']} since {v['first_seen']}, "
+            f"{v['expense_count']} expenses totalling {v['total_amount']:.2f} {currency}"
+        )
+    for s in insights["spikes"][:max_items]:
+        lines.append(
+            f"Spending spike: {s['group']} {s['name']} at {s['total_amount']:.2f} {currency} in {s['month']} "
+            f"vs a {s['baseline_amount']:.2f} monthly average ({s['change_percent']:+.0f}%)"
+        )
+    for t in insights["trends"][:max_items]:
+        lines.append(
+            f"Trend: {t['category']} {t['direction']} about {abs(t['monthly_change_percent']):.0f}% per month "
+            f"from {t['from_month']} to {t['to_month']}"
+        )
+    return lines
@@ -0,0 +1,189 @@
+"""
+Background jobs run by the scheduler (see scheduler.py).
+
+Each job is a plain function taking keyword params (plus `company_id` when
+the run is scoped to one company) and returning a JSON-serializable summary
+that is stored in jobs.result.
+"""
+from datetime import datetime, timedelta
+from fastapi import HTTPException
+from database import table, rpc
+from scheduler import scheduler
+import analytics
+import audit
+import backfill_expenses
+import duplicates
+import importer
+import ledger
+import throttling
+
+HOUR = 3600
+DAY = 24 * HOUR
+
+
+def company_ids(company_id: str = None):
+    """The given company, or every company when None."""
+    if company_id:
+        return [company_id]
+    return [row["id"] for row in table("companies").select("id").execute().data]
+
+
+def month_bounds(day=None):
+    day = day or datetime.utcnow().date()
+    start = day.replace(day=1)
+    end = start.replace(year=start.year + 1, month=1) if start.month == 12 else start.replace(month=start.month + 1)
+    return start, end
+
+
+def refresh_reports_cache(company_id: str = None):
+    """Rebuild the current month's expense summary in reports_cache."""
+    period_start, period_end = month_bounds()
+    last_day = (period_end - timedelta(days=1)).isoformat()
+    refreshed = 0
+    for cid in company_ids(company_id):
+        # Vectorized group-bys over the company's columnar snapshot
+        totals = analytics.summary(cid, period_start.isoformat(), last_day)
+        by_category = analytics.group_totals(cid, "category", period_start.isoformat(), last_day)
+        by_vendor = analytics.group_totals(cid, "vendor", period_start.isoformat(), last_day)
+
+        report = {
+            "company_id": cid,
+            "report_name": "monthly_expenses",
+            "period_start": period_start.isoformat(),
+            "period_end": period_end.isoformat(),
+            "data": {
+                "expense_count": totals["expense_count"],
+                "total_amount": totals["total_amount"],
+                "currency": totals["currency"],
+                "by_category": {row["category"]: row["total_amount"] for row in by_category},
+                "by_vendor": {row["vendor"]: row["total_amount"] for row in by_vendor},
+            },
+            "generated_at": datetime.utcnow().isoformat(),
+        }
+        table("reports_cache").upsert(report, on_conflict="company_id,report_name,period_start").execute()
+        refreshed += 1
+    return {"companies": refreshed}
+
+
+def recompute_budget_actuals(company_id: str = None):
+    """Full recomputation of budgets.actual_amount; repairs any drift from the incremental trigger."""
+    response = rpc("recompute_budget_actuals", {"p_company_id": company_id}).execute()
+    return {"budgets_updated": response.data}
+
+
+def backfill_ai_suggestions(company_id: str = None, limit: int = 50):
+    """
+    Assign categories to uncategorized expenses using the AI (or rule-based)
+    suggestions. Every expense checked is marked, categorized or not, so each
+    run takes the next ones instead of paying for the same suggestions again.
+    """
+    # Imported here: routes pull in FastAPI routers that the sidecar doesn't otherwise need
+    from routes.ai_overlook import ai_enabled, get_ai_suggestions
+    from routes.expenses import resolve_category_id
+
+    query = (
+        table("expenses")
+        .select("id, company_id, amount, bill_date, memo, vendors(name)")
+        .is_("category_id", "null")
+        .neq("status", "void")
+        .is_("deleted_at", "null")
+        .is_("ai_category_attempted_at", "null")
+        .limit(limit)
+    )
+    if company_id:
+        query = query.eq("company_id", company_id)
+
+    checked = 0
+    categorized = 0
+    rows = query.execute().data
+    for row in rows:
+        attempted = {"ai_category_attempted_at": datetime.utcnow().isoformat()}
+        vendor = (row.get("vendors") or {}).get("name")
+        if not vendor:
+            table("expenses").update(attempted).eq("id", row["id"]).execute()
+            checked += 1
+            continue
+        request = dict(
+            company_id=row["company_id"],
+            vendor_name=vendor,
+            amount=row.get("amount"),
+            date=row.get("bill_date"),
+            memo=row.get("memo"),
+        )
+        if ai_enabled():
+            # Same per-company rate limit and fair LLM queue as the API. Rows of a
+            # company over its limit stay unmarked for the next run.
+            try:
+                throttling.limiter.check("llm", row["company_id"])
+            except HTTPException:
+                continue
+            with throttling.llm_queue.slot_sync(row["company_id"]):
+                suggestion = get_ai_suggestions(**request)
+        else:
+            suggestion = get_ai_suggestions(**request)
+        checked += 1
+        category_id = resolve_category_id(row["company_id"], suggestion.get("category"))
+        if not category_id:
+            table("expenses").update(attempted).eq("id", row["id"]).execute()
+            continue
+        table("expenses").update({"category_id": category_id, **attempted}).eq("id", row["id"]).execute()
+        audit.log_expense_change(
+            row["id"], row["company_id"], "updated",
+            old_values={"category_id": None}, new_values={"category_id": category_id},
+            reason="AI category backfill",
+        )
+        categorized += 1
+    return {"checked": checked, "categorized": categorized}
+
+
+def reindex_duplicates(company_id: str = None):
+    """Bulk duplicate scan per company; also rebuilds this process's duplicate index."""
+    groups = 0
+    for cid in company_ids(company_id):
+        groups += len(duplicates.scan_company(cid))
+    return {"duplicate_groups": groups}
+
+
+def verify_ledger(company_id: str = None):
+    """Compare account balances with a full recomputation and rebuild them if they drifted."""
+    mismatches = ledger.verify_balances(company_id)
+    rebuilt = ledger.recompute_balances(company_id) if mismatches else 0
+    return {"mismatches": len(mismatches), "account_months_rebuilt": rebuilt}
+
+
+def assign_ledger_accounts(company_id: str = None, limit: int = 1000):
+    """Map journal lines posted without an account onto chart_of_accounts."""
+    return {"assigned": ledger.assign_line_accounts(company_id, limit=limit)}
+
+
+def link_journal_entries(company_id: str = None):
+    """Link journal entries posted before entries carried expense_id to their expenses."""
+    return {"linked": ledger.link_legacy_entries(company_id)}
+
+
+def backfill_bills(batch_size: int = backfill_expenses.DEFAULT_BATCH_SIZE, max_batches: int = 20):
+    """Copy legacy bills into expenses; continues from the cursor the previous run stored in its result."""
+    last = (
+        table("jobs")
+        .select("result")
+        .eq("job_name", "backfill_bills")
+        .eq("status", "completed")
+        .order("finished_at", desc=True)
+        .limit(1)
+        .execute()
+        .data
+    )
+    after_id = (last[0].get("result") or {}).get("cursor") if last else None
+    return backfill_expenses.backfill(batch_size=batch_size, max_batches=max_batches, after_id=after_id)
+
+
+scheduler.register("refresh_reports_cache", refresh_reports_cache, interval=HOUR)
+scheduler.register("recompute_budget_actuals", recompute_budget_actuals, interval=DAY)
+scheduler.register("backfill_ai_suggestions", backfill_ai_suggestions, interval=6 * HOUR)
+scheduler.register("reindex_duplicates", reindex_duplicates, interval=DAY)
+scheduler.register("verify_ledger", verify_ledger, interval=DAY)
+scheduler.register("assign_ledger_accounts", assign_ledger_accounts)
+scheduler.register("link_journal_entries", link_journal_entries)
+scheduler.register("backfill_bills", backfill_bills)
+# Failed imports resume from their checkpoint on retry
+scheduler.register("import_accounting_file", importer.run_import, max_attempts=5)
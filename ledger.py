@@ -0,0 +1,281 @@
+"""
+Ledger: maps expenses onto chart_of_accounts and posts their journal entries.
+
+An expense debits its category's account and credits the account of the
+payment method used. Mappings live on categories.account_id and
+payment_methods.account_id and are filled in on first use. Entries are
+posted in the company's base currency, converted at the bill date's rate.
+
+Account balances are maintained in the database: triggers on journal_lines
+and journal_entries keep account_balances (monthly totals plus running
+closing balances) current, so posting or voiding an entry here is all it
+takes to move them. An entry and its lines are written together by the
+post_journal_entry function. It and the SQL functions account_balance_as_of,
+trial_balance, verify_account_balances, recompute_account_balances and
+link_expense_journal_entries are in schema.sql.
+"""
+from datetime import datetime
+from database import table, rpc
+from cache import TTLCache
+import fx
+
+ACCOUNT_TTL_SECONDS = 300
+
+DEFAULT_EXPENSE_ACCOUNT = ("Uncategorized Expense", "expense")
+# payment_methods.type (or the payment_method given on a manual entry) -> account credited
+PAYMENT_METHOD_ACCOUNTS = {
+    "cash": ("Cash", "asset"),
+    "check": ("Checking Account", "asset"),
+    "bank_account": ("Checking Account", "asset"),
+    "debit_card": ("Checking Account", "asset"),
+    "credit_card": ("Credit Card", "liability"),
+    "paypal": ("PayPal", "asset"),
+}
+DEFAULT_PAYMENT_ACCOUNT = ("Accounts Payable", "liability")
+
+# (company_id, account_name) -> chart_of_accounts id
+_account_ids = TTLCache(ACCOUNT_TTL_SECONDS)
+
+
+def get_or_create_account(company_id: str, name: str, account_type: str):
+    key = (company_id, name)
+    account_id = _account_ids.get(key)
+    if account_id:
+        return account_id
+    existing = (
+        table("chart_of_accounts")
+        .select("id")
+        .eq("company_id", company_id)
+        .eq("account_name", name)
+        .limit(1)
+        .execute()
+    )
+    if existing.data:
+        account_id = existing.data[0]["id"]
+    else:
+        account_id = table("chart_of_accounts").insert({
+            "company_id": company_id,
+            "account_name": name,
+            "account_type": account_type,
+        }).execute().data[0]["id"]
+    _account_ids.set(key, account_id)
+    return account_id
+
+
+def expense_account_id(company_id: str, category_id: str = None):
+    """Debit side: the category's account (an expense account named after it, mapped on first use)."""
+    category = None
+    if category_id:
+        response = table("categories").select("name, account_id").eq("id", category_id).execute()
+        category = response.data[0] if response.data else None
+    if not category:
+        return get_or_create_account(company_id, *DEFAULT_EXPENSE_ACCOUNT)
+    if category.get("account_id"):
+        return category["account_id"]
+    account_id = get_or_create_account(company_id, category["name"], "expense")
+    table("categories").update({"account_id": account_id}).eq("id", category_id).execute()
+    return account_id
+
+
+def payment_account_id(company_id: str, payment_method: str = None):
+    """
+    Credit side: the account of a named payment method (mapped on first use
+    from its type), or of a payment type such as "cash" or "credit_card".
+    Anything unrecognized is credited to Accounts Payable.
+    """
+    method = (payment_method or "").strip()
+    if method:
+        response = (
+            table("payment_methods")
+            .select("id, type, account_id")
+            .eq("company_id", company_id)
+            .eq("name", method)
+            .limit(1)
+            .execute()
+        )
+        if response.data:
+            row = response.data[0]
+            if row.get("account_id"):
+                return row["account_id"]
+            account_id = get_or_create_account(company_id, *PAYMENT_METHOD_ACCOUNTS.get(row["type"], DEFAULT_PAYMENT_ACCOUNT))
+            table("payment_methods").update({"account_id": account_id}).eq("id", row["id"]).execute()
+            return account_id
+    key = method.lower().replace(" ", "_")
+    return get_or_create_account(company_id, *PAYMENT_METHOD_ACCOUNTS.get(key, DEFAULT_PAYMENT_ACCOUNT))
+
+
+def post_expense_entry(expense: dict, credit_account_id: str, memo: str,
+                       debit_description: str = "Expense", credit_description: str = "Payment",
+                       created_by: str = None, replace: bool = False):
+    """
+    Post the journal entry for an expense row, with its lines, in one
+    transaction. `replace` voids the expense's current entries in the same
+    transaction. Returns the inserted journal_entries rows.
+    """
+    # Conversion (ValueError without a rate) and account lookups run before anything is written
+    base = fx.base_currency(expense["company_id"])
+    amount = fx.convert_amount(expense["amount"], expense.get("currency"), base, expense["bill_date"])
+    debit_account_id = expense_account_id(expense["company_id"], expense.get("category_id"))
+
+    entry = {
+        "company_id": expense["company_id"],
+        "expense_id": expense["id"],
+        "entry_date": expense["bill_date"],
+        "memo": memo,
+        "status": "posted",
+        "created_by": created_by,
+    }
+    lines = [
+        {"account_id": debit_account_id, "description": debit_description, "debit": amount, "credit": 0},
+        {"account_id": credit_account_id, "description": credit_description, "debit": 0, "credit": amount},
+    ]
+    return rpc("post_journal_entry", {
+        "p_entry": entry,
+        "p_lines": lines,
+        "p_replace_expense_id": expense["id"] if replace else None,
+    }).execute().data
+
+
+def link_legacy_entries(company_id: str = None, expense_id: str = None):
+    """
+    Set expense_id on journal entries posted before entries carried it,
+    matched by company, date, vendor (from the memo) and amount. Returns the
+    number of entries linked.
+    """
+    response = rpc("link_expense_journal_entries", {"p_company_id": company_id, "p_expense_id": expense_id}).execute()
+    return response.data or 0
+
+
+def void_expense_entries(expense_id: str):
+    """Void the expense's posted journal entries (the balance triggers reverse their lines)."""
+    def void():
+        return (
+            table("journal_entries")
+            .update({"status": "void"})
+            .eq("expense_id", expense_id)
+            .eq("status", "posted")
+            .execute()
+            .data
+        )
+
+    voided = void()
+    if not voided and link_legacy_entries(expense_id=expense_id):
+        voided = void()
+    return voided
+
+
+def repost_expense(expense: dict):
+    """
+    After an expense's amount, currency, date or category changed: void its entry and
+    post a replacement (atomically), keeping the original's payment account, memo
+    and line descriptions. Expenses without an entry (even a legacy one) are left alone.
+    """
+    def latest_entry():
+        return (
+            table("journal_entries")
+            .select("id, memo, created_by, journal_lines(account_id, description, debit, credit)")
+            .eq("expense_id", expense["id"])
+            .order("created_at", desc=True)
+            .limit(1)
+            .execute()
+            .data
+        )
+
+    entries = latest_entry()
+    if not entries and link_legacy_entries(expense_id=expense["id"]):
+        entries = latest_entry()
+    if not entries:
+        return None
+    previous = entries[0]
+    lines = previous.get("journal_lines") or []
+    debit_line = next((l for l in lines if float(l.get("debit") or 0) > 0), {})
+    credit_line = next((l for l in lines if float(l.get("credit") or 0) > 0), {})
+
+    return post_expense_entry(
+        expense,
+        credit_line.get("account_id") or payment_account_id(expense["company_id"]),
+        previous.get("memo"),
+        debit_description=debit_line.get("description") or "Expense",
+        credit_description=credit_line.get("description") or "Payment",
+        created_by=previous.get("created_by"),
+        replace=True,
+    )
+
+
+def assign_line_accounts(company_id: str = None, limit: int = 1000):
+    """
+    Fill in account_id on journal lines posted before the ledger existed.
+    Manual-entry lines are described "<category> expense" / "<payment method>
+    payment", which is enough to find both accounts.
+    """
+    query = (
+        table("journal_lines")
+        .select("id, description, debit, journal_entries!inner(company_id)")
+        .is_("account_id", "null")
+        .limit(limit)
+    )
+    if company_id:
+        query = query.eq("journal_entries.company_id", company_id)
+    lines = query.execute().data
+
+    resolved = {}
+    assigned = 0
+    for line in lines:
+        cid = line["journal_entries"]["company_id"]
+        description = (line.get("description") or "").strip()
+        is_debit = float(line.get("debit") or 0) > 0
+        key = (cid, description, is_debit)
+        if key not in resolved:
+            if is_debit:
+                name = description.removesuffix(" expense")
+                category = (
+                    table("categories").select("id").eq("company_id", cid).eq("name", name).limit(1).execute().data
+                )
+                resolved[key] = expense_account_id(cid, category[0]["id"] if category else None)
+            else:
+                resolved[key] = payment_account_id(cid, description.removesuffix(" payment"))
+        table("journal_lines").update({"account_id": resolved[key]}).eq("id", line["id"]).execute()
+        assigned += 1
+    return assigned
+
+
+def as_of_date(as_of: str = None):
+    return as_of or datetime.utcnow().date().isoformat()
+
+
+def balance_as_of(account_id: str, as_of: str = None):
+    """Account balance (debits - credits) at the end of `as_of` (default today)."""
+    response = rpc("account_balance_as_of", {"p_account_id": account_id, "p_as_of": as_of_date(as_of)}).execute()
+    return float(response.data or 0)
+
+
+def trial_balance(company_id: str, as_of: str = None):
+    """Every account's balance at `as_of`, split into debit and credit columns with totals."""
+    rows = rpc("trial_balance", {"p_company_id": company_id, "p_as_of": as_of_date(as_of)}).execute().data or []
+    accounts = []
+    total_debit = total_credit = 0.0
+    for row in rows:
+        balance = float(row.get("balance") or 0)
+        if balance == 0:
+            continue
+        debit, credit = (balance, 0.0) if balance > 0 else (0.0, -balance)
+        total_debit += debit
+        total_credit += credit
+        accounts.append(dict(row, balance=balance, debit=debit, credit=credit))
+    return {
+        "as_of": as_of_date(as_of),
+        "accounts": accounts,
+        "total_debit": round(total_debit, 2),
+        "total_credit": round(total_credit, 2),
+        "balanced": round(total_debit - total_credit, 2) == 0,
+    }
+
+
+def verify_balances(company_id: str = None):
+    """Account-months where stored balances differ from a full recomputation (empty when consistent)."""
+    return rpc("verify_account_balances", {"p_company_id": company_id}).execute().data or []
+
+
+def recompute_balances(company_id: str = None):
+    """Rebuild account_balances from posted journal lines. Returns account-months written."""
+    return rpc("recompute_account_balances", {"p_company_id": company_id}).execute().data
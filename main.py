@@ -1,9 +1,16 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
+from compression import CompressionMiddleware
 from database import table
-from routes import users, companies, expenses, parser, ai_overlook, categories
+from jobs import scheduler
+import cache
+import os
+import receipt_store
+from routes import users, companies, expenses, parser, ai_overlook, categories, jobs, imports, ledger, receipts, search, quotas
 
-app = FastAPI(title="AI Financial Companion Backend")
+# orjson serializes the large listing payloads several times faster than json
+app = FastAPI(title="AI Financial Companion Backend", default_response_class=ORJSONResponse)
 
 # CORS middleware for frontend
 app.add_middleware(
@@ -12,8 +19,22 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Let the frontend read ETags for If-None-Match revalidation
+    expose_headers=["ETag"],
 )
 
+# Brotli/gzip response compression
+app.add_middleware(CompressionMiddleware)
+
+# Request-scoped memo so a handler never fetches the same user/company twice
+@app.middleware("http")
+async def request_memo(request: Request, call_next):
+    token = cache.begin_request()
+    try:
+        return await call_next(request)
+    finally:
+        cache.end_request(token)
+
 # include routers
 app.include_router(users.router)
 app.include_router(companies.router)
@@ -21,6 +42,25 @@ app.include_router(expenses.router)
 app.include_router(parser.router)
 app.include_router(ai_overlook.router)
 app.include_router(categories.router)
+app.include_router(jobs.router)
+app.include_router(imports.router)
+app.include_router(ledger.router)
+app.include_router(receipts.router)
+app.include_router(search.router)
+app.include_router(quotas.router)
+
+# Background jobs run in-process when SCHEDULER_ENABLED=1; otherwise run
+# `python scheduler.py` as a sidecar
+@app.on_event("startup")
+async def start_scheduler():
+    if os.getenv("SCHEDULER_ENABLED", "0") == "1":
+        scheduler.start()
+
+@app.on_event("shutdown")
+async def shutdown_workers():
+    await scheduler.stop()
+    parser.shutdown_ocr_pool()
+    receipt_store.shutdown_thumbnail_pool()
 
 @app.get("/")
 def read_root():
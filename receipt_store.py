@@ -0,0 +1,213 @@
+"""
+Receipt file storage.
+
+Uploaded receipts are kept, content-addressed by SHA-256, so the same file
+uploaded twice is stored once and OCR'd once: its extracted text and fields
+are saved in the `receipts` table and reused. Thumbnails and previews are
+generated in a background worker pool after the upload is answered.
+
+LocalStore writes under RECEIPT_STORAGE_DIR. Keys are plain relative paths
+('ab/cd/<sha256>.jpg'), so an object store (S3, Supabase Storage) can stand
+in behind the same put/open/exists/size interface.
+"""
+import hashlib
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from database import table
+
+STORAGE_DIR = os.getenv("RECEIPT_STORAGE_DIR", "uploads/receipts")
+THUMBNAIL_WORKERS = int(os.getenv("THUMBNAIL_WORKERS", "2"))
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+
+THUMBNAIL_SIZE = 256
+PREVIEW_SIZE = 1024
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+PREVIEWABLE_EXTENSIONS = IMAGE_EXTENSIONS + (".pdf",)
+
+CONTENT_TYPES = {
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".png": "image/png",
+    ".pdf": "application/pdf",
+    ".csv": "text/csv",
+}
+
+
+class LocalStore:
+    """Filesystem stand-in for an object store."""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def path(self, key: str):
+        return os.path.join(self.root, key)
+
+    def exists(self, key: str):
+        return os.path.exists(self.path(key))
+
+    def size(self, key: str):
+        return os.path.getsize(self.path(key))
+
+    def put_file(self, source_path: str, key: str):
+        """Move a local file into the store under `key` (a no-op if the key already exists)."""
+        target = self.path(key)
+        if os.path.exists(target):
+            os.remove(source_path)
+            return
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(source_path, target)
+
+    def open(self, key: str):
+        return open(self.path(key), "rb")
+
+
+store = LocalStore(STORAGE_DIR)
+_thumbnail_pool = None
+
+
+def content_key(sha256: str, ext: str):
+    return f"{sha256[:2]}/{sha256[2:4]}/{sha256}{ext}"
+
+
+def derived_key(sha256: str, name: str):
+    """Key of a file generated from the original (thumbnail, preview)."""
+    return f"{sha256[:2]}/{sha256[2:4]}/{sha256}.{name}.jpg"
+
+
+async def save_upload(file):
+    """
+    Stream an UploadFile to a temp file of its own, hashing as it goes.
+    Returns (sha256, key, size_bytes, temp_path). The caller moves the temp
+    file to `key` with store.put_file once its receipts row is being recorded
+    (identical content is stored once), or drops it with discard_upload.
+    """
+    ext = os.path.splitext(file.filename or "")[1].lower()
+    digest = hashlib.sha256()
+    size = 0
+    os.makedirs(STORAGE_DIR, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=STORAGE_DIR, suffix=ext)
+    with os.fdopen(fd, "wb") as f:
+        while chunk := await file.read(UPLOAD_CHUNK_BYTES):
+            digest.update(chunk)
+            f.write(chunk)
+            size += len(chunk)
+    sha256 = digest.hexdigest()
+    return sha256, content_key(sha256, ext), size, temp_path
+
+
+def discard_upload(temp_path: str):
+    """Delete a temp file that was not kept (e.g. an upload whose extraction failed). Stored files are never touched."""
+    try:
+        os.remove(temp_path)
+    except FileNotFoundError:
+        pass
+
+
+def find_processed(sha256: str):
+    """A receipts row with the same content whose text was already extracted, or None."""
+    response = (
+        table("receipts")
+        .select("*")
+        .eq("sha256", sha256)
+        .not_.is_("extracted_text", "null")
+        .limit(1)
+        .execute()
+    )
+    return response.data[0] if response.data else None
+
+
+def record_receipt(company_id, sha256: str, key: str, file_name: str, size: int,
+                   raw_text: str, parsed_fields: dict, fingerprint: str = None):
+    """Insert (or refresh) the company's receipts row for this content."""
+    existing = table("receipts").select("*").eq("sha256", sha256)
+    existing = existing.eq("company_id", company_id) if company_id else existing.is_("company_id", "null")
+    existing = existing.limit(1).execute().data
+    fields = {
+        "extracted_text": raw_text,
+        "parsed_fields": parsed_fields,
+        "receipt_fingerprint": fingerprint,
+    }
+    if existing:
+        return table("receipts").update(fields).eq("id", existing[0]["id"]).execute().data[0]
+
+    # Another company may already have had the thumbnails generated
+    thumbnail_key = derived_key(sha256, "thumb")
+    preview_key = derived_key(sha256, "preview")
+    ext = os.path.splitext(key)[1]
+    return table("receipts").insert({
+        "company_id": company_id,
+        "sha256": sha256,
+        "storage_key": key,
+        "file_name": file_name,
+        "content_type": CONTENT_TYPES.get(ext, "application/octet-stream"),
+        "size_bytes": size,
+        "thumbnail_key": thumbnail_key if store.exists(thumbnail_key) else None,
+        "preview_key": preview_key if store.exists(preview_key) else None,
+        **fields,
+    }).execute().data[0]
+
+
+# -- thumbnails --------------------------------------------------------------
+
+def _first_page_image(key: str):
+    from PIL import Image, ImageOps
+
+    ext = os.path.splitext(key)[1]
+    if ext in IMAGE_EXTENSIONS:
+        with Image.open(store.path(key)) as image:
+            return ImageOps.exif_transpose(image).convert("RGB")
+    if ext == ".pdf":
+        from pdf2image import convert_from_path
+        pages = convert_from_path(store.path(key), dpi=72, first_page=1, last_page=1)
+        return pages[0].convert("RGB") if pages else None
+    return None
+
+
+def _write_resized(image, size: int, key: str):
+    copy = image.copy()
+    copy.thumbnail((size, size))
+    target = store.path(key)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    # A temp name of its own: the same file may be thumbnailed for two uploads at once
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(target), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            copy.save(f, "JPEG", quality=80, optimize=True)
+        os.replace(temp_path, target)
+    except BaseException:
+        discard_upload(temp_path)
+        raise
+
+
+def generate_thumbnails(sha256: str, key: str):
+    """Create the thumbnail and preview for a stored file and point its receipts rows at them."""
+    thumbnail_key = derived_key(sha256, "thumb")
+    preview_key = derived_key(sha256, "preview")
+    try:
+        if not (store.exists(thumbnail_key) and store.exists(preview_key)):
+            image = _first_page_image(key)
+            if image is None:
+                return
+            _write_resized(image, PREVIEW_SIZE, preview_key)
+            _write_resized(image, THUMBNAIL_SIZE, thumbnail_key)
+        table("receipts").update({"thumbnail_key": thumbnail_key, "preview_key": preview_key}).eq("sha256", sha256).execute()
+    except Exception as e:
+        print(f"Thumbnail generation failed for {key}: {e}")
+
+
+def schedule_thumbnails(sha256: str, key: str):
+    """Queue thumbnail generation; returns immediately."""
+    global _thumbnail_pool
+    if os.path.splitext(key)[1] not in PREVIEWABLE_EXTENSIONS:
+        return
+    if _thumbnail_pool is None:
+        _thumbnail_pool = ThreadPoolExecutor(max_workers=THUMBNAIL_WORKERS, thread_name_prefix="thumbnails")
+    _thumbnail_pool.submit(generate_thumbnails, sha256, key)
+
+
+def shutdown_thumbnail_pool():
+    global _thumbnail_pool
+    if _thumbnail_pool is not None:
+        _thumbnail_pool.shutdown(wait=False, cancel_futures=True)
+        _thumbnail_pool = None
@@ -1,10 +1,39 @@
 from fastapi import APIRouter, HTTPException
+from fastapi.concurrency import run_in_threadpool
+import asyncio
 import os
+import json
 from datetime import datetime
 from database import table
+import analytics
+import duplicates
+import insights
+import throttling
 
 router = APIRouter(prefix="/ai", tags=["AI Overlook"])
 
+# Suggestion fields that depend only on the (vendor, category) key, so batch
+# items with the same key can share them. The memo is written from one item's
+# own memo and amount and is never given to another item.
+SHARED_SUGGESTION_FIELDS = ("normalized_vendor", "category")
+
+# /ai/overlook_batch: items per request, distinct vendors packed into one
+# prompt, and prompts in flight at once per request (all LLM calls also share
+# the fair queue's LLM_CONCURRENCY slots)
+BATCH_MAX_ITEMS = 200
+VENDORS_PER_PROMPT = 20
+AI_MAX_CONCURRENCY = int(os.getenv("AI_MAX_CONCURRENCY", "4"))
+
+
+def ai_enabled():
+    return bool(os.getenv("OPENAI_API_KEY", ""))
+
+
+async def run_llm(tenant: str, func, /, *args, **kwargs):
+    """Run a sync function that calls the LLM in the threadpool, holding one of `tenant`'s LLM slots."""
+    async with throttling.llm_queue.slot(tenant):
+        return await run_in_threadpool(func, *args, **kwargs)
+
 
 def get_ai_suggestions(company_id: str, vendor_name: str, amount: float, date: str, category: str = None, memo: str = None):
     """
@@ -48,7 +77,6 @@ Respond in JSON format:
                 response_format={"type": "json_object"}
             )
 
-            import json
             suggestions = json.loads(response.choices[0].message.content)
 
             return {
@@ -61,7 +89,11 @@ Respond in JSON format:
             print(f"OpenAI API error: {e}")
             # Fall through to basic suggestions
 
-    # Fallback: Basic rule-based suggestions
+    return rule_based_suggestions(vendor_name, category, memo)
+
+
+def rule_based_suggestions(vendor_name: str, category: str = None, memo: str = None):
+    """Basic suggestions used when OpenAI is not configured or fails."""
     normalized_vendor = vendor_name.strip().title()
     suggested_category = category or "Uncategorized"
     suggested_memo = memo or f"{normalized_vendor} expense"
@@ -84,8 +116,95 @@ Respond in JSON format:
     }
 
 
+def validate_expense(expense_data: dict):
+    """Local validation rules shared by the single and batch overlook endpoints."""
+    issues = []
+    amount = expense_data.get("amount")
+    date = expense_data.get("date")
+    if not expense_data.get("vendor_name"):
+        issues.append("Vendor name is required")
+    if not isinstance(amount, (int, float)) or amount <= 0:
+        issues.append("Amount must be greater than 0")
+    if not date:
+        issues.append("Date is required")
+    else:
+        # Validate date format
+        try:
+            datetime.strptime(date, "%Y-%m-%d")
+        except (TypeError, ValueError):
+            issues.append("Date must be in YYYY-MM-DD format")
+    return issues
+
+
+def get_packed_suggestions(items: list):
+    """
+    Suggestions for several distinct vendors from a single OpenAI call.
+    `items` are dicts with vendor_name, amount, date, category and memo;
+    returns one suggestion per item, in order. Items the model skips (or
+    every item, without OPENAI_API_KEY) get the rule-based suggestions.
+    """
+    results = [None] * len(items)
+    openai_key = os.getenv("OPENAI_API_KEY", "")
+    if openai_key:
+        try:
+            from openai import OpenAI
+            client = OpenAI(api_key=openai_key)
+
+            listing = "\n".join(
+                f"{i}. Vendor: {item['vendor_name']} | Amount: ${item['amount']} | Date: {item['date']} | "
+                f"Category: {item.get('category') or 'Not provided'} | Memo: {item.get('memo') or 'Not provided'}"
+                for i, item in enumerate(items)
+            )
+            prompt = f"""Analyze each of these expenses and provide suggestions:
+{listing}
+
+For each expense provide a normalized vendor name (clean, standardized), an
+appropriate expense category (e.g., Office Supplies, Travel, Meals & Entertainment,
+Software & Services, etc.) and a concise memo.
+
+Respond in JSON format:
+{{
+  "results": [
+    {{"id": 0, "normalized_vendor": "standardized name", "category": "category name", "memo": "brief description"}}
+  ]
+}}"""
+
+            response = client.chat.completions.create(
+                model="gpt-4o-mini",
+                messages=[
+                    {"role": "system", "content": "You are a financial assistant helping categorize business expenses. Respond only with valid JSON."},
+                    {"role": "user", "content": prompt}
+                ],
+                temperature=0.3,
+                response_format={"type": "json_object"}
+            )
+
+            for suggestion in json.loads(response.choices[0].message.content).get("results", []):
+                i = suggestion.get("id")
+                if isinstance(i, int) and 0 <= i < len(items):
+                    item = items[i]
+                    results[i] = {
+                        "normalized_vendor": suggestion.get("normalized_vendor", item["vendor_name"]),
+                        "category": suggestion.get("category", item.get("category") or "Uncategorized"),
+                        "memo": suggestion.get("memo", item.get("memo") or f"{item['vendor_name']} expense")
+                    }
+
+        except Exception as e:
+            print(f"OpenAI API error: {e}")
+
+    return [
+        result or rule_based_suggestions(item["vendor_name"], item.get("category"), item.get("memo"))
+        for item, result in zip(items, results)
+    ]
+
+
+def suggestion_key(item: dict):
+    """Batch items with the same vendor (after normalization) and category share one suggestion."""
+    return duplicates.normalize_vendor(item["vendor_name"]), (item.get("category") or "").strip().lower()
+
+
 @router.post("/overlook_expense")
-def overlook_expense(expense_data: dict):
+async def overlook_expense(expense_data: dict):
     """
     AI-powered expense validation and suggestion.
     Returns issues, suggestions, and a JSON patch for the expense.
@@ -98,27 +217,21 @@ def overlook_expense(expense_data: dict):
         category = expense_data.get("category")
         memo = expense_data.get("memo")
 
-        # Validation
-        issues = []
-        if not vendor_name:
-            issues.append("Vendor name is required")
-        if not amount or amount <= 0:
-            issues.append("Amount must be greater than 0")
-        if not date:
-            issues.append("Date is required")
-        else:
-            # Validate date format
-            try:
-                datetime.strptime(date, "%Y-%m-%d")
-            except ValueError:
-                issues.append("Date must be in YYYY-MM-DD format")
-
+        issues = validate_expense(expense_data)
         valid = len(issues) == 0
 
+        # Flag likely duplicates of expenses already entered
+        possible_duplicates = []
+        if valid and company_id:
+            possible_duplicates = await run_in_threadpool(
+                duplicates.find_duplicates,
+                company_id, vendor_name, amount, date, expense_data.get("receipt_fingerprint"),
+            )
+
         # Get AI suggestions
         suggestions = {}
         if valid:
-            suggestions = get_ai_suggestions(
+            request = dict(
                 company_id=company_id,
                 vendor_name=vendor_name,
                 amount=amount,
@@ -126,20 +239,160 @@ def overlook_expense(expense_data: dict):
                 category=category,
                 memo=memo
             )
+            if ai_enabled():
+                # One LLM token, then a fair-queue slot for the call
+                throttling.limiter.check("llm", company_id, expense_data.get("user_id"))
+                suggestions = await run_llm(company_id, get_ai_suggestions, **request)
+            else:
+                suggestions = get_ai_suggestions(**request)
 
         return {
             "valid": valid,
             "issues": issues,
             "suggestions": suggestions,
-            "json_patch": suggestions  # Same as suggestions for now
+            "json_patch": suggestions,  # Same as suggestions for now
+            "possible_duplicates": possible_duplicates
         }
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing expense: {str(e)}")
 
 
+@router.post("/overlook_batch")
+async def overlook_batch(batch: dict):
+    """
+    Validate and enrich many expenses in one call.
+    Body: {"company_id": "uuid", "expenses": [{vendor_name, amount, date, category, memo}, ...]}
+    Items are validated locally with the same rules as /ai/overlook_expense.
+    Each distinct vendor is sent to the AI once, with vendors packed several
+    to a prompt and a bounded number of prompts in flight. Each prompt costs
+    one of the company's LLM tokens.
+    """
+    try:
+        items = batch.get("expenses") or []
+        if not isinstance(items, list):
+            raise HTTPException(status_code=400, detail="expenses must be a list")
+        if len(items) > BATCH_MAX_ITEMS:
+            raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_ITEMS} expenses per batch")
+
+        results = []
+        # (normalized vendor, category) -> index of the first item with it
+        groups = {}
+        for index, item in enumerate(items):
+            item = item if isinstance(item, dict) else {}
+            issues = validate_expense(item)
+            result = {"index": index, "valid": not issues, "issues": issues, "suggestions": {},
+                      "json_patch": {}, "possible_duplicates": []}
+            results.append(result)
+            if issues:
+                continue
+
+            company_id = item.get("company_id") or batch.get("company_id")
+            if company_id:
+                result["possible_duplicates"] = await run_in_threadpool(
+                    duplicates.find_duplicates,
+                    company_id, item["vendor_name"], item["amount"], item["date"], item.get("receipt_fingerprint"),
+                )
+            groups.setdefault(suggestion_key(item), index)
+
+        representatives = [items[i] for i in groups.values()]
+        packs = [representatives[i:i + VENDORS_PER_PROMPT] for i in range(0, len(representatives), VENDORS_PER_PROMPT)]
+        suggestions = []
+        if packs and ai_enabled():
+            # Every prompt is paid for up front, all or nothing
+            company_id = batch.get("company_id")
+            throttling.limiter.check("llm", company_id, batch.get("user_id"), cost=len(packs))
+            in_flight = asyncio.Semaphore(AI_MAX_CONCURRENCY)
+
+            async def suggest(pack):
+                async with in_flight:
+                    return await run_llm(company_id, get_packed_suggestions, pack)
+
+            for pack_suggestions in await asyncio.gather(*(suggest(pack) for pack in packs)):
+                suggestions.extend(pack_suggestions)
+        else:
+            for pack in packs:
+                suggestions.extend(get_packed_suggestions(pack))
+        by_index = dict(zip(groups.values(), suggestions))
+        by_key = dict(zip(groups, suggestions))
+
+        for result in results:
+            if not result["valid"]:
+                continue
+            index = result["index"]
+            item = items[index]
+            if index in by_index:
+                # The item the prompt was written from keeps its whole suggestion
+                suggestion = by_index[index]
+            else:
+                shared = by_key[suggestion_key(item)]
+                suggestion = {field: shared[field] for field in SHARED_SUGGESTION_FIELDS}
+                suggestion["memo"] = item.get("memo") or f"{suggestion['normalized_vendor']} expense"
+            result["suggestions"] = suggestion
+            result["json_patch"] = suggestion
+
+        return {
+            "results": results,
+            "summary": {
+                "items": len(items),
+                "valid": sum(1 for r in results if r["valid"]),
+                "unique_vendors": len(groups),
+                "ai_requests": len(packs) if ai_enabled() else 0,
+            }
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error processing batch: {str(e)}")
+
+
+# Spending insights (no AI tokens used)
+@router.get("/insights")
+def get_insights(company_id: str, as_of: str = None, limit: int = insights.DEFAULT_LIMIT):
+    """
+    Unusual amounts, new vendors, spending spikes and steady trends, computed
+    from the company's expense history against rolling monthly baselines.
+    """
+    try:
+        if as_of:
+            try:
+                as_of = datetime.strptime(as_of, "%Y-%m-%d").date().isoformat()
+            except ValueError:
+                raise HTTPException(status_code=400, detail="as_of must be a date (YYYY-MM-DD)")
+        limit = max(1, min(limit, 100))
+        return {"status": "success", "data": insights.company_insights(company_id, as_of, limit)}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+def query_context_data(company_id: str):
+    """Totals, top vendors, recent expenses and notable patterns for the assistant's context."""
+    # Summarize from the company's columnar snapshot instead of fetching every expense
+    totals = analytics.summary(company_id)
+    top_vendors = analytics.group_totals(company_id, by="vendor", limit=5)
+    recent_expenses = (
+        table("expenses")
+        .select("bill_date, memo, total_amount:amount, currency, vendors(name)")
+        .eq("company_id", company_id)
+        .neq("status", "void")
+        .is_("deleted_at", "null")
+        .order("bill_date", desc=True)
+        .limit(10)
+        .execute()
+        .data
+    ) or []
+    # Outliers, new vendors, spikes and trends, computed locally
+    patterns = insights.describe(insights.company_insights(company_id))
+    return totals, top_vendors, recent_expenses, patterns
+
+
 @router.post("/query")
-def ai_query(query_data: dict):
+async def ai_query(query_data: dict):
     """
     AI-powered financial assistant that answers questions about your expenses.
     Acts as a helpful, friendly accountant companion.
@@ -161,58 +414,52 @@ def ai_query(query_data: dict):
                 status_code=503,
                 detail="AI assistant requires OPENAI_API_KEY to be configured. Please add it to your .env file."
             )
+        throttling.limiter.check("llm", company_id, query_data.get("user_id"))
 
-        # Fetch expense data for the company
+        # Async route (so queued requests hold no threads): blocking work goes to the threadpool
         try:
-            expenses_resp = table("bills").select("*, vendors(name)").eq("company_id", company_id).execute()
-            expenses = expenses_resp.data or []
+            totals, top_vendors, recent_expenses, patterns = await run_in_threadpool(query_context_data, company_id)
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Error fetching expense data: {str(e)}")
 
         # Prepare expense summary for AI
-        if not expenses:
+        if not totals["expense_count"]:
             return {
                 "answer": "I don't see any expenses recorded yet for your company. Once you start recording expenses, I'll be able to help you analyze your spending patterns, identify trends, and answer questions about your financial data!",
                 "expense_count": 0
             }
 
-        # Build a concise summary of expenses for the AI
-        total_amount = sum(exp.get("total_amount", 0) for exp in expenses)
-        expense_count = len(expenses)
-
-        # Group by vendor
-        vendor_totals = {}
-        for exp in expenses:
-            vendor = exp.get("vendors", {}).get("name", "Unknown") if exp.get("vendors") else "Unknown"
-            amount = exp.get("total_amount", 0)
-            vendor_totals[vendor] = vendor_totals.get(vendor, 0) + amount
-
-        # Recent expenses (last 10)
-        recent_expenses = expenses[-10:] if len(expenses) > 10 else expenses
+        total_amount = totals["total_amount"]
+        expense_count = totals["expense_count"]
+        currency = totals["currency"]
 
-        # Build context for AI
-        context = f"""Company Expense Data Summary:
+        # Build context for AI (totals are converted into the base currency)
+        context = f"""Company Expense Data Summary (amounts in {currency}):
 - Total Expenses: {expense_count}
-- Total Amount: ${total_amount:.2f}
-- Average Expense: ${total_amount/expense_count:.2f}
+- Total Amount: {total_amount:.2f} {currency}
+- Average Expense: {total_amount/expense_count:.2f} {currency}
 
 Top Vendors by Spending:
 """
         # Add top 5 vendors
-        sorted_vendors = sorted(vendor_totals.items(), key=lambda x: x[1], reverse=True)[:5]
-        for vendor, amount in sorted_vendors:
-            context += f"- {vendor}: ${amount:.2f}\n"
+        for row in top_vendors:
+            context += f"- {row['vendor']}: {row['total_amount']:.2f} {currency}\n"
 
         context += "\nRecent Expenses:\n"
         for exp in recent_expenses:
             vendor = exp.get("vendors", {}).get("name", "Unknown") if exp.get("vendors") else "Unknown"
-            amount = exp.get("total_amount", 0)
+            amount = float(exp.get("total_amount") or 0)
             date = exp.get("bill_date", "N/A")
             memo = exp.get("memo", "")
-            context += f"- {date}: {vendor} - ${amount:.2f}"
+            context += f"- {date}: {vendor} - {amount:.2f} {exp.get('currency') or currency}"
             if memo:
                 context += f" ({memo})"
             context += "\n"
+        if patterns:
+            context += "\nNotable Patterns (computed from expense history):\n"
+            context += "".join(f"- {line}\n" for line in patterns)
+        if totals["unconverted_count"]:
+            context += f"\n({totals['unconverted_count']} expenses in currencies without exchange rates are not included in the totals.)\n"
 
         # Call OpenAI
         try:
@@ -235,15 +482,18 @@ User's Question: {question}
 
 Provide a helpful, friendly response that directly answers their question. If you notice any interesting patterns or have helpful suggestions, feel free to mention them!"""
 
-            response = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                temperature=0.7,
-                max_tokens=500
-            )
+            # LLM slots are shared fairly between companies
+            async with throttling.llm_queue.slot(company_id):
+                response = await run_in_threadpool(
+                    client.chat.completions.create,
+                    model="gpt-4o-mini",
+                    messages=[
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": user_prompt}
+                    ],
+                    temperature=0.7,
+                    max_tokens=500
+                )
 
             answer = response.choices[0].message.content
 
@@ -253,6 +503,8 @@ Provide a helpful, friendly response that directly answers their question. If yo
                 "total_amount": total_amount
             }
 
+        except HTTPException:
+            raise
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"OpenAI API error: {str(e)}")
 
@@ -1,14 +1,31 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Header, HTTPException, Request, Response
 from database import table
+import http_cache
+import idempotency
+from datetime import datetime
+from routes.expenses import EXPENSE_SELECT
 
 router = APIRouter(prefix="/categories", tags=["Categories"])
 
+MAX_PAGE_SIZE = 500
+# Fraction of a budget at which a category is flagged as "warning"
+BUDGET_WARNING_THRESHOLD = 0.8
+
+
+def current_period():
+    """Budget period key for the current month ('YYYY-MM')."""
+    return datetime.utcnow().strftime("%Y-%m")
+
 
 # Get all categories for a company
 @router.get("/company/{company_id}")
-def get_company_categories(company_id: str):
+def get_company_categories(company_id: str, request: Request, http_response: Response):
     """Get all categories for a specific company."""
     try:
+        etag = http_cache.listing_etag(request, http_cache.table_version("categories", company_id))
+        cached = http_cache.not_modified(request, http_response, etag)
+        if cached:
+            return cached
         response = table("categories").select("*").eq("company_id", company_id).eq("is_active", True).execute()
         return {"status": "success", "data": response.data}
     except Exception as e:
@@ -17,8 +34,12 @@ def get_company_categories(company_id: str):
 
 # Create a new category
 @router.post("/")
-def create_category(category: dict):
+def create_category(category: dict, idempotency_key: str = Header(None)):
     """Create a new expense category."""
+    return idempotency.run(idempotency_key, "categories.create", category, lambda: insert_category(category))
+
+
+def insert_category(category: dict):
     try:
         company_id = category.get("company_id")
         name = category.get("name")
@@ -38,6 +59,8 @@ def create_category(category: dict):
         
         response = table("categories").insert(new_category).execute()
         return {"status": "success", "data": response.data}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -50,7 +73,19 @@ def update_category(category_id: str, update_data: dict):
         response = table("categories").update(update_data).eq("id", category_id).execute()
         if not response.data:
             raise HTTPException(status_code=404, detail="Category not found")
+
+        # A new budget applies from the current period onward; past months keep theirs
+        if "budget_amount" in update_data:
+            (
+                table("budgets")
+                .update({"budget_amount": update_data["budget_amount"] or 0})
+                .eq("category_id", category_id)
+                .gte("period", current_period())
+                .execute()
+            )
         return {"status": "success", "data": response.data}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -70,11 +105,103 @@ def delete_category(category_id: str):
 
 # Get expenses by category
 @router.get("/{category_id}/expenses")
-def get_category_expenses(category_id: str):
-    """Get all expenses for a specific category."""
+def get_category_expenses(category_id: str, limit: int = 100, offset: int = 0):
+    """Get expenses for a specific category, newest first, one page at a time."""
     try:
-        # Note: This requires the bills table to have a category_id column
-        # For now, we'll return a placeholder
-        return {"status": "success", "data": [], "message": "Feature pending: category_id column in bills table"}
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        offset = max(0, offset)
+        response = (
+            table("expenses")
+            .select(EXPENSE_SELECT)
+            .eq("category_id", category_id)
+            .is_("deleted_at", "null")
+            .order("bill_date", desc=True)
+            .range(offset, offset + limit - 1)
+            .execute()
+        )
+        return {"status": "success", "data": response.data, "limit": limit, "offset": offset}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+# Budget status for every category of a company in one period
+@router.get("/company/{company_id}/budget_status")
+def get_budget_status(company_id: str, period: str = None, threshold: float = BUDGET_WARNING_THRESHOLD):
+    """
+    Budget vs. actual spend per category for a period (defaults to this month).
+    Actuals are maintained incrementally by the expenses trigger, so this is a
+    single indexed read. Categories at or above `threshold` of their budget
+    are flagged "warning", and those over budget "over". Actuals sum amounts
+    as entered, without converting currencies (`currency_converted` says so).
+    """
+    try:
+        period = period or current_period()
+        response = (
+            table("budgets")
+            .select("category_id, period, budget_amount, actual_amount, variance, categories(name)")
+            .eq("company_id", company_id)
+            .eq("period", period)
+            .execute()
+        )
+        budgets = response.data or []
+
+        # Budgeted categories with no spend yet have no budgets row for the period
+        tracked = {budget["category_id"] for budget in budgets}
+        budgeted = (
+            table("categories")
+            .select("id, name, budget_amount")
+            .eq("company_id", company_id)
+            .eq("is_active", True)
+            .gt("budget_amount", 0)
+            .execute()
+            .data
+        ) or []
+        for category in budgeted:
+            if category["id"] not in tracked:
+                budget_amount = float(category["budget_amount"])
+                budgets.append({
+                    "category_id": category["id"],
+                    "period": period,
+                    "budget_amount": budget_amount,
+                    "actual_amount": 0,
+                    "variance": budget_amount,
+                    "categories": {"name": category["name"]},
+                })
+
+        statuses = []
+        alerts = []
+        for budget in budgets:
+            budget_amount = float(budget.get("budget_amount") or 0)
+            actual_amount = float(budget.get("actual_amount") or 0)
+            used = actual_amount / budget_amount if budget_amount > 0 else None
+
+            if used is None:
+                level = "unbudgeted"
+            elif used > 1:
+                level = "over"
+            elif used >= threshold:
+                level = "warning"
+            else:
+                level = "ok"
+
+            status = {
+                "category_id": budget["category_id"],
+                "category": (budget.get("categories") or {}).get("name"),
+                "period": budget["period"],
+                "budget_amount": budget_amount,
+                "actual_amount": actual_amount,
+                "variance": budget.get("variance"),
+                "percent_used": round(used * 100, 1) if used is not None else None,
+                "level": level,
+            }
+            statuses.append(status)
+            if level in ("warning", "over"):
+                alerts.append(status)
+
+        return {
+            "status": "success", "period": period, "data": statuses, "alerts": alerts,
+            # The trigger adds raw amounts; expenses in other currencies are not converted
+            "currency_converted": False,
+        }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
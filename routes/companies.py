@@ -1,14 +1,27 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Header, HTTPException, Request, Response
 from database import table
+from datetime import datetime
+from uuid import UUID
+import cache
+import http_cache
+import idempotency
 
 router = APIRouter(prefix="/companies", tags=["Companies"])
 
+MAX_PAGE_SIZE = 500
+
 
 # Get all companies (with users included)
 @router.get("/with-users")
-def get_companies_with_users():
+def get_companies_with_users(request: Request, http_response: Response):
     """Fetch all companies along with their associated users."""
     try:
+        etag = http_cache.listing_etag(
+            request, http_cache.table_version("companies"), http_cache.table_version("users"),
+        )
+        cached = http_cache.not_modified(request, http_response, etag)
+        if cached:
+            return cached
         response = table("companies").select("*, users(full_name, email, role, user_type)").execute()
         return {"status": "success", "data": response.data}
     except Exception as e:
@@ -17,28 +30,35 @@ def get_companies_with_users():
 
 # Get all companies (basic, no join)
 @router.get("/")
-def get_all_companies():
+def get_all_companies(request: Request, http_response: Response, limit: int = 100, after: str = None):
+    """
+    List companies oldest first, one page at a time (names are unique).
+    Pass the previous page's `next` as `after` for the following page.
+    """
     try:
-        response = table("companies").select("*").execute()
-        
-        # Deduplicate by name - keep the oldest company for each name
-        seen_names = {}
-        unique_companies = []
-        
-        # Sort by created_at to ensure we keep the oldest
-        sorted_companies = sorted(
-            response.data,
-            key=lambda x: x.get("created_at", ""),
-            reverse=False
-        )
-        
-        for company in sorted_companies:
-            company_name = company.get("name", "").strip()
-            if company_name and company_name not in seen_names:
-                seen_names[company_name] = True
-                unique_companies.append(company)
-        
-        return {"status": "success", "data": unique_companies}
+        etag = http_cache.listing_etag(request, http_cache.table_version("companies"))
+        cached = http_cache.not_modified(request, http_response, etag)
+        if cached:
+            return cached
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        query = table("companies").select("*").order("created_at").order("id").limit(limit)
+        if after:
+            # Keyset cursor "<created_at>,<id>": an index range scan, whatever the page.
+            # Both parts are parsed, so only a timestamp and a UUID reach the filter.
+            created_at, _, company_id = after.rpartition(",")
+            try:
+                created_at = datetime.fromisoformat(created_at).isoformat()
+                company_id = str(UUID(company_id))
+            except ValueError:
+                raise HTTPException(status_code=400, detail="Invalid cursor.")
+            query = query.or_(
+                f'created_at.gt."{created_at}",and(created_at.eq."{created_at}",id.gt.{company_id})'
+            )
+        rows = query.execute().data
+        next_cursor = f"{rows[-1]['created_at']},{rows[-1]['id']}" if len(rows) == limit else None
+        return {"status": "success", "data": rows, "limit": limit, "next": next_cursor}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -47,46 +67,54 @@ def get_all_companies():
 @router.get("/{company_id}")
 def get_company(company_id: str):
     try:
-        response = (
-            table("companies")
-            .select("*, users(full_name, email, role, user_type)")
-            .eq("id", company_id)
-            .execute()
-        )
-        if not response.data:
+        company = cache.get_company(company_id)
+        if not company:
             raise HTTPException(status_code=404, detail="Company not found.")
-        return {"status": "success", "data": response.data[0]}
+        return {"status": "success", "data": company}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 # Create a new company
 @router.post("/")
-def create_company(company: dict):
+def create_company(company: dict, idempotency_key: str = Header(None)):
+    return idempotency.run(idempotency_key, "companies.create", company, lambda: insert_company(company))
+
+
+def insert_company(company: dict):
     try:
         company_name = company.get("name", "").strip()
         if not company_name:
             raise HTTPException(status_code=400, detail="Company name is required.")
         
-        # Check if a company with the same name already exists
+        company["name"] = company_name
+
+        # Insert unless the normalized name is taken; the unique constraint makes
+        # this race-free, so concurrent creates can never produce duplicates
+        response = (
+            table("companies")
+            .upsert(company, on_conflict="name_normalized", ignore_duplicates=True)
+            .execute()
+        )
+        if response.data:
+            return {"status": "success", "data": response.data}
+
+        # Return the existing company instead of creating a duplicate
         existing = (
             table("companies")
             .select("id, name")
-            .eq("name", company_name)
+            .eq("name_normalized", company_name.lower())
+            .order("created_at")
+            .limit(1)
             .execute()
         )
-        
-        if existing.data and len(existing.data) > 0:
-            # Return the existing company instead of creating a duplicate
-            return {
-                "status": "success",
-                "data": existing.data,
-                "message": "Company with this name already exists. Using existing company."
-            }
-        
-        # Create new company if no duplicate exists
-        response = table("companies").insert(company).execute()
-        return {"status": "success", "data": response.data}
+        return {
+            "status": "success",
+            "data": existing.data,
+            "message": "Company with this name already exists. Using existing company."
+        }
     except HTTPException:
         raise
     except Exception as e:
@@ -98,6 +126,7 @@ def create_company(company: dict):
 def update_company(company_id: str, update_data: dict):
     try:
         response = table("companies").update(update_data).eq("id", company_id).execute()
+        cache.invalidate_company(company_id)
         if not response.data:
             raise HTTPException(status_code=404, detail="Company not found.")
         return {"status": "success", "data": response.data}
@@ -110,6 +139,9 @@ def update_company(company_id: str, update_data: dict):
 def delete_company(company_id: str):
     try:
         response = table("companies").delete().eq("id", company_id).execute()
+        cache.invalidate_company(company_id)
+        # Members' company_id is nulled by the FK, so cached users are stale
+        cache.clear_users()
         return {"status": "success", "message": f"Company {company_id} deleted successfully."}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
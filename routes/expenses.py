@@ -1,15 +1,76 @@
-from fastapi import APIRouter, HTTPException
-from database import table
+from fastapi import APIRouter, Header, HTTPException, Request, Response
+from database import table, rpc
+import analytics
+import audit
+import cache
+import duplicates
+import fx
+import http_cache
+import idempotency
+import ledger
 from datetime import datetime
 
 router = APIRouter(prefix="/expenses", tags=["Expenses"])
 
-# Get all expenses (bills with vendor info)
+# Expense columns returned by the API. Listed explicitly so search_document
+# (a tsvector that can hold a receipt's whole OCR text) is never sent.
+EXPENSE_COLUMNS = (
+    "id, company_id, vendor_id, category_id, bill_date, amount, currency, memo, status, "
+    "bill_number, receipt_id, receipt_url, receipt_file_name, receipt_fingerprint, "
+    "payment_method_id, created_by, approved_by, source_bill_id, import_id, import_row, "
+    "created_at, updated_at, deleted_at"
+)
+# Expense rows with the legacy bill field name kept for API compatibility
+EXPENSE_SELECT = f"{EXPENSE_COLUMNS}, total_amount:amount, vendors(name), categories(name)"
+# Columns dropped from the rows insert/update hand back
+INTERNAL_COLUMNS = ("search_document",)
+
+# Fields snapshotted into expense_audit_log old_values/new_values
+AUDITED_FIELDS = ["vendor_id", "category_id", "bill_date", "amount", "currency", "memo", "status"]
+
+
+def resolve_category_id(company_id: str, category: str = None, category_id: str = None):
+    """Return the category id for an explicit id or a category name within the company."""
+    if category_id:
+        return category_id
+    if not category or category == "Uncategorized":
+        return None
+    response = (
+        table("categories")
+        .select("id")
+        .eq("company_id", company_id)
+        .eq("name", category)
+        .limit(1)
+        .execute()
+    )
+    return response.data[0]["id"] if response.data else None
+
+
+def public_rows(rows: list):
+    """Insert/update results (which return every column) without the internal ones."""
+    return [{k: v for k, v in row.items() if k not in INTERNAL_COLUMNS} for row in rows]
+
+
+def audit_values(row: dict):
+    """The subset of an expense row recorded in expense_audit_log."""
+    return {field: row.get(field) for field in AUDITED_FIELDS if field in row}
+
+
+# Get all expenses (with vendor info)
 @router.get("/")
-def get_all_expenses():
-    """Get all expenses (bills) with vendor information."""
+def get_all_expenses(request: Request, http_response: Response):
+    """Get all expenses with vendor and category information."""
     try:
-        response = table("bills").select("*, vendors(name)").execute()
+        etag = http_cache.listing_etag(
+            request,
+            http_cache.table_version("expenses"),
+            http_cache.table_version("vendors"),
+            http_cache.table_version("categories"),
+        )
+        cached = http_cache.not_modified(request, http_response, etag)
+        if cached:
+            return cached
+        response = table("expenses").select(EXPENSE_SELECT).is_("deleted_at", "null").execute()
         return {"status": "success", "data": response.data}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -17,22 +78,76 @@ def get_all_expenses():
 
 # Get expenses for a specific company
 @router.get("/company/{company_id}")
-def get_company_expenses(company_id: str):
-    """Get all expenses for a specific company."""
+def get_company_expenses(company_id: str, request: Request, http_response: Response):
+    """Get all expenses for a specific company (ETag / If-None-Match aware)."""
     try:
-        response = table("bills").select("*, vendors(name)").eq("company_id", company_id).execute()
+        etag = http_cache.listing_etag(
+            request,
+            http_cache.table_version("expenses", company_id),
+            http_cache.table_version("vendors", company_id),
+            http_cache.table_version("categories", company_id),
+        )
+        cached = http_cache.not_modified(request, http_response, etag)
+        if cached:
+            return cached
+        response = (
+            table("expenses")
+            .select(EXPENSE_SELECT)
+            .eq("company_id", company_id)
+            .is_("deleted_at", "null")
+            .execute()
+        )
         return {"status": "success", "data": response.data}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# Spending summary for dashboards
+@router.get("/company/{company_id}/summary")
+def get_company_summary(company_id: str, start: str = None, end: str = None, group_by: str = "category", limit: int = None):
+    """
+    Count and total of a company's expenses between start and end (YYYY-MM-DD,
+    inclusive), grouped by vendor, category or month.
+    """
+    try:
+        if group_by not in analytics.GROUP_BY:
+            raise HTTPException(status_code=400, detail=f"group_by must be one of {', '.join(analytics.GROUP_BY)}")
+        return {
+            "status": "success",
+            "data": {
+                **analytics.summary(company_id, start, end),
+                "groups": analytics.group_totals(company_id, group_by, start, end, limit),
+            },
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+# Scan a company's history for duplicate expenses
+@router.get("/company/{company_id}/duplicates")
+def get_company_duplicates(company_id: str):
+    """Bulk duplicate scan: groups of expenses that look like the same receipt."""
+    try:
+        groups = duplicates.scan_company(company_id)
+        return {"status": "success", "data": groups}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 # Create a manual expense
 @router.post("/manual_entry")
-def create_expense(expense: dict):
+def create_expense(expense: dict, idempotency_key: str = Header(None)):
     """
     Log a manual expense.
-    Automatically links vendor, creates a bill and journal entry.
+    Automatically links vendor, creates an expense and journal entry.
+    A retry with the same Idempotency-Key header replays the first response.
     """
+    return idempotency.run(idempotency_key, "expenses.manual_entry", expense, lambda: record_manual_expense(expense))
+
+
+def record_manual_expense(expense: dict):
     try:
         company_id = expense.get("company_id")
         user_id = expense.get("user_id")  # Can be None if user not in users table
@@ -42,9 +157,30 @@ def create_expense(expense: dict):
         payment_method = expense.get("payment_method", "cash")
         memo = expense.get("memo", "")
         date = expense.get("date", str(datetime.utcnow().date()))
+        receipt_fingerprint = expense.get("receipt_fingerprint")
+        receipt_id = expense.get("receipt_id")  # from /parse, links the stored receipt file
+        currency = fx.normalize(expense.get("currency"))  # None = the company's base currency
 
         if not all([company_id, vendor_name, amount]):
             raise HTTPException(status_code=400, detail="Missing required fields: company_id, vendor_name, amount.")
+        if currency and len(currency) != 3:
+            raise HTTPException(status_code=400, detail="currency must be a 3-letter ISO code")
+        # The journal entry is posted in the base currency, so a rate must exist
+        try:
+            fx.convert_amount(amount, currency, fx.base_currency(company_id), date)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        receipt = None
+        if receipt_id:
+            response = table("receipts").select("id, file_name, receipt_fingerprint").eq("id", receipt_id).execute()
+            if not response.data:
+                raise HTTPException(status_code=400, detail="Unknown receipt_id")
+            receipt = response.data[0]
+            receipt_fingerprint = receipt_fingerprint or receipt["receipt_fingerprint"]
+
+        # Flag (but don't block) likely re-entries of an existing expense
+        possible_duplicates = duplicates.find_duplicates(company_id, vendor_name, amount, date, receipt_fingerprint)
 
         # Create or fetch vendor
         vendor_resp = table("vendors").select("*").eq("name", vendor_name).eq("company_id", company_id).execute()
@@ -55,63 +191,58 @@ def create_expense(expense: dict):
             vendor_insert = table("vendors").insert(new_vendor).execute()
             vendor_id = vendor_insert.data[0]["id"]
 
-        # Create a Bill record
-        bill_data = {
+        # Only set created_by if the user exists in the users table
+        # (schema allows NULL via ON DELETE SET NULL)
+        created_by = user_id if user_id and cache.get_user(user_id) else None
+
+        # Create the Expense record (category_id drives budget actuals via trigger)
+        expense_data = {
             "company_id": company_id,
             "vendor_id": vendor_id,
-            "bill_number": f"EXP-{int(datetime.utcnow().timestamp())}",
+            "category_id": resolve_category_id(company_id, category, expense.get("category_id")),
+            "bill_number": rpc("next_bill_number", {"p_company_id": company_id}).execute().data,
             "bill_date": date,
-            "total_amount": amount,
-            "balance_due": amount,
+            "amount": amount,
+            "currency": currency,
             "status": "draft",
-            "memo": memo
+            "memo": memo,
+            "created_by": created_by,
+            "receipt_fingerprint": receipt_fingerprint,
         }
-        bill = table("bills").insert(bill_data).execute()
+        if receipt:
+            expense_data.update({
+                "receipt_id": receipt["id"],
+                "receipt_url": f"/receipts/{receipt['id']}/file",
+                "receipt_file_name": receipt["file_name"],
+            })
+        created = table("expenses").insert(expense_data).execute()
+        created_expense = created.data[0]
+        duplicates.record_expense(company_id, created_expense["id"], vendor_name, amount, date, receipt_fingerprint)
+        audit.log_expense_change(
+            created_expense["id"], company_id, "created",
+            changed_by=created_by, new_values=audit_values(created_expense),
+        )
 
-        # Create Journal Entry
-        # created_by can be null if user_id is not in users table (schema allows ON DELETE SET NULL)
-        journal_entry = {
-            "company_id": company_id,
-            "entry_date": date,
-            "memo": f"Expense logged: {vendor_name} ({category})",
-            "status": "posted",
-        }
-        # Only include created_by if user_id is provided and exists in users table
-        if user_id:
-            try:
-                # Verify user exists in users table before setting created_by
-                user_check = table("users").select("id").eq("id", user_id).limit(1).execute()
-                if user_check.data:
-                    journal_entry["created_by"] = user_id
-            except Exception:
-                # If user doesn't exist, just skip created_by (will be NULL)
-                pass
-        
-        journal = table("journal_entries").insert(journal_entry).execute()
-        journal_id = journal.data[0]["id"]
-
-        # Add Journal Lines
-        debit_line = {
-            "journal_id": journal_id,
-            "description": f"{category} expense",
-            "debit": amount,
-            "credit": 0,
-        }
-        credit_line = {
-            "journal_id": journal_id,
-            "description": f"{payment_method} payment",
-            "debit": 0,
-            "credit": amount,
-        }
-        table("journal_lines").insert([debit_line, credit_line]).execute()
+        # Post the journal entry: debit the category's account, credit the payment method's
+        journal_entry = ledger.post_expense_entry(
+            created_expense,
+            ledger.payment_account_id(company_id, payment_method),
+            memo=f"Expense logged: {vendor_name} ({category})",
+            debit_description=f"{category} expense",
+            credit_description=f"{payment_method} payment",
+            created_by=created_by,
+        )
 
         return {
             "status": "success",
             "message": "Expense recorded successfully.",
-            "bill": bill.data,
-            "journal_entry": journal.data
+            "bill": public_rows(created.data),
+            "journal_entry": journal_entry,
+            "possible_duplicates": possible_duplicates
         }
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error creating expense: {e}")
 
@@ -119,7 +250,7 @@ def create_expense(expense: dict):
 # Update an expense
 @router.patch("/{expense_id}")
 def update_expense(expense_id: str, update_data: dict):
-    """Update an expense (bill)."""
+    """Update an expense."""
     try:
         # Extract update fields
         vendor_name = update_data.get("vendor_name")
@@ -127,28 +258,53 @@ def update_expense(expense_id: str, update_data: dict):
         memo = update_data.get("memo")
         date = update_data.get("date")
         status = update_data.get("status")
+        category = update_data.get("category")
+        category_id = update_data.get("category_id")
+        user_id = update_data.get("user_id")
+        currency = update_data.get("currency")
 
-        # Build update object for bills table
-        bill_update = {}
+        # Build update object for expenses table
+        expense_update = {}
         if amount is not None:
-            bill_update["total_amount"] = amount
-            bill_update["balance_due"] = amount
+            expense_update["amount"] = amount
         if memo is not None:
-            bill_update["memo"] = memo
+            expense_update["memo"] = memo
         if date is not None:
-            bill_update["bill_date"] = date
+            expense_update["bill_date"] = date
         if status is not None:
-            bill_update["status"] = status
+            expense_update["status"] = status
+        if currency is not None:
+            currency = fx.normalize(currency)
+            if currency and len(currency) != 3:
+                raise HTTPException(status_code=400, detail="currency must be a 3-letter ISO code")
+            expense_update["currency"] = currency
 
-        # Update vendor if provided
-        if vendor_name:
-            # Get current bill to find company_id
-            current_bill = table("bills").select("company_id").eq("id", expense_id).execute()
-            if not current_bill.data:
-                raise HTTPException(status_code=404, detail="Expense not found")
+        if not expense_update and not vendor_name and category is None and category_id is None:
+            raise HTTPException(status_code=400, detail="No update fields provided")
+
+        # Current row: gives the company for vendor/category lookups, the audit "before"
+        # and the vendor name the duplicate index keeps when the vendor isn't renamed
+        current = table("expenses").select(f"{EXPENSE_COLUMNS}, vendors(name)").eq("id", expense_id).is_("deleted_at", "null").execute()
+        if not current.data:
+            raise HTTPException(status_code=404, detail="Expense not found")
+        current_expense = current.data[0]
+        company_id = current_expense["company_id"]
+        # The reposted journal entry needs a rate for the new currency, amount or date
+        if {"currency", "amount", "bill_date"} & set(expense_update):
+            try:
+                fx.convert_amount(
+                    expense_update.get("amount", current_expense["amount"]),
+                    expense_update.get("currency", current_expense.get("currency")),
+                    fx.base_currency(company_id), expense_update.get("bill_date", current_expense["bill_date"]),
+                )
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
 
-            company_id = current_bill.data[0]["company_id"]
+        if category is not None or category_id is not None:
+            expense_update["category_id"] = resolve_category_id(company_id, category, category_id)
 
+        # Update vendor if provided
+        if vendor_name:
             # Create or fetch vendor
             vendor_resp = table("vendors").select("*").eq("name", vendor_name).eq("company_id", company_id).execute()
             if vendor_resp.data:
@@ -158,17 +314,42 @@ def update_expense(expense_id: str, update_data: dict):
                 vendor_insert = table("vendors").insert(new_vendor).execute()
                 vendor_id = vendor_insert.data[0]["id"]
 
-            bill_update["vendor_id"] = vendor_id
+            expense_update["vendor_id"] = vendor_id
 
-        # Update the bill
-        if bill_update:
-            response = table("bills").update(bill_update).eq("id", expense_id).execute()
-            if not response.data:
-                raise HTTPException(status_code=404, detail="Expense not found")
-            return {"status": "success", "data": response.data}
+        # Update the expense
+        response = table("expenses").update(expense_update).eq("id", expense_id).execute()
+        if not response.data:
+            raise HTTPException(status_code=404, detail="Expense not found")
+
+        updated_expense = response.data[0]
+        # Voiding reverses the journal entry; changing what it posts replaces it
+        if updated_expense.get("status") == "void":
+            ledger.void_expense_entries(expense_id)
+        elif current_expense.get("status") == "void" or any(
+            current_expense.get(f) != updated_expense.get(f) for f in ("amount", "currency", "bill_date", "category_id")
+        ):
+            ledger.repost_expense(updated_expense)
+
+        if updated_expense.get("status") == "void":
+            duplicates.forget_expense(company_id, expense_id)
         else:
-            raise HTTPException(status_code=400, detail="No update fields provided")
+            duplicates.record_expense(
+                company_id, expense_id, vendor_name or (current_expense.get("vendors") or {}).get("name"),
+                updated_expense.get("amount") or 0,
+                updated_expense.get("bill_date"), updated_expense.get("receipt_fingerprint"),
+            )
 
+        action = "status_changed" if set(expense_update) == {"status"} else "updated"
+        audit.log_expense_change(
+            expense_id, company_id, action,
+            changed_by=user_id if cache.get_user(user_id) else None,
+            old_values=audit_values(current_expense),
+            new_values=audit_values(updated_expense),
+        )
+        return {"status": "success", "data": public_rows(response.data)}
+
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error updating expense: {e}")
 
@@ -178,10 +359,22 @@ def update_expense(expense_id: str, update_data: dict):
 def delete_expense(expense_id: str):
     """Delete an expense by setting status to 'void'."""
     try:
-        response = table("bills").update({"status": "void"}).eq("id", expense_id).execute()
+        # Current row: the audit "before"
+        current = table("expenses").select(", ".join(AUDITED_FIELDS)).eq("id", expense_id).execute()
+        if not current.data:
+            raise HTTPException(status_code=404, detail="Expense not found")
+        response = table("expenses").update({"status": "void"}).eq("id", expense_id).execute()
         if not response.data:
             raise HTTPException(status_code=404, detail="Expense not found")
+        voided = response.data[0]
+        ledger.void_expense_entries(expense_id)
+        duplicates.forget_expense(voided["company_id"], expense_id)
+        audit.log_expense_change(
+            expense_id, voided["company_id"], "deleted",
+            old_values=audit_values(current.data[0]), new_values=audit_values(voided), reason="voided",
+        )
         return {"status": "success", "message": f"Expense {expense_id} voided successfully"}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error deleting expense: {e}")
-
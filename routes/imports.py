@@ -0,0 +1,86 @@
+from fastapi import APIRouter, File, UploadFile, HTTPException
+from database import table
+from jobs import scheduler
+import importer
+import os
+import uuid
+
+router = APIRouter(prefix="/imports", tags=["Imports"])
+
+# Uploaded export files are kept here until their import completes
+IMPORT_UPLOAD_DIR = os.getenv("IMPORT_UPLOAD_DIR", "uploads/imports")
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+SOURCE_SYSTEMS = ("quickbooks", "netsuite")
+
+
+# Upload an export file and queue its import
+@router.post("/company/{company_id}")
+async def start_import(company_id: str, source_system: str = "quickbooks", file: UploadFile = File(...)):
+    """
+    Upload a QuickBooks/NetSuite export (.iif, .csv or qbXML .xml) and queue
+    the import as a background job. Poll GET /imports/{import_id} for progress.
+    """
+    try:
+        if source_system not in SOURCE_SYSTEMS:
+            raise HTTPException(status_code=400, detail=f"source_system must be one of {', '.join(SOURCE_SYSTEMS)}")
+        file_format = os.path.splitext(file.filename or "")[1].lower().lstrip(".")
+        if file_format not in importer.PARSERS:
+            raise HTTPException(status_code=400, detail="Unsupported file type. Upload an .iif, .csv or .xml export.")
+
+        company = table("companies").select("id").eq("id", company_id).execute()
+        if not company.data:
+            raise HTTPException(status_code=404, detail="Company not found")
+
+        # Stream to disk; exports can be far larger than we want in memory
+        os.makedirs(IMPORT_UPLOAD_DIR, exist_ok=True)
+        file_path = os.path.join(IMPORT_UPLOAD_DIR, f"{uuid.uuid4()}.{file_format}")
+        with open(file_path, "wb") as f:
+            while chunk := await file.read(UPLOAD_CHUNK_BYTES):
+                f.write(chunk)
+
+        row = table("migrations_imports").insert({
+            "company_id": company_id,
+            "source_system": source_system,
+            "file_name": file.filename,
+            "file_path": file_path,
+            "file_format": file_format,
+            "status": "pending",
+        }).execute().data[0]
+        scheduler.enqueue("import_accounting_file", params={"import_id": row["id"]}, company_id=company_id)
+        return {"status": "success", "data": row}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+# Imports for a company
+@router.get("/company/{company_id}")
+def get_company_imports(company_id: str):
+    """List a company's imports, newest first."""
+    try:
+        response = (
+            table("migrations_imports")
+            .select("*")
+            .eq("company_id", company_id)
+            .order("created_at", desc=True)
+            .execute()
+        )
+        return {"status": "success", "data": response.data}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+# Import progress
+@router.get("/{import_id}")
+def get_import(import_id: str):
+    """Status, records imported so far (the resume checkpoint) and throughput."""
+    try:
+        response = table("migrations_imports").select("*").eq("id", import_id).execute()
+        if not response.data:
+            raise HTTPException(status_code=404, detail="Import not found")
+        return {"status": "success", "data": response.data[0]}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,48 @@
+from fastapi import APIRouter, HTTPException
+from database import table
+from jobs import scheduler
+
+router = APIRouter(prefix="/jobs", tags=["Jobs"])
+
+
+# Recent job runs
+@router.get("/")
+def get_jobs(job_name: str = None, status: str = None, limit: int = 50):
+    """List recent job runs, newest first."""
+    try:
+        query = table("jobs").select("*").order("created_at", desc=True).limit(max(1, min(limit, 500)))
+        if job_name:
+            query = query.eq("job_name", job_name)
+        if status:
+            query = query.eq("status", status)
+        return {"status": "success", "data": query.execute().data}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+# Per-job metrics for this process
+@router.get("/metrics")
+def get_job_metrics():
+    """Run counts, failures, retries and durations per job, as seen by this process."""
+    return {"status": "success", "data": scheduler.get_metrics()}
+
+
+# Queue a job run
+@router.post("/{job_name}")
+def enqueue_job(job_name: str, request: dict = None):
+    """
+    Queue a run of a registered job. Body (optional):
+    {"company_id": "uuid", "params": {...}}
+    """
+    try:
+        request = request or {}
+        if job_name not in scheduler.jobs:
+            raise HTTPException(status_code=404, detail=f"Unknown job: {job_name}")
+        row = scheduler.enqueue(job_name, params=request.get("params"), company_id=request.get("company_id"))
+        if row is None:
+            return {"status": "success", "data": None, "message": f"{job_name} is already queued."}
+        return {"status": "success", "data": row}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
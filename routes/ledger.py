@@ -0,0 +1,48 @@
+from fastapi import APIRouter, HTTPException
+import ledger
+
+router = APIRouter(prefix="/ledger", tags=["Ledger"])
+
+
+# Trial balance
+@router.get("/company/{company_id}/trial_balance")
+def get_trial_balance(company_id: str, as_of: str = None):
+    """Every account's balance at the end of `as_of` (YYYY-MM-DD, default today)."""
+    try:
+        return {"status": "success", "data": ledger.trial_balance(company_id, as_of)}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+# Balance of one account
+@router.get("/accounts/{account_id}/balance")
+def get_account_balance(account_id: str, as_of: str = None):
+    """Account balance (debits - credits) at the end of `as_of` (YYYY-MM-DD, default today)."""
+    try:
+        return {
+            "status": "success",
+            "data": {"account_id": account_id, "as_of": ledger.as_of_date(as_of), "balance": ledger.balance_as_of(account_id, as_of)},
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+# Check stored balances against a full recomputation
+@router.get("/company/{company_id}/verify")
+def verify_ledger(company_id: str):
+    """Account-months whose stored balances disagree with the journal lines (empty when consistent)."""
+    try:
+        mismatches = ledger.verify_balances(company_id)
+        return {"status": "success", "consistent": not mismatches, "data": mismatches}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+# Rebuild stored balances
+@router.post("/company/{company_id}/recompute")
+def recompute_ledger(company_id: str):
+    """Rebuild the company's account balances from its posted journal lines."""
+    try:
+        return {"status": "success", "data": {"account_months": ledger.recompute_balances(company_id)}}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
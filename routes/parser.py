@@ -1,56 +1,129 @@
-from fastapi import APIRouter, File, UploadFile, HTTPException
+from fastapi import APIRouter, File, Form, UploadFile, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from concurrent.futures import ProcessPoolExecutor
 from smart_parser import smart_extract
+from duplicates import text_fingerprint
+import receipt_store
+import throttling
+import asyncio
+import multiprocessing
 import os
 import json
 
 router = APIRouter(prefix="/parse", tags=["Parser"])
 
+# OCR_WORKERS > 0 runs extraction in that many separate processes, so the OCR
+# stack (easyocr/torch) is never loaded into API workers. With 0 it runs in a
+# thread of the API worker, importing the stack on the first upload.
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", "0"))
+_ocr_pool = None
+
+
+def get_ocr_pool():
+    global _ocr_pool
+    if _ocr_pool is None and OCR_WORKERS > 0:
+        _ocr_pool = ProcessPoolExecutor(
+            max_workers=OCR_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _ocr_pool
+
+
+def shutdown_ocr_pool():
+    global _ocr_pool
+    if _ocr_pool is not None:
+        _ocr_pool.shutdown(cancel_futures=True)
+        _ocr_pool = None
+
+
+async def run_extract(path: str):
+    """Run smart_extract off the event loop, in the OCR pool if one is configured."""
+    pool = get_ocr_pool()
+    if pool is None:
+        return await run_in_threadpool(smart_extract, path)
+    return await asyncio.get_running_loop().run_in_executor(pool, smart_extract, path)
+
+
+async def store_and_extract(file: UploadFile, company_id: str = None, user_id: str = None, llm: bool = False):
+    """
+    Keep the upload in receipt storage and extract its text. A file whose
+    content was extracted before is not OCR'd again. Returns the OCR result
+    and the receipts row.
+    An OCR token is spent only when OCR runs; with `llm`, an LLM token is
+    checked in the same call, so neither is spent unless both are available.
+    """
+    sha256, key, size, temp_path = await receipt_store.save_upload(file)
+    try:
+        processed = await run_in_threadpool(receipt_store.find_processed, sha256)
+        resources = (() if processed else ("ocr",)) + (("llm",) if llm else ())
+        if resources:
+            throttling.limiter.check(resources, company_id, user_id)
+        if processed:
+            result = {"raw_text": processed["extracted_text"], "parsed_fields": processed.get("parsed_fields") or {}}
+        else:
+            # OCR pool slots are shared fairly between companies
+            async with throttling.ocr_queue.slot(company_id):
+                result = await run_extract(temp_path)
+
+        # Each request OCRs its own temp copy; only a successful one is moved to
+        # the shared content key, so a failed upload can't remove a file in use
+        await run_in_threadpool(receipt_store.store.put_file, temp_path, key)
+        receipt = await run_in_threadpool(
+            receipt_store.record_receipt, company_id, sha256, key, file.filename, size,
+            result["raw_text"], result["parsed_fields"], text_fingerprint(result["raw_text"]),
+        )
+    except BaseException:
+        # Unsupported file, OCR failure, queue timeout or client gone: don't keep
+        # a file no receipt points to
+        await run_in_threadpool(receipt_store.discard_upload, temp_path)
+        raise
+    if not receipt.get("thumbnail_key"):
+        receipt_store.schedule_thumbnails(sha256, key)
+    return result, receipt
+
 
 @router.post("/")
-async def parse_any_file(file: UploadFile = File(...)):
+async def parse_any_file(file: UploadFile = File(...), company_id: str = Form(None), user_id: str = Form(None)):
     """Accepts image, PDF, or CSV and extracts text + structured info."""
     try:
         filename = file.filename
-        temp_path = f"temp_{filename}"
-
-        # Save file temporarily
-        with open(temp_path, "wb") as f:
-            f.write(await file.read())
 
-        # Run smart extraction
-        result = smart_extract(temp_path)
-        os.remove(temp_path)
+        # Store the receipt and run smart extraction (skipped for files seen before)
+        result, receipt = await store_and_extract(file, company_id, user_id)
 
         return {
             "filename": filename,
+            "receipt_id": receipt["id"],
             "parsed_fields": result["parsed_fields"],
-            "sample_text": result["raw_text"][:500]  # preview first 500 chars
+            "sample_text": result["raw_text"][:500],  # preview first 500 chars
+            "receipt_fingerprint": receipt["receipt_fingerprint"]
         }
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.post("/ai")
-async def parse_with_ai(file: UploadFile = File(...)):
+async def parse_with_ai(file: UploadFile = File(...), company_id: str = Form(None), user_id: str = Form(None)):
     """
     AI-enhanced receipt parsing: OCR + OpenAI for intelligent field extraction.
     Returns cleaned, categorized, and validated expense data in one step.
     """
     try:
         filename = file.filename
-        temp_path = f"temp_{filename}"
-
-        # Save file temporarily
-        with open(temp_path, "wb") as f:
-            f.write(await file.read())
 
-        # Step 1: Run OCR extraction
-        ocr_result = smart_extract(temp_path)
-        os.remove(temp_path)
+        # Step 1: Store the receipt and run OCR extraction (skipped for files seen before).
+        # The OCR and LLM buckets are checked together before either is spent.
+        ocr_result, receipt = await store_and_extract(
+            file, company_id, user_id, llm=bool(os.getenv("OPENAI_API_KEY", "")),
+        )
 
         raw_text = ocr_result["raw_text"]
         ocr_fields = ocr_result["parsed_fields"]
+        # Sent back with manual_entry so re-entered receipts are flagged
+        receipt_fingerprint = receipt["receipt_fingerprint"]
 
         # Step 2: Check if OpenAI is configured
         openai_key = os.getenv("OPENAI_API_KEY", "")
@@ -59,8 +132,10 @@ async def parse_with_ai(file: UploadFile = File(...)):
             # Fallback: Return OCR-only results
             return {
                 "filename": filename,
+                "receipt_id": receipt["id"],
                 "parsed_fields": ocr_fields,
                 "sample_text": raw_text[:500],
+                "receipt_fingerprint": receipt_fingerprint,
                 "ai_enhanced": False,
                 "message": "OpenAI not configured. Returning OCR-only results."
             }
@@ -79,6 +154,7 @@ OCR Extracted Fields (may be incomplete or messy):
 - Vendor: {ocr_fields.get('vendor', 'Not found')}
 - Date: {ocr_fields.get('date', 'Not found')}
 - Amount: {ocr_fields.get('total', 'Not found')}
+- Currency: {ocr_fields.get('currency') or 'Not found'}
 - Description: {ocr_fields.get('description', 'Not found')}
 
 Your task: Analyze the receipt and return clean, structured expense data.
@@ -88,6 +164,7 @@ Return a JSON object with:
   "vendor": "Clean vendor name (standardized, no store numbers)",
   "date": "Date in YYYY-MM-DD format",
   "amount": "Amount as number (no $ or currency symbols)",
+  "currency": "ISO 4217 code of the amount (e.g., USD, EUR, GBP, INR), or null if not shown",
   "description": "Short, professional description of the purchase",
   "category": "Expense category (e.g., Office Supplies, Travel, Meals & Entertainment, Software & Services, Utilities, etc.)",
   "memo": "Professional memo for accounting records",
@@ -102,23 +179,28 @@ Rules:
 - Be conservative: if unsure about any field, use confidence: "low"
 """
 
-            response = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", "content": "You are a receipt analysis expert. Extract and clean expense data from OCR text. Always respond with valid JSON."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.3,
-                response_format={"type": "json_object"}
-            )
+            # Off the event loop, in a fairly shared LLM slot
+            async with throttling.llm_queue.slot(company_id):
+                response = await run_in_threadpool(
+                    client.chat.completions.create,
+                    model="gpt-4o-mini",
+                    messages=[
+                        {"role": "system", "content": "You are a receipt analysis expert. Extract and clean expense data from OCR text. Always respond with valid JSON."},
+                        {"role": "user", "content": prompt}
+                    ],
+                    temperature=0.3,
+                    response_format={"type": "json_object"}
+                )
 
             ai_fields = json.loads(response.choices[0].message.content)
 
             return {
                 "filename": filename,
+                "receipt_id": receipt["id"],
                 "parsed_fields": ai_fields,
                 "ocr_fields": ocr_fields,
                 "sample_text": raw_text[:500],
+                "receipt_fingerprint": receipt_fingerprint,
                 "ai_enhanced": True,
                 "message": "Receipt successfully parsed and enhanced with AI"
             }
@@ -127,11 +209,15 @@ Rules:
             # If AI fails, return OCR results with error message
             return {
                 "filename": filename,
+                "receipt_id": receipt["id"],
                 "parsed_fields": ocr_fields,
                 "sample_text": raw_text[:500],
+                "receipt_fingerprint": receipt_fingerprint,
                 "ai_enhanced": False,
                 "message": f"AI enhancement failed: {str(ai_error)}. Returning OCR-only results."
             }
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,18 @@
+from fastapi import APIRouter
+import throttling
+
+router = APIRouter(prefix="/quotas", tags=["Quotas"])
+
+
+# OCR/LLM queue metrics for this process
+@router.get("/")
+def get_quotas():
+    """Slots in use, queued work, grants and queue wait percentiles per company."""
+    return {"status": "success", "data": throttling.metrics()}
+
+
+# One company's quota usage
+@router.get("/company/{company_id}")
+def get_company_quotas(company_id: str):
+    """The company's remaining rate-limit tokens, rejections and queue waits."""
+    return {"status": "success", "data": throttling.metrics(company_id)}
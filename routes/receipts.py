@@ -0,0 +1,125 @@
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
+from database import table
+import receipt_store
+
+router = APIRouter(prefix="/receipts", tags=["Receipts"])
+
+STREAM_CHUNK_BYTES = 64 * 1024
+# Stored files never change (keys are content hashes), so clients may cache them forever
+IMMUTABLE_CACHE = "private, max-age=31536000, immutable"
+
+
+def get_receipt_row(receipt_id: str):
+    response = table("receipts").select("*").eq("id", receipt_id).execute()
+    if not response.data:
+        raise HTTPException(status_code=404, detail="Receipt not found")
+    return response.data[0]
+
+
+def parse_range(header: str, size: int):
+    """(start, end) inclusive for a single 'bytes=' range, or None to send the whole file."""
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start, _, end = header[len("bytes="):].strip().partition("-")
+    try:
+        if start:
+            start, end = int(start), int(end) if end else size - 1
+        else:
+            # Suffix range: the last N bytes
+            start, end = max(size - int(end), 0), size - 1
+    except ValueError:
+        return None
+    if start > end or start >= size:
+        raise HTTPException(status_code=416, detail="Requested range not satisfiable",
+                            headers={"Content-Range": f"bytes */{size}"})
+    return start, min(end, size - 1)
+
+
+def stream_file(key: str, start: int, length: int):
+    with receipt_store.store.open(key) as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(STREAM_CHUNK_BYTES, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def serve_stored_file(request: Request, key: str, etag: str, content_type: str):
+    """Send a stored file with ETag / If-None-Match and single-range support."""
+    if not key or not receipt_store.store.exists(key):
+        raise HTTPException(status_code=404, detail="File not available")
+    headers = {"ETag": etag, "Cache-Control": IMMUTABLE_CACHE, "Accept-Ranges": "bytes"}
+    if etag in (request.headers.get("if-none-match") or "").replace(" ", "").split(","):
+        return Response(status_code=304, headers=headers)
+
+    size = receipt_store.store.size(key)
+    byte_range = None
+    # If-Range: only honour the range if the client's copy is this version
+    if request.headers.get("if-range") in (None, etag):
+        byte_range = parse_range(request.headers.get("range"), size)
+    if byte_range is None:
+        headers["Content-Length"] = str(size)
+        return StreamingResponse(stream_file(key, 0, size), media_type=content_type, headers=headers)
+
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(stream_file(key, start, end - start + 1), status_code=206,
+                             media_type=content_type, headers=headers)
+
+
+# Receipts for a company
+@router.get("/company/{company_id}")
+def get_company_receipts(company_id: str, limit: int = 50, offset: int = 0):
+    """List a company's stored receipts, newest first (without the extracted text)."""
+    try:
+        limit = max(1, min(limit, 500))
+        response = (
+            table("receipts")
+            .select("id, file_name, content_type, size_bytes, thumbnail_key, preview_key, parsed_fields, created_at")
+            .eq("company_id", company_id)
+            .order("created_at", desc=True)
+            .range(offset, offset + limit - 1)
+            .execute()
+        )
+        return {"status": "success", "data": response.data, "limit": limit, "offset": offset}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+# Receipt metadata and extracted text
+@router.get("/{receipt_id}")
+def get_receipt(receipt_id: str):
+    """Receipt metadata, extracted text and parsed fields."""
+    try:
+        return {"status": "success", "data": get_receipt_row(receipt_id)}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+# Original file
+@router.get("/{receipt_id}/file")
+def get_receipt_file(receipt_id: str, request: Request):
+    """The uploaded file, with Range and ETag support."""
+    receipt = get_receipt_row(receipt_id)
+    return serve_stored_file(request, receipt["storage_key"], f'"{receipt["sha256"]}"', receipt["content_type"])
+
+
+# Thumbnail (256px) and preview (1024px) JPEGs
+@router.get("/{receipt_id}/thumbnail")
+def get_receipt_thumbnail(receipt_id: str, request: Request):
+    """Small JPEG of the receipt (404 until generated)."""
+    receipt = get_receipt_row(receipt_id)
+    return serve_stored_file(request, receipt.get("thumbnail_key"), f'"{receipt["sha256"]}-thumb"', "image/jpeg")
+
+
+@router.get("/{receipt_id}/preview")
+def get_receipt_preview(receipt_id: str, request: Request):
+    """Screen-sized JPEG of the receipt (404 until generated)."""
+    receipt = get_receipt_row(receipt_id)
+    return serve_stored_file(request, receipt.get("preview_key"), f'"{receipt["sha256"]}-preview"', "image/jpeg")
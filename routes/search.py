@@ -0,0 +1,98 @@
+from fastapi import APIRouter, HTTPException
+from database import table, rpc
+from routes.expenses import EXPENSE_SELECT
+from datetime import date, datetime
+import calendar
+import re
+
+router = APIRouter(prefix="/search", tags=["Search"])
+
+MAX_PAGE_SIZE = 100
+
+MONTHS = {name.lower(): i for i, name in enumerate(calendar.month_name) if name}
+MONTHS.update({name.lower(): i for i, name in enumerate(calendar.month_abbr) if name})
+YEAR = re.compile(r"^(19|20)\d{2}$")
+
+
+def extract_date_range(query: str, today: date = None):
+    """
+    Pull a month and/or year out of a free-text query ("staples march 2025").
+    Returns (remaining query, start, end); a month without a year means its
+    most recent occurrence.
+    """
+    today = today or datetime.utcnow().date()
+    month = year = None
+    words = []
+    for word in query.split():
+        key = word.lower().strip(".,")
+        if month is None and key in MONTHS:
+            month = MONTHS[key]
+        elif year is None and YEAR.match(key):
+            year = int(key)
+        else:
+            words.append(word)
+    # Don't turn a query that is only "may" or "2024" into an empty search
+    if not words:
+        return query, None, None
+    if month is None and year is None:
+        return query, None, None
+    if month is None:
+        return " ".join(words), date(year, 1, 1), date(year, 12, 31)
+    if year is None:
+        year = today.year if month <= today.month else today.year - 1
+    return " ".join(words), date(year, month, 1), date(year, month, calendar.monthrange(year, month)[1])
+
+
+# Search a company's expenses
+@router.get("/company/{company_id}")
+def search_expenses(company_id: str, q: str, start: str = None, end: str = None, limit: int = 20, offset: int = 0):
+    """
+    Ranked search over vendor names (fuzzy), memos, bill numbers, categories
+    and receipt text. Month and year words in `q` become a date filter unless
+    start/end are given.
+    """
+    try:
+        q = (q or "").strip()
+        if not q:
+            raise HTTPException(status_code=400, detail="q is required")
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        offset = max(0, offset)
+
+        terms = q
+        if not start and not end:
+            terms, parsed_start, parsed_end = extract_date_range(q)
+            start = parsed_start.isoformat() if parsed_start else None
+            end = parsed_end.isoformat() if parsed_end else None
+
+        hits = rpc("search_expenses", {
+            "p_company_id": company_id,
+            "p_query": terms,
+            "p_start": start,
+            "p_end": end,
+            "p_limit": limit,
+            "p_offset": offset,
+        }).execute().data or []
+
+        results = []
+        if hits:
+            rows = table("expenses").select(EXPENSE_SELECT).in_("id", [h["expense_id"] for h in hits]).execute().data
+            by_id = {row["id"]: row for row in rows}
+            for hit in hits:
+                row = by_id.get(hit["expense_id"])
+                if row:
+                    results.append(dict(row, score=round(hit["score"], 4)))
+
+        return {
+            "status": "success",
+            "data": results,
+            "total": hits[0]["total_count"] if hits else 0,
+            "limit": limit,
+            "offset": offset,
+            "query": terms,
+            "start": start,
+            "end": end,
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
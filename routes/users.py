@@ -1,13 +1,20 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Header, HTTPException, Request, Response
 from database import table
+import cache
+import http_cache
+import idempotency
 
 router = APIRouter(prefix="/users", tags=["Users"])
 
 
 # Get all users
 @router.get("/")
-def get_all_users():
+def get_all_users(request: Request, http_response: Response):
     try:
+        etag = http_cache.listing_etag(request, http_cache.table_version("users"))
+        cached = http_cache.not_modified(request, http_response, etag)
+        if cached:
+            return cached
         response = table("users").select("*").execute()
         return {"status": "success", "data": response.data}
     except Exception as e:
@@ -18,10 +25,12 @@ def get_all_users():
 @router.get("/{user_id}")
 def get_user(user_id: str):
     try:
-        response = table("users").select("*").eq("id", user_id).execute()
-        if not response.data:
+        user = cache.get_user(user_id)
+        if not user:
             raise HTTPException(status_code=404, detail="User not found.")
-        return {"status": "success", "data": response.data[0]}
+        return {"status": "success", "data": user}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -30,10 +39,10 @@ def get_user(user_id: str):
 @router.get("/by-email/{email}")
 def get_user_by_email(email: str):
     try:
-        response = table("users").select("*").eq("email", email).execute()
-        if not response.data:
+        user = cache.get_user_by_email(email)
+        if not user:
             raise HTTPException(status_code=404, detail="User not found.")
-        return {"status": "success", "data": response.data[0]}
+        return {"status": "success", "data": user}
     except HTTPException:
         raise
     except Exception as e:
@@ -42,14 +51,17 @@ def get_user_by_email(email: str):
 
 # Create a new user
 @router.post("/")
-def create_user(user: dict):
+def create_user(user: dict, idempotency_key: str = Header(None)):
+    return idempotency.run(idempotency_key, "users.create", user, lambda: insert_user(user))
+
+
+def insert_user(user: dict):
     try:
         email = user.get("email")
         if email:
             # Check if user with this email already exists
-            existing = table("users").select("*").eq("email", email).execute()
-            if existing.data and len(existing.data) > 0:
-                existing_user = existing.data[0]
+            existing_user = cache.get_user_by_email(email)
+            if existing_user:
                 # If user already has a company, prevent association with another
                 if existing_user.get("company_id"):
                     raise HTTPException(
@@ -59,15 +71,16 @@ def create_user(user: dict):
                 # User exists but no company - allow update
                 if user.get("company_id"):
                     response = table("users").update({"company_id": user["company_id"]}).eq("id", existing_user["id"]).execute()
+                    cache.invalidate_user(existing_user["id"], email)
+                    cache.invalidate_company(user["company_id"])
                     return {"status": "success", "data": response.data}
         
         # Check if trying to associate with company and user already has one
         if user.get("company_id"):
             user_id = user.get("id")
             if user_id:
-                existing = table("users").select("*").eq("id", user_id).execute()
-                if existing.data and len(existing.data) > 0:
-                    existing_user = existing.data[0]
+                existing_user = cache.get_user(user_id)
+                if existing_user:
                     if existing_user.get("company_id") and existing_user.get("company_id") != user.get("company_id"):
                         raise HTTPException(
                             status_code=400,
@@ -75,6 +88,8 @@ def create_user(user: dict):
                         )
         
         response = table("users").insert(user).execute()
+        cache.invalidate_user(user.get("id"), email)
+        cache.invalidate_company(user.get("company_id"))
         return {"status": "success", "data": response.data}
     except HTTPException:
         raise
@@ -87,9 +102,9 @@ def create_user(user: dict):
 def update_user(user_id: str, update_data: dict):
     try:
         # Check if user exists
-        existing = table("users").select("*").eq("id", user_id).execute()
+        existing_user = cache.get_user(user_id)
         
-        if not existing.data or len(existing.data) == 0:
+        if not existing_user:
             # User doesn't exist - create them if company_id is being set
             if "company_id" in update_data and update_data["company_id"]:
                 # Create user with provided data
@@ -104,11 +119,12 @@ def update_user(user_id: str, update_data: dict):
                 elif "email" in update_data and update_data["email"]:
                     user_data["full_name"] = update_data["email"].split("@")[0]
                 response = table("users").insert(user_data).execute()
+                cache.invalidate_user(user_id, user_data.get("email"))
+                cache.invalidate_company(user_data["company_id"])
                 return {"status": "success", "data": response.data}
             else:
                 raise HTTPException(status_code=404, detail="User not found.")
         
-        existing_user = existing.data[0]
         existing_company_id = existing_user.get("company_id")
         
         # Prevent changing company_id if user already has one (one email = one company)
@@ -126,6 +142,8 @@ def update_user(user_id: str, update_data: dict):
             # Allow if: user has no company (None/null/empty) OR setting to the same company
         
         response = table("users").update(update_data).eq("id", user_id).execute()
+        cache.invalidate_user(user_id, existing_user.get("email"), existing_company_id)
+        cache.invalidate_company(update_data.get("company_id"))
         if not response.data:
             raise HTTPException(status_code=404, detail="User not found.")
         return {"status": "success", "data": response.data}
@@ -140,6 +158,9 @@ def update_user(user_id: str, update_data: dict):
 def delete_user(user_id: str):
     try:
         response = table("users").delete().eq("id", user_id).execute()
+        # The deleted row names the company whose cached user list included them
+        deleted = response.data[0] if response.data else {}
+        cache.invalidate_user(user_id, deleted.get("email"), deleted.get("company_id"))
         return {"status": "success", "message": f"User {user_id} deleted successfully."}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -147,15 +168,21 @@ def delete_user(user_id: str):
 
 # Create a new user linked to a specific company
 @router.post("/company/{company_id}")
-def create_user_for_company(company_id: str, user: dict):
+def create_user_for_company(company_id: str, user: dict, idempotency_key: str = Header(None)):
     """Create a new user and automatically link them to a company."""
+    return idempotency.run(
+        idempotency_key, f"users.create_for_company:{company_id}", user,
+        lambda: insert_company_user(company_id, user),
+    )
+
+
+def insert_company_user(company_id: str, user: dict):
     try:
         email = user.get("email")
         if email:
             # Check if user with this email already exists and has a company
-            existing = table("users").select("*").eq("email", email).execute()
-            if existing.data and len(existing.data) > 0:
-                existing_user = existing.data[0]
+            existing_user = cache.get_user_by_email(email)
+            if existing_user:
                 if existing_user.get("company_id"):
                     raise HTTPException(
                         status_code=400,
@@ -164,6 +191,8 @@ def create_user_for_company(company_id: str, user: dict):
         
         user["company_id"] = company_id
         response = table("users").insert(user).execute()
+        cache.invalidate_user(user.get("id"), email)
+        cache.invalidate_company(company_id)
         return {"status": "success", "data": response.data}
     except HTTPException:
         raise
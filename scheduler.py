@@ -0,0 +1,314 @@
+"""
+Async background job scheduler with persistent state in the `jobs` table.
+
+Runs inside the API process (SCHEDULER_ENABLED=1, started from main.py) or
+as a sidecar:
+
+    python scheduler.py
+
+Every run is a row in `jobs`. Workers claim pending rows with a conditional
+update, so several API workers or sidecars can share one queue without
+running a job twice. A running job's row gets a heartbeat every
+HEARTBEAT_SECONDS; one whose heartbeat stops (the worker died) is put back in
+the queue, or marked failed once it has used its attempts. Failed runs are
+retried with exponential backoff.
+"""
+import asyncio
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from database import table
+
+MAX_CONCURRENT_JOBS = int(os.getenv("SCHEDULER_MAX_CONCURRENT_JOBS", "2"))
+POLL_INTERVAL_SECONDS = 5
+HEARTBEAT_SECONDS = 60
+# Running rows without a heartbeat for this long (the worker died) are put back in the queue
+STALE_RUNNING_SECONDS = 600
+
+
+def utcnow():
+    return datetime.utcnow()
+
+
+class Job:
+    """A registered job: a sync function plus its schedule and retry policy."""
+
+    def __init__(self, name: str, func, interval: int = None, max_attempts: int = 3,
+                 backoff_seconds: int = 30):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+
+
+class JobMetrics:
+    def __init__(self):
+        self.runs = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.retried = 0
+        self.total_seconds = 0.0
+        self.last_seconds = None
+        self.last_error = None
+        self.last_finished_at = None
+
+    def as_dict(self):
+        return {
+            "runs": self.runs,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "retried": self.retried,
+            "avg_seconds": round(self.total_seconds / self.runs, 3) if self.runs else None,
+            "last_seconds": self.last_seconds,
+            "last_error": self.last_error,
+            "last_finished_at": self.last_finished_at,
+        }
+
+
+class JobScheduler:
+    def __init__(self, max_concurrent: int = MAX_CONCURRENT_JOBS, poll_interval: float = POLL_INTERVAL_SECONDS):
+        self.jobs = {}
+        self.metrics = {}
+        self.max_concurrent = max_concurrent
+        self.poll_interval = poll_interval
+        self._next_run = {}
+        self._running = {}
+        self._metrics_lock = threading.Lock()
+        self._task = None
+        # Strong references to running job tasks (the event loop only keeps weak ones)
+        self._job_tasks = set()
+
+    def register(self, name: str, func, interval: int = None, max_attempts: int = 3, backoff_seconds: int = 30):
+        """Register a job. With `interval` (seconds) it is also enqueued periodically."""
+        self.jobs[name] = Job(name, func, interval, max_attempts, backoff_seconds)
+        self.metrics[name] = JobMetrics()
+
+    def enqueue(self, name: str, params: dict = None, company_id: str = None, run_after: datetime = None):
+        """Persist a pending run of `name`. Returns the jobs row, or None if one is already queued."""
+        if name not in self.jobs:
+            raise ValueError(f"Unknown job: {name}")
+        row = {
+            "job_name": name,
+            "company_id": company_id,
+            "params": params or {},
+            "status": "pending",
+            "max_attempts": self.jobs[name].max_attempts,
+            "run_after": (run_after or utcnow()).isoformat(),
+        }
+        try:
+            return table("jobs").insert(row).execute().data[0]
+        except Exception as e:
+            # uq_jobs_active_global: the same global job is already pending/running
+            if "duplicate key" in str(e) or "23505" in str(e):
+                return None
+            raise
+
+    def get_metrics(self):
+        with self._metrics_lock:
+            return {
+                name: dict(m.as_dict(), running=self._running.get(name, 0))
+                for name, m in self.metrics.items()
+            }
+
+    # -- scheduling loop ---------------------------------------------------
+
+    def _enqueue_due_periodic(self):
+        now = utcnow()
+        for job in self.jobs.values():
+            if not job.interval:
+                continue
+            if job.name not in self._next_run:
+                # Resume the schedule from the last persisted run
+                last = (
+                    table("jobs")
+                    .select("created_at")
+                    .eq("job_name", job.name)
+                    .is_("company_id", "null")
+                    .order("created_at", desc=True)
+                    .limit(1)
+                    .execute()
+                )
+                last_at = datetime.fromisoformat(last.data[0]["created_at"]) if last.data else None
+                self._next_run[job.name] = last_at + timedelta(seconds=job.interval) if last_at else now
+            if self._next_run[job.name] <= now:
+                self.enqueue(job.name)
+                self._next_run[job.name] = now + timedelta(seconds=job.interval)
+
+    def _requeue_stale(self):
+        """Put running rows whose worker died back in the queue, or fail them once out of attempts."""
+        cutoff = (utcnow() - timedelta(seconds=STALE_RUNNING_SECONDS)).isoformat()
+        # Rows claimed before heartbeats existed only have started_at
+        stale_filter = f'heartbeat_at.lt."{cutoff}",and(heartbeat_at.is.null,started_at.lt."{cutoff}")'
+        stale = (
+            table("jobs")
+            .select("id, attempts, max_attempts")
+            .eq("status", "running")
+            .or_(stale_filter)
+            .execute()
+            .data
+        ) or []
+        # A job that kills its worker (OOM, a crash in native code) would otherwise be retried forever
+        exhausted = [r["id"] for r in stale if (r.get("attempts") or 0) >= (r.get("max_attempts") or 1)]
+        retry = [r["id"] for r in stale if r["id"] not in exhausted]
+        for ids, update in (
+            (retry, {"status": "pending"}),
+            (exhausted, {
+                "status": "failed",
+                "finished_at": utcnow().isoformat(),
+                "last_error": "Worker stopped while running the job",
+            }),
+        ):
+            if ids:
+                table("jobs").update(update).in_("id", ids).eq("status", "running").or_(stale_filter).execute()
+
+    def _heartbeat(self, job_id: str):
+        table("jobs").update({"heartbeat_at": utcnow().isoformat()}).eq("id", job_id).eq("status", "running").execute()
+
+    def _claim(self, row: dict):
+        """Atomically move a pending row to running; None if another worker got it first."""
+        now = utcnow().isoformat()
+        claimed = (
+            table("jobs")
+            .update({
+                "status": "running",
+                "attempts": (row.get("attempts") or 0) + 1,
+                "started_at": now,
+                "heartbeat_at": now,
+            })
+            .eq("id", row["id"])
+            .eq("status", "pending")
+            .execute()
+        )
+        return claimed.data[0] if claimed.data else None
+
+    def _due_rows(self, limit: int):
+        response = (
+            table("jobs")
+            .select("*")
+            .eq("status", "pending")
+            .lte("run_after", utcnow().isoformat())
+            .in_("job_name", list(self.jobs))
+            .order("run_after")
+            .limit(limit)
+            .execute()
+        )
+        return response.data or []
+
+    def _run(self, row: dict):
+        """Execute one claimed row in a worker thread and persist the outcome."""
+        job = self.jobs[row["job_name"]]
+        params = dict(row.get("params") or {})
+        if row.get("company_id"):
+            params["company_id"] = row["company_id"]
+
+        start = time.perf_counter()
+        error = None
+        result = None
+        try:
+            result = job.func(**params)
+        except Exception as e:
+            error = str(e)
+        elapsed = time.perf_counter() - start
+        finished_at = utcnow()
+
+        update = {"finished_at": finished_at.isoformat(), "duration_ms": int(elapsed * 1000)}
+        retry = False
+        if error is None:
+            update.update({"status": "completed", "result": result, "last_error": None})
+        elif row["attempts"] < job.max_attempts:
+            retry = True
+            delay = job.backoff_seconds * 2 ** (row["attempts"] - 1)
+            update.update({
+                "status": "pending",
+                "last_error": error,
+                "run_after": (finished_at + timedelta(seconds=delay)).isoformat(),
+            })
+        else:
+            update.update({"status": "failed", "last_error": error})
+        table("jobs").update(update).eq("id", row["id"]).execute()
+
+        with self._metrics_lock:
+            metrics = self.metrics[job.name]
+            metrics.runs += 1
+            metrics.total_seconds += elapsed
+            metrics.last_seconds = round(elapsed, 3)
+            metrics.last_finished_at = finished_at.isoformat()
+            if error is None:
+                metrics.succeeded += 1
+            else:
+                metrics.last_error = error
+                if retry:
+                    metrics.retried += 1
+                else:
+                    metrics.failed += 1
+        if error:
+            print(f"Job {job.name} failed (attempt {row['attempts']}/{job.max_attempts}): {error}")
+
+    async def _keep_alive(self, job_id: str):
+        """Heartbeat a running row until cancelled, so long jobs are not requeued as stale."""
+        while True:
+            await asyncio.sleep(HEARTBEAT_SECONDS)
+            try:
+                await asyncio.to_thread(self._heartbeat, job_id)
+            except Exception as e:
+                print(f"Job heartbeat failed: {e}")
+
+    async def _execute(self, row: dict):
+        name = row["job_name"]
+        keep_alive = asyncio.create_task(self._keep_alive(row["id"]))
+        try:
+            await asyncio.to_thread(self._run, row)
+        finally:
+            keep_alive.cancel()
+            with self._metrics_lock:
+                self._running[name] -= 1
+
+    async def tick(self):
+        """One scheduling pass: enqueue periodic jobs and start due ones up to the concurrency limit."""
+        await asyncio.to_thread(self._enqueue_due_periodic)
+        await asyncio.to_thread(self._requeue_stale)
+
+        with self._metrics_lock:
+            free = self.max_concurrent - sum(self._running.values())
+        if free <= 0:
+            return
+        for row in await asyncio.to_thread(self._due_rows, free):
+            claimed = await asyncio.to_thread(self._claim, row)
+            if claimed is None:
+                continue
+            with self._metrics_lock:
+                self._running[claimed["job_name"]] = self._running.get(claimed["job_name"], 0) + 1
+            task = asyncio.create_task(self._execute(claimed))
+            self._job_tasks.add(task)
+            task.add_done_callback(self._job_tasks.discard)
+
+    async def run_forever(self):
+        while True:
+            try:
+                await self.tick()
+            except Exception as e:
+                print(f"Scheduler tick failed: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+    def start(self):
+        """Start the loop on the running event loop (e.g. from a FastAPI startup hook)."""
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self.run_forever())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+scheduler = JobScheduler()
+
+
+if __name__ == "__main__":
+    # Import through `jobs` so the jobs register on the shared scheduler
+    # instance rather than on this __main__ module's copy
+    from jobs import scheduler as registered
+    print(f"Scheduler running {len(registered.jobs)} jobs, max {registered.max_concurrent} at a time")
+    asyncio.run(registered.run_forever())
@@ -1,18 +1,48 @@
 import os
 import re
-import pandas as pd
-from pdfminer.high_level import extract_text
-from pdf2image import convert_from_path
-import easyocr
-from PIL import Image
+from functools import lru_cache
+
+# The OCR/PDF/CSV stacks (easyocr + torch, pdfminer, pdf2image, pandas) are
+# imported on first use, so API workers that never parse a file don't pay
+# their startup time and memory.
+
+
+# Image preprocessing before OCR. EasyOCR's detection time grows with pixel
+# count, and a 12MP phone photo is far more than needed to read receipt text.
+PREPROCESS_IMAGES = os.getenv("OCR_PREPROCESS", "1") == "1"
+TARGET_TEXT_HEIGHT = 24   # px; EasyOCR reads reliably at ~20-30px line height
+MAX_IMAGE_SIDE = 2000     # fallback cap when line height can't be estimated
+MAX_SKEW_DEGREES = 5
+
+# PDFs: a page with fewer text-layer characters than this is treated as scanned
+PDF_MIN_TEXT_CHARS = 50
+PDF_MAX_PAGES = int(os.getenv("PDF_MAX_PAGES", "20"))
+PDF_OCR_DPI = 300
+
+CURRENCY_SYMBOLS = {"$": "USD", "€": "EUR", "£": "GBP", "₹": "INR"}
+CURRENCY_CODES = ("USD", "EUR", "GBP", "INR", "CAD", "AUD", "JPY", "CHF", "MXN", "SGD")
+_CODE = "|".join(CURRENCY_CODES)
+_SYMBOL = "".join(re.escape(symbol) for symbol in CURRENCY_SYMBOLS)
+TOTAL_PATTERN = re.compile(
+    rf"(?i)(?:total|amount\s+due|balance)[:\s]*(?:([{_SYMBOL}])|\b({_CODE})\b)?\s*([\d,]+\.\d{{2}})(?:\s*({_CODE})\b)?"
+)
+ANY_CURRENCY_PATTERN = re.compile(rf"([{_SYMBOL}])\s*\d|\b({_CODE})\b")
+
+
+@lru_cache(maxsize=1)
+def get_ocr_reader():
+    """The process-wide EasyOCR reader (loading the model takes seconds)."""
+    import easyocr
+    return easyocr.Reader(['en'])
 
 
 def extract_fields(text: str):
-    """Extract vendor, date, total, and description from text using regex."""
+    """Extract vendor, date, total, currency, and description from text using regex."""
     fields = {
         "vendor": None,
         "date": None,
         "total": None,
+        "currency": None,
         "description": None
     }
 
@@ -22,8 +52,8 @@ def extract_fields(text: str):
     # Date extraction
     date_match = re.search(r"(\d{1,2}[/-]\d{1,2}[/-]\d{2,4})", text)
 
-    # Total extraction (supports $, €, £, ₹)
-    total_match = re.search(r"(?i)(?:total|amount\s+due|balance)[:\s\$€£₹]*([\d,]+\.\d{2})", text)
+    # Total extraction with its currency ($, €, £, ₹ or an ISO code before or after)
+    total_match = TOTAL_PATTERN.search(text)
 
     # Description extraction (explicit)
     description_match = re.search(r"(?i)(?:description|item|details)[:\s\-]+(.{5,80})", text)
@@ -43,42 +73,183 @@ def extract_fields(text: str):
     if date_match:
         fields["date"] = date_match.group(1)
     if total_match:
-        fields["total"] = total_match.group(1)
+        symbol, code_before, amount, code_after = total_match.groups()
+        fields["total"] = amount
+        fields["currency"] = CURRENCY_SYMBOLS.get(symbol) or (code_before or code_after or "").upper() or None
+    if not fields["currency"]:
+        # Otherwise the first currency marker anywhere on the receipt
+        currency_match = ANY_CURRENCY_PATTERN.search(text)
+        if currency_match:
+            fields["currency"] = CURRENCY_SYMBOLS.get(currency_match.group(1)) or currency_match.group(2).upper()
     if description_match:
         fields["description"] = description_match.group(1).strip()
 
     return fields
 
 
-def extract_from_image(filepath: str):
+def otsu_threshold(gray):
+    """Global threshold that best separates ink from paper (Otsu's method)."""
+    import numpy as np
+    hist = np.bincount(gray.ravel(), minlength=256).astype(np.float64)
+    levels = np.arange(256)
+    weight_bg = hist.cumsum()
+    weight_fg = weight_bg[-1] - weight_bg
+    sum_bg = (hist * levels).cumsum()
+    mean_bg = sum_bg / np.maximum(weight_bg, 1)
+    mean_fg = (sum_bg[-1] - sum_bg) / np.maximum(weight_fg, 1)
+    between = weight_bg * weight_fg * (mean_bg - mean_fg) ** 2
+    return int(between.argmax())
+
+
+def crop_to_receipt(gray):
+    """Crop to the bright paper region when the receipt sits on a darker background."""
+    bright = gray > otsu_threshold(gray)
+    rows = bright.mean(axis=1)
+    cols = bright.mean(axis=0)
+    row_idx = (rows > rows.max() / 2).nonzero()[0]
+    col_idx = (cols > cols.max() / 2).nonzero()[0]
+    if len(row_idx) == 0 or len(col_idx) == 0:
+        return gray
+
+    top, bottom = row_idx[0], row_idx[-1] + 1
+    left, right = col_idx[0], col_idx[-1] + 1
+    area = (bottom - top) * (right - left) / gray.size
+    # Ignore crops that keep nearly everything or look like noise
+    if area > 0.9 or area < 0.05:
+        return gray
+    return gray[top:bottom, left:right]
+
+
+def estimate_text_height(gray):
+    """Median height in px of text lines, from the horizontal ink profile, or None."""
+    import numpy as np
+    ink_rows = (gray < otsu_threshold(gray)).mean(axis=1) > 0.02
+    # Lengths of consecutive runs of inked rows
+    edges = np.diff(np.concatenate(([0], ink_rows.astype(np.int8), [0])))
+    runs = (edges == -1).nonzero()[0] - (edges == 1).nonzero()[0]
+    runs = runs[runs >= 4]
+    if len(runs) < 3:
+        return None
+    return float(np.median(runs))
+
+
+def estimate_skew(gray):
+    """Rotation (degrees) that makes text lines horizontal, searched by projection profile."""
+    import numpy as np
+    from PIL import Image
+    small = Image.fromarray(gray)
+    small.thumbnail((600, 600))
+    ink = Image.fromarray(np.where(np.asarray(small) < otsu_threshold(np.asarray(small)), 255, 0).astype(np.uint8))
+
+    best_angle, best_score = 0, -1.0
+    for angle in range(-MAX_SKEW_DEGREES, MAX_SKEW_DEGREES + 1):
+        profile = np.asarray(ink.rotate(angle, expand=True)).sum(axis=1, dtype=np.float64)
+        # Aligned lines give sharp peaks and gaps, i.e. a high-variance profile
+        score = profile.var()
+        if score > best_score:
+            best_angle, best_score = angle, score
+    return best_angle
+
+
+def adaptive_binarize(gray, block: int, offset: int = 10):
+    """Black/white image using each pixel's local mean (copes with shadows and uneven light)."""
+    # OpenCV (installed with easyocr) computes the local mean with a running
+    # box filter, without full-size integral images
+    import cv2
+    return cv2.adaptiveThreshold(
+        gray, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY, block, offset,
+    )
+
+
+def preprocess_image(source):
+    """
+    Prepare a photo or scanned page for OCR: fix EXIF orientation, convert to
+    grayscale, crop to the receipt, deskew, downscale so text lines are about
+    TARGET_TEXT_HEIGHT px tall, and binarize.
+    `source` is a file path or PIL image; returns a uint8 NumPy array.
+    """
+    import numpy as np
+    from PIL import Image, ImageOps
+
+    image = Image.open(source) if isinstance(source, str) else source
+    image = ImageOps.exif_transpose(image).convert("L")
+    gray = crop_to_receipt(np.asarray(image))
+
+    # Deskew first so text lines are horizontal when measuring their height
+    image = Image.fromarray(gray)
+    angle = estimate_skew(gray)
+    if angle:
+        image = image.rotate(angle, expand=True, fillcolor=255, resample=Image.BICUBIC)
+
+    # Estimate line height on a 2x-decimated copy; it's only used for a ratio
+    text_height = estimate_text_height(np.asarray(image)[::2, ::2])
+    if text_height:
+        scale = TARGET_TEXT_HEIGHT / (text_height * 2)
+    else:
+        scale = MAX_IMAGE_SIDE / max(image.size)
+    if scale < 1:
+        image = image.resize(
+            (max(1, round(image.width * scale)), max(1, round(image.height * scale))),
+            Image.LANCZOS,
+        )
+
+    return adaptive_binarize(np.asarray(image), block=2 * TARGET_TEXT_HEIGHT + 1)
+
+
+def extract_from_image(filepath: str, preprocess: bool = None):
     """Extract text from image using EasyOCR."""
-    reader = easyocr.Reader(['en'])
-    result = reader.readtext(filepath, detail=0)
+    if preprocess is None:
+        preprocess = PREPROCESS_IMAGES
+    image = preprocess_image(filepath) if preprocess else filepath
+    result = get_ocr_reader().readtext(image, detail=0)
     return "\n".join(result)
 
 
+def pdf_page_text(layout):
+    """Text-layer content of one pdfminer page layout."""
+    from pdfminer.layout import LTTextContainer
+    return "".join(element.get_text() for element in layout if isinstance(element, LTTextContainer))
+
+
+def ocr_pdf_page(filepath: str, page_number: int):
+    """Render a single PDF page (1-based) and OCR it."""
+    import numpy as np
+    from pdf2image import convert_from_path
+
+    pages = convert_from_path(filepath, dpi=PDF_OCR_DPI, first_page=page_number, last_page=page_number)
+    if not pages:
+        return ""
+    # Pages are OCR'd straight from memory rather than via temp PNGs
+    image = preprocess_image(pages[0]) if PREPROCESS_IMAGES else np.asarray(pages[0])
+    return "\n".join(get_ocr_reader().readtext(image, detail=0))
+
+
 def extract_from_pdf(filepath: str):
-    """Extract text from PDF (text-based or scanned)."""
-    # Try text-based first
-    text = extract_text(filepath)
-    if len(text.strip()) > 50:
-        return text
-
-    # Fallback to OCR for scanned PDFs
-    pages = convert_from_path(filepath, dpi=300)
-    reader = easyocr.Reader(['en'])
-    full_text = ""
-    for i, page in enumerate(pages):
-        img_path = f"temp_page_{i}.png"
-        page.save(img_path, "PNG")
-        result = reader.readtext(img_path, detail=0)
-        full_text += "\n".join(result)
-        os.remove(img_path)
-    return full_text
+    """
+    Extract text from PDF (text-based, scanned, or mixed).
+    Pages are streamed one at a time: each uses its text layer when it has
+    one and is rendered for OCR only when it doesn't. Parsing stops as soon
+    as the total and date have been found, or after PDF_MAX_PAGES pages.
+    """
+    from pdfminer.high_level import extract_pages
+
+    texts = []
+    for page_number, layout in enumerate(extract_pages(filepath, maxpages=PDF_MAX_PAGES), start=1):
+        text = pdf_page_text(layout)
+        if len(text.strip()) <= PDF_MIN_TEXT_CHARS:
+            # No usable text layer: scanned page
+            text = ocr_pdf_page(filepath, page_number)
+        texts.append(text)
+
+        fields = extract_fields("\n".join(texts))
+        if fields["total"] and fields["date"]:
+            break
+    return "\n".join(texts)
 
 
 def extract_from_csv(filepath: str):
     """Convert CSV content to readable text."""
+    import pandas as pd
     df = pd.read_csv(filepath)
     return df.to_string(index=False)
 
@@ -92,7 +263,7 @@ def smart_extract(filepath: str):
         text = extract_from_image(filepath)
 
     elif ext == ".pdf":
-        print("📄 PDF detected — auto-selecting method...")
+        print("📄 PDF detected — auto-selecting method per page...")
         text = extract_from_pdf(filepath)
 
     elif ext == ".csv":
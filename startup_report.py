@@ -0,0 +1,54 @@
+"""
+Measure import time and memory of the API and of the heavy parser stacks.
+
+Each target is imported in a fresh interpreter, so the numbers reflect what a
+new uvicorn worker pays. Run from the repo root with the .env in place:
+
+    python startup_report.py
+"""
+import json
+import subprocess
+import sys
+
+TARGETS = [
+    ("API app (main)", "import main"),
+    ("smart_parser", "import smart_parser"),
+    ("OCR reader loaded", "import smart_parser; smart_parser.get_ocr_reader()"),
+    ("easyocr", "import easyocr"),
+    ("pdfminer + pdf2image", "import pdfminer.high_level, pdf2image"),
+    ("pandas", "import pandas"),
+]
+
+PROBE = """
+import json, resource, sys, time
+start = time.perf_counter()
+exec({code!r})
+elapsed = time.perf_counter() - start
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+if sys.platform == "darwin":
+    rss //= 1024  # bytes on macOS, KiB elsewhere
+print(json.dumps({{"seconds": elapsed, "rss_mb": rss / 1024,
+                   "heavy_loaded": [m for m in ("easyocr", "torch", "pdfminer", "pdf2image", "pandas") if m in sys.modules]}}))
+"""
+
+
+def measure(code: str):
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE.format(code=code)],
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        return {"error": result.stderr.strip().splitlines()[-1] if result.stderr else "failed"}
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    print(f"{'Target':<24} {'Import (s)':>10} {'Max RSS (MB)':>13}  Heavy modules loaded")
+    for name, code in TARGETS:
+        stats = measure(code)
+        if "error" in stats:
+            print(f"{name:<24} {'-':>10} {'-':>13}  error: {stats['error']}")
+            continue
+        heavy = ", ".join(stats["heavy_loaded"]) or "none"
+        print(f"{name:<24} {stats['seconds']:>10.2f} {stats['rss_mb']:>13.1f}  {heavy}")
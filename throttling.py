@@ -0,0 +1,310 @@
+"""
+Rate limits and per-tenant fair queuing for the expensive work: OCR (CPU)
+and LLM calls (paid).
+
+Rate limits are token buckets per (resource, company) and per (resource,
+user): a company may start RATE_LIMIT_<RESOURCE>_PER_MINUTE jobs a minute
+(bursting to that many at once) and a single user half of that. Over the
+limit the request gets 429 with Retry-After, before any work is done.
+
+Admitted work then waits for a slot in the resource's FairQueue: a fixed
+number of concurrent slots (the OCR pool size, LLM_CONCURRENCY), granted by
+weighted round-robin across companies, each company's requests in arrival
+order. A tenant uploading hundreds of receipts queues behind itself only;
+a small tenant waits for at most one slot per other busy tenant (weight >1
+gives a company that many grants per turn, via TENANT_WEIGHTS). A company
+with MAX_QUEUED_PER_TENANT requests waiting gets 429; a request that waits
+QUEUE_TIMEOUT_SECONDS gets 503.
+
+Both are per process. Counters for /quotas come from metrics().
+"""
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from fastapi import HTTPException
+
+RATE_LIMITS_PER_MINUTE = {
+    "ocr": int(os.getenv("RATE_LIMIT_OCR_PER_MINUTE", "30")),
+    "llm": int(os.getenv("RATE_LIMIT_LLM_PER_MINUTE", "20")),
+}
+USER_SHARE = 0.5
+MAX_BUCKETS = 10000
+
+OCR_SLOTS = int(os.getenv("OCR_WORKERS", "0")) or int(os.getenv("OCR_CONCURRENCY", "2"))
+LLM_SLOTS = int(os.getenv("LLM_CONCURRENCY", "8"))
+MAX_QUEUED_PER_TENANT = int(os.getenv("MAX_QUEUED_PER_TENANT", "20"))
+QUEUE_TIMEOUT_SECONDS = 120
+QUEUE_FULL_RETRY_SECONDS = 10
+# Recent waits kept per tenant for the latency percentiles in metrics()
+WAIT_SAMPLES = 200
+
+# "company_id=weight,company_id=weight"
+TENANT_WEIGHTS = {
+    tenant.strip(): int(weight)
+    for tenant, _, weight in (
+        item.partition("=") for item in os.getenv("TENANT_WEIGHTS", "").split(",") if "=" in item
+    )
+}
+
+ANONYMOUS = "anonymous"
+
+
+def throttled(status_code: int, detail: str, retry_after: float):
+    return HTTPException(
+        status_code=status_code, detail=detail, headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+    )
+
+
+class TokenBucket:
+    def __init__(self, capacity: float, per_second: float):
+        self.capacity = capacity
+        self.per_second = per_second
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.per_second)
+        self.updated = now
+
+    def wait_time(self, cost: float = 1):
+        """Seconds until `cost` tokens are available (0 if they are now)."""
+        self._refill()
+        return max(0, (cost - self.tokens) / self.per_second)
+
+    def take(self, cost: float = 1):
+        self._refill()
+        self.tokens -= cost
+
+    def level(self):
+        self._refill()
+        return self.tokens
+
+
+class RateLimiter:
+    """Token buckets keyed by (resource, scope, id); idle buckets are dropped LRU beyond MAX_BUCKETS."""
+
+    def __init__(self, limits_per_minute: dict):
+        self.limits = limits_per_minute
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+        self.limited = {}  # (resource, company) -> rejected requests
+
+    def _bucket(self, key, per_minute: float):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(max(per_minute, 1), per_minute / 60)
+            while len(self._buckets) > MAX_BUCKETS:
+                self._buckets.popitem(last=False)
+        self._buckets.move_to_end(key)
+        return bucket
+
+    def check(self, resources, company_id: str = None, user_id: str = None, cost: int = 1):
+        """
+        Take `cost` tokens from the company's (and user's) bucket for each
+        resource (a name or a tuple of names), or raise 429.
+        """
+        resources = (resources,) if isinstance(resources, str) else tuple(resources)
+        company_id = company_id or ANONYMOUS
+        with self._lock:
+            waits = {}
+            buckets = []
+            for resource in resources:
+                per_minute = self.limits[resource]
+                own = [self._bucket((resource, "company", company_id), per_minute)]
+                if user_id:
+                    own.append(self._bucket((resource, "user", user_id), per_minute * USER_SHARE))
+                waits[resource] = max(bucket.wait_time(cost) for bucket in own)
+                buckets.extend(own)
+            # All or nothing: a user over their limit doesn't spend the company's token,
+            # and a request over its LLM limit doesn't spend its OCR token
+            limited = [resource for resource, wait in waits.items() if wait]
+            if limited:
+                for resource in limited:
+                    key = (resource, company_id)
+                    self.limited[key] = self.limited.get(key, 0) + 1
+                raise throttled(
+                    429, f"Too many {' and '.join(limited)} requests, retry later", max(waits.values()),
+                )
+            for bucket in buckets:
+                bucket.take(cost)
+
+    def levels(self, company_id: str):
+        with self._lock:
+            levels = {}
+            for resource, per_minute in self.limits.items():
+                bucket = self._buckets.get((resource, "company", company_id))
+                levels[resource] = {
+                    "limit_per_minute": per_minute,
+                    "remaining": math.floor(bucket.level()) if bucket else max(per_minute, 1),
+                    "rejected": self.limited.get((resource, company_id), 0),
+                }
+            return levels
+
+
+class _Waiter:
+    def __init__(self, tenant: str, grant):
+        self.tenant = tenant
+        self.grant = grant
+        self.granted = False
+        self.enqueued = time.monotonic()
+
+
+class FairQueue:
+    """
+    `slots` concurrent holders, granted weighted round-robin across tenants.
+    Use `async with queue.slot(tenant)` in request handlers (waiting holds no
+    thread) and `with queue.slot_sync(tenant)` in background job threads.
+    """
+
+    def __init__(self, name: str, slots: int, weights: dict = None):
+        self.name = name
+        self.slots = max(1, slots)
+        self.weights = weights or {}
+        self.active = 0
+        self._queues = {}  # tenant -> deque of waiters
+        self._ring = deque()  # tenants with queued work, in turn order
+        self._burst = 0  # grants given to the tenant at the head of the ring this turn
+        self._lock = threading.Lock()
+        self.granted = {}
+        self.waits = {}
+
+    def _enqueue(self, waiter: _Waiter):
+        with self._lock:
+            queue = self._queues.get(waiter.tenant)
+            if queue is None:
+                queue = self._queues[waiter.tenant] = deque()
+                self._ring.append(waiter.tenant)
+            if len(queue) >= MAX_QUEUED_PER_TENANT:
+                raise throttled(429, f"Too many queued {self.name} requests, retry later", QUEUE_FULL_RETRY_SECONDS)
+            queue.append(waiter)
+            self._dispatch()
+
+    def _dispatch(self):
+        """Grant free slots to queued waiters, weighted round-robin (lock held)."""
+        while self.active < self.slots and self._ring:
+            tenant = self._ring[0]
+            queue = self._queues[tenant]
+            waiter = queue.popleft()
+            self._burst += 1
+            if not queue:
+                self._ring.popleft()
+                del self._queues[tenant]
+                self._burst = 0
+            elif self._burst >= self.weights.get(tenant, 1):
+                self._ring.rotate(-1)
+                self._burst = 0
+            self.active += 1
+            waiter.granted = True
+            self.granted[tenant] = self.granted.get(tenant, 0) + 1
+            samples = self.waits.setdefault(tenant, deque(maxlen=WAIT_SAMPLES))
+            samples.append(time.monotonic() - waiter.enqueued)
+            waiter.grant()
+
+    def _withdraw(self, waiter: _Waiter):
+        """Take a waiter that gave up out of the queue. False if it was granted a slot meanwhile."""
+        with self._lock:
+            if waiter.granted:
+                return False
+            queue = self._queues[waiter.tenant]
+            queue.remove(waiter)
+            if not queue:
+                if self._ring[0] == waiter.tenant:
+                    self._burst = 0
+                del self._queues[waiter.tenant]
+                self._ring.remove(waiter.tenant)
+            return True
+
+    def release(self):
+        with self._lock:
+            self.active -= 1
+            self._dispatch()
+
+    def slot(self, tenant: str = None):
+        return _AsyncSlot(self, tenant or ANONYMOUS)
+
+    def slot_sync(self, tenant: str = None):
+        return _SyncSlot(self, tenant or ANONYMOUS)
+
+    def metrics(self, tenant: str = None):
+        with self._lock:
+            tenants = [tenant] if tenant else sorted(set(self.granted) | set(self._queues))
+            per_tenant = {}
+            for t in tenants:
+                samples = sorted(self.waits.get(t, ()))
+                per_tenant[t] = {
+                    "queued": len(self._queues.get(t, ())),
+                    "granted": self.granted.get(t, 0),
+                    "weight": self.weights.get(t, 1),
+                    "wait_p50_ms": round(samples[len(samples) // 2] * 1000, 1) if samples else None,
+                    "wait_p99_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1000, 1) if samples else None,
+                }
+            return {
+                "slots": self.slots,
+                "active": self.active,
+                "queued": sum(len(q) for q in self._queues.values()),
+                "tenants": per_tenant,
+            }
+
+
+class _AsyncSlot:
+    def __init__(self, queue: FairQueue, tenant: str):
+        self.queue = queue
+        self.tenant = tenant
+
+    async def __aenter__(self):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def grant():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+        waiter = _Waiter(self.tenant, grant)
+        self.queue._enqueue(waiter)
+        try:
+            await asyncio.wait_for(future, QUEUE_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            if self.queue._withdraw(waiter):
+                raise throttled(503, f"Timed out waiting for a {self.queue.name} slot", QUEUE_TIMEOUT_SECONDS)
+        except asyncio.CancelledError:
+            # Client went away: give up the place in line, or the slot itself
+            if not self.queue._withdraw(waiter):
+                self.queue.release()
+            raise
+
+    async def __aexit__(self, *exc):
+        self.queue.release()
+
+
+class _SyncSlot:
+    def __init__(self, queue: FairQueue, tenant: str):
+        self.queue = queue
+        self.tenant = tenant
+
+    def __enter__(self):
+        event = threading.Event()
+        waiter = _Waiter(self.tenant, event.set)
+        self.queue._enqueue(waiter)
+        if not event.wait(QUEUE_TIMEOUT_SECONDS) and self.queue._withdraw(waiter):
+            raise throttled(503, f"Timed out waiting for a {self.queue.name} slot", QUEUE_TIMEOUT_SECONDS)
+
+    def __exit__(self, *exc):
+        self.queue.release()
+
+
+limiter = RateLimiter(RATE_LIMITS_PER_MINUTE)
+ocr_queue = FairQueue("ocr", OCR_SLOTS, TENANT_WEIGHTS)
+llm_queue = FairQueue("llm", LLM_SLOTS, TENANT_WEIGHTS)
+
+
+def metrics(company_id: str = None):
+    data = {
+        "ocr": ocr_queue.metrics(company_id),
+        "llm": llm_queue.metrics(company_id),
+    }
+    if company_id:
+        data["rate_limits"] = limiter.levels(company_id)
+    return data